@@ -1,6 +1,36 @@
+import os
 import json
-import google.generativeai as genai
-from database import get_all_products_for_prompt
+import asyncio
+import logging
+from database import get_catalog_snapshot
+from result_cache import make_cache_key, normalize_email
+from model_client import generate_content_async
+from metrics import time_stage, PROMPT_CHARS, PROMPT_TOKENS, RESPONSE_CHARS, EXTRACTION_PATHS
+from agents.rule_extractor import RuleBasedExtractor
+from email_preprocessing import EmailPreprocessor, remove_quoted_reply
+from token_budget import PromptBudget, PROMPT_TOKEN_BUDGETS, estimate_tokens, drop_indentation, truncate_to_tokens
+from logging_config import Payload, should_log_payload
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the extraction prompt template changes so cached results are not reused
+EXTRACTION_PROMPT_VERSION = "2"
+
+# "full" sends the whole catalog as pretty-printed JSON (previous behaviour).
+# "pruned" sends only the top-k products relevant to the email as a compact table.
+EXTRACTION_CATALOG_MODE = os.environ.get("EXTRACTION_CATALOG_MODE", "pruned")
+EXTRACTION_CATALOG_TOP_K = int(os.environ.get("EXTRACTION_CATALOG_TOP_K", "20"))
+
+# "rules" tries the deterministic extractor for structured order emails before calling
+# Gemini; "off" always calls Gemini
+EXTRACTION_FAST_PATH = os.environ.get("EXTRACTION_FAST_PATH", "rules")
+
+# "on" normalizes emails before extraction (HTML to text, quoted replies, signatures,
+# disclaimers and whitespace removed); "off" passes them through verbatim
+EMAIL_PREPROCESSING = os.environ.get("EMAIL_PREPROCESSING", "on")
+
+# Smallest catalog excerpt the token budget compaction shrinks the prompt to
+EXTRACTION_CATALOG_MIN_K = int(os.environ.get("EXTRACTION_CATALOG_MIN_K", "5"))
 
 class ExtractionAgent:
     """
@@ -8,21 +38,47 @@ class ExtractionAgent:
     Uses AI to extract order details from unstructured email content.
     Returns raw JSON data that will be validated by Agent 2.
     """
-    
-    def __init__(self, model):
+
+    def __init__(self, model, catalog_mode=None, top_k=None, result_cache=None, fast_path=None, token_budget=None, preprocessing=None):
         self.model = model
-    
-    def create_prompt(self, email_content, catalog):
+        self.result_cache = result_cache
+        self.catalog_mode = catalog_mode or EXTRACTION_CATALOG_MODE
+        self.top_k = top_k or EXTRACTION_CATALOG_TOP_K
+        self.token_budget = token_budget or PROMPT_TOKEN_BUDGETS["extraction"]
+        self.fast_path = fast_path or EXTRACTION_FAST_PATH
+        self.rule_extractor = RuleBasedExtractor() if self.fast_path == "rules" else None
+        self.preprocessor = EmailPreprocessor() if (preprocessing or EMAIL_PREPROCESSING) == "on" else None
+
+    def select_catalog(self, email_content, snapshot):
         """
-        Creates the prompt for the AI to extract order details.
+        Returns the SKUs of the catalog snapshot to include in the prompt, or None for the
+        whole catalog. In pruned mode only the top-k products retrieved for the email are kept.
         """
-        catalog_str = json.dumps(catalog, indent=2)
-        
-        return f"""
+        if self.catalog_mode == "full":
+            return None
+        return snapshot.index.rank_for_text(email_content, self.top_k)
+
+    def format_catalog(self, catalog, skus=None, catalog_mode=None):
+        """
+        Serializes the selected part of a Catalog for the prompt from its pre-rendered text.
+        Returns a tuple of (code fence language, catalog text).
+        """
+        if (catalog_mode or self.catalog_mode) == "full":
+            return "json", catalog.json_text()
+        return "text", catalog.render_table(skus)
+
+    def create_prompt(self, email_content, catalog, skus=None, catalog_mode=None, compact=False):
+        """
+        Creates the prompt for the AI to extract order details, including the given SKUs of
+        the catalog (default: all of them). compact=True drops the indentation.
+        """
+        catalog_format, catalog_str = self.format_catalog(catalog, skus, catalog_mode)
+
+        prompt = f"""
         You are an expert order processing assistant. Your task is to extract order details from an unstructured email and generate a structured JSON output.
 
         **Product Catalog for Reference:**
-        ```json
+        ```{catalog_format}
         {catalog_str}
         ```
 
@@ -52,40 +108,207 @@ class ExtractionAgent:
         }}
         ```
 
-        **Important:** 
+        **Important:**
         - Extract the product names as mentioned in the email (e.g., "desk TRÄNHOLM 19", "black hoodies")
         - Do not validate against the catalog - just extract what the customer mentioned
         - Focus on identifying what they want, not whether it's available or valid
         - If a SKU is mentioned, include it in the item_description but use the product name for product_name_mentioned
         """
-    
-    def extract_details(self, email_content):
+        return drop_indentation(prompt) if compact else prompt
+
+    def build_prompt(self, email_content, snapshot, metadata=None):
+        """
+        Builds the extraction prompt within the stage token budget. While the prompt is over
+        budget it is compacted step by step: the catalog excerpt is shrunk (halving the
+        number of products down to EXTRACTION_CATALOG_MIN_K), then the indentation is
+        dropped, then quoted reply history is removed from the email and, as a last resort,
+        the email is truncated. Token accounting is recorded under metadata["tokens"].
+
+        Returns:
+            tuple: (prompt, SKUs included or None for the whole catalog, catalog mode used)
+        """
+        catalog = snapshot.products
+        budget = PromptBudget("extraction", self.token_budget)
+        catalog_mode = self.catalog_mode
+        skus = self.select_catalog(email_content, snapshot)
+        compact = False
+
+        def render():
+            return self.create_prompt(email_content, catalog, skus, catalog_mode, compact)
+
+        prompt = render()
+        if not budget.fits(prompt):
+            # Level 1: shrink the catalog excerpt
+            top_k = len(catalog) if skus is None else len(skus)
+            while not budget.fits(prompt) and top_k > EXTRACTION_CATALOG_MIN_K:
+                top_k = max(top_k // 2, EXTRACTION_CATALOG_MIN_K)
+                catalog_mode = "pruned"
+                previous_count = None if skus is None else len(skus)
+                skus = snapshot.index.rank_for_text(email_content, top_k)
+                prompt = render()
+                if len(skus) != previous_count:
+                    budget.compacted(1, f"catalog_top_{len(skus)}")
+        if not budget.fits(prompt):
+            # Level 2: drop indentation
+            compact = True
+            prompt = render()
+            budget.compacted(2, "drop_indentation")
+        if not budget.fits(prompt):
+            # Level 3: remove quoted history, then truncate the email to what is left
+            email_content = remove_quoted_reply(email_content).strip()
+            prompt = render()
+            budget.compacted(3, "remove_quoted_reply")
+            if not budget.fits(prompt):
+                available = budget.budget - (estimate_tokens(prompt) - estimate_tokens(email_content))
+                email_content = truncate_to_tokens(email_content, available)
+                prompt = render()
+                budget.compacted(3, "truncate_email")
+
+        budget.record(prompt, {
+            "catalog": estimate_tokens(self.format_catalog(catalog, skus, catalog_mode)[1]),
+            "email": estimate_tokens(email_content)
+        }, metadata)
+        return prompt, skus, catalog_mode
+
+    def prepare_extraction(self, email_content, metadata=None, snapshot=None):
+        """
+        Everything that happens before the Gemini call: email pre-processing, catalog lookup,
+        rule-based fast path, result cache lookup and prompt construction. Uses the given
+        CatalogSnapshot or the current one. metadata["extraction_path"] records "rules",
+        "cache" or "llm"; metadata["preprocessing"] the bytes removed from the email.
+
+        Returns:
+            tuple: (cache_key, extraction data or None, prompt or None when no Gemini call is needed)
+        """
+        if should_log_payload(logger):
+            logger.debug("Processing email content: %s", Payload(email_content))
+
+        # Strip markup, quoted history, signatures and footers that never hold order lines
+        if self.preprocessor is not None:
+            with time_stage("email_preprocessing"):
+                email_content, preprocessing = self.preprocessor.process(email_content)
+            logger.debug("Pre-processing removed %d of %d bytes", preprocessing["bytes_removed"], preprocessing["input_bytes"])
+            if metadata is not None:
+                metadata["preprocessing"] = preprocessing
+
+        # Fetch product catalog for context (served from the in-process cache)
+        if snapshot is None:
+            snapshot = get_catalog_snapshot()
+        product_catalog = snapshot.products
+
+        # Structured order emails are extracted deterministically without calling Gemini
+        if self.rule_extractor is not None:
+            with time_stage("rule_extraction"):
+                rule_extraction = self.rule_extractor.extract(email_content, snapshot)
+            if rule_extraction is not None:
+                logger.debug("Extracted %d items with rules", len(rule_extraction["items"]))
+                self.record_path("rules", metadata)
+                return None, rule_extraction, None
+
+        # Identical emails against the same catalog contents and prompt template reuse the cached result
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = make_cache_key(
+                "extraction", EXTRACTION_PROMPT_VERSION, snapshot.products.digest(),
+                self.catalog_mode, self.top_k, self.token_budget, normalize_email(email_content)
+            )
+            cached_extraction = self.result_cache.get(cache_key)
+            if metadata is not None:
+                metadata.setdefault("cache", {})["extraction"] = "hit" if cached_extraction is not None else "miss"
+            if cached_extraction is not None:
+                logger.debug("Served from result cache")
+                self.record_path("cache", metadata)
+                return cache_key, cached_extraction, None
+
+        with time_stage("prompt_build"):
+            prompt, prompt_skus, catalog_mode = self.build_prompt(email_content, snapshot, metadata)
+        prompt_products = len(product_catalog) if prompt_skus is None else len(prompt_skus)
+        logger.debug("Using %d of %d products for context (%s mode)", prompt_products, len(product_catalog), catalog_mode)
+
+        # Compare the prompt size against what the full JSON catalog would have cost
+        prompt_tokens = estimate_tokens(prompt)
+        if catalog_mode == "full":
+            full_prompt_tokens = prompt_tokens
+        else:
+            catalog_tokens = estimate_tokens(self.format_catalog(product_catalog, prompt_skus, catalog_mode)[1])
+            full_prompt_tokens = prompt_tokens - catalog_tokens + estimate_tokens(product_catalog.json_text())
+        logger.info("Prompt tokens (estimated): %d (%s), full catalog: %d", prompt_tokens, catalog_mode, full_prompt_tokens)
+        PROMPT_CHARS.inc(len(prompt), "extraction")
+        PROMPT_TOKENS.inc(prompt_tokens, "extraction")
+        self.record_path("llm", metadata)
+
+        if metadata is not None:
+            metadata["extraction"] = {
+                "catalog_mode": catalog_mode,
+                "catalog_products": prompt_products,
+                "prompt_tokens": prompt_tokens,
+                "full_prompt_tokens": full_prompt_tokens
+            }
+
+        return cache_key, None, prompt
+
+    def record_path(self, path, metadata=None):
+        """
+        Records which path served the extraction in the metadata and the path counter.
+        """
+        EXTRACTION_PATHS.inc(1, path)
+        if metadata is not None:
+            metadata["extraction_path"] = path
+
+    def parse_response(self, response_text, cache_key=None):
+        """
+        Cleans and parses the Gemini response, storing the result in the result cache.
+        """
+        RESPONSE_CHARS.inc(len(response_text), "extraction")
+        with time_stage("json_parse"):
+            cleaned_response = response_text.strip().replace("```json", "").replace("```", "")
+            raw_extraction_data = json.loads(cleaned_response)
+        if should_log_payload(logger):
+            logger.debug("Raw AI response: %s", Payload(cleaned_response))
+
+        if cache_key is not None:
+            self.result_cache.set(cache_key, raw_extraction_data)
+
+        return raw_extraction_data
+
+    def extract_details(self, email_content, metadata=None, snapshot=None):
         """
         Main extraction function that processes email content and returns raw JSON data.
         """
         try:
-            print(f"🔍 EXTRACTION AGENT: Processing email content: {email_content[:200]}...")
-            
-            # Fetch product catalog for context
-            product_catalog = get_all_products_for_prompt()
-            print(f"🔍 EXTRACTION AGENT: Fetched {len(product_catalog)} products for context")
-            
-            # Create prompt
-            prompt = self.create_prompt(email_content, product_catalog)
-            
+            cache_key, cached_extraction, prompt = self.prepare_extraction(email_content, metadata, snapshot)
+            if cached_extraction is not None:
+                return cached_extraction
+
             # Get AI response
-            print("🔍 EXTRACTION AGENT: Calling Gemini AI...")
-            response = self.model.generate_content(prompt)
-            
-            # Clean and parse response
-            cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-            print(f"🔍 EXTRACTION AGENT: Raw AI response: {cleaned_response}")
-            
-            raw_extraction_data = json.loads(cleaned_response)
-            print(f"🔍 EXTRACTION AGENT: Parsed extraction data: {raw_extraction_data}")
-            
-            return raw_extraction_data
-            
+            logger.debug("Calling Gemini AI...")
+            with time_stage("gemini_extraction"):
+                response = self.model.generate_content(prompt)
+
+            return self.parse_response(response.text, cache_key)
+
+        except Exception as e:
+            logger.error("Extraction failed: %s", e)
+            raise Exception(f"Extraction failed: {str(e)}")
+
+    async def extract_details_async(self, email_content, metadata=None, snapshot=None):
+        """
+        Async variant of extract_details; awaits the Gemini call instead of blocking a thread.
+        Pre-processing, rule extraction, result cache access and prompt building run on the
+        default thread executor so the event loop is never blocked.
+        """
+        try:
+            cache_key, cached_extraction, prompt = await asyncio.to_thread(self.prepare_extraction, email_content, metadata, snapshot)
+            if cached_extraction is not None:
+                return cached_extraction
+
+            # Get AI response
+            logger.debug("Calling Gemini AI (async)...")
+            with time_stage("gemini_extraction"):
+                response = await generate_content_async(self.model, prompt)
+
+            return await asyncio.to_thread(self.parse_response, response.text, cache_key)
+
         except Exception as e:
-            print(f"❌ EXTRACTION AGENT: Extraction failed: {e}")
-            raise Exception(f"Extraction failed: {str(e)}") 
\ No newline at end of file
+            logger.error("Extraction failed: %s", e)
+            raise Exception(f"Extraction failed: {str(e)}")
@@ -1,23 +1,137 @@
+import os
 import json
-import google.generativeai as genai
+import asyncio
+from database import get_cached_products
+from result_cache import make_cache_key
+from model_client import generate_content_async
+from metrics import PROMPT_CHARS, PROMPT_TOKENS, RESPONSE_CHARS
+from token_budget import PromptBudget, PROMPT_TOKEN_BUDGETS, estimate_tokens, drop_indentation
+
+# Longest customer note, delivery preference or issue text kept once the token budget
+# forces the most aggressive compaction
+RESPONSE_MAX_FIELD_CHARS = int(os.environ.get("RESPONSE_MAX_FIELD_CHARS", "400"))
+
+# Bump whenever the response prompt template changes so cached results are not reused
+RESPONSE_PROMPT_VERSION = "2"
+
+# When to skip the Gemini call and render a deterministic reply instead:
+# "off" always uses Gemini, "clean" only for orders without issues,
+# "known_issues" also for orders whose issues are all in TEMPLATED_ISSUE_TYPES.
+# Orders with customer notes always go to Gemini.
+RESPONSE_FAST_PATH = os.environ.get("RESPONSE_FAST_PATH", "known_issues")
+TEMPLATED_ISSUE_TYPES = {"MOQ_NOT_MET", "INSUFFICIENT_INVENTORY"}
+
+def format_price(amount):
+    """
+    Formats a price for customer-facing text.
+    """
+    return f"${amount:,.2f}"
 
 class ResponseAgent:
     """
     Agent 3: Response Agent
     Generates customer-friendly responses based on validated order data.
     """
-    
-    def __init__(self, model):
+
+    def __init__(self, model, result_cache=None, fast_path=None, token_budget=None):
         self.model = model
-    
-    def create_prompt(self, validated_order):
+        self.result_cache = result_cache
+        self.fast_path = fast_path or RESPONSE_FAST_PATH
+        self.token_budget = token_budget or PROMPT_TOKEN_BUDGETS["response"]
+
+    def can_use_template(self, validated_order):
+        """
+        Decides whether the reply can be rendered from the template under the fast-path policy.
+        Free-form customer notes and unresolved items (unknown products, validation errors)
+        always need Gemini.
+        """
+        if self.fast_path not in ("clean", "known_issues"):
+            return False
+        if str(validated_order.get("customer_notes") or "").strip():
+            return False
+
+        issue_types = {issue.get("issue_type") for issue in validated_order.get("issues", [])}
+        if self.fast_path == "clean":
+            return not issue_types
+        return issue_types <= TEMPLATED_ISSUE_TYPES
+
+    def render_template_response(self, validated_order):
+        """
+        Renders a deterministic customer email for orders that need no free-form reasoning.
+        """
+        validated_items = validated_order.get("validated_items", [])
+        issues = validated_order.get("issues", [])
+        delivery_preference = str(validated_order.get("delivery_preference") or "").strip().rstrip(".")
+
+        paragraphs = ["Dear Customer,"]
+
+        if validated_items:
+            lines = ["Thank you for your order. We are pleased to confirm the following items:"]
+            order_total = 0.0
+            for item in validated_items:
+                try:
+                    line_total = float(item["quantity"]) * float(item["price"])
+                    order_total += line_total
+                    lines.append(f"- {item['name']} (SKU {item['sku']}): {item['quantity']} x {format_price(float(item['price']))} = {format_price(line_total)}")
+                except (TypeError, ValueError):
+                    lines.append(f"- {item['name']} (SKU {item['sku']}): {item['quantity']}")
+            lines.append(f"Order total: {format_price(order_total)}")
+            paragraphs.append("\n".join(lines))
+        else:
+            paragraphs.append("Thank you for your order request. Unfortunately, we are not able to confirm any of the requested items as submitted yet.")
+
+        if issues:
+            lines = ["We need your help with the following items before we can include them:"]
+            for issue in issues:
+                lines.append(f"- {issue['item_mentioned']}: {issue['message']}. {issue['suggestion']}.")
+            lines.append("Please let us know if you would like to adjust these quantities and we will update your order right away.")
+            paragraphs.append("\n".join(lines))
+
+        if delivery_preference:
+            paragraphs.append(f"We have noted your delivery preference: {delivery_preference}.")
+
+        if validated_items:
+            paragraphs.append("Next steps: please reply to confirm the order and we will send you the order confirmation and payment details.")
+        else:
+            paragraphs.append("Next steps: please reply with the updated quantities and we will send you the order confirmation and payment details.")
+
+        paragraphs.append("Best regards,\nCustomer Service Team")
+        return "\n\n".join(paragraphs)
+
+    def template_response(self, validated_order, metadata=None):
+        """
+        Returns the structured templated response when the fast path applies, otherwise None.
+        Records which path produced the reply under metadata["response_path"].
+        """
+        use_template = self.can_use_template(validated_order)
+        if metadata is not None:
+            metadata["response_path"] = "template" if use_template else "llm"
+        if not use_template:
+            return None
+        return {
+            "email_response": self.render_template_response(validated_order),
+            "order_summary": self.build_order_summary(validated_order)
+        }
+
+    def format_validated_data(self, validated_order, compact=False):
+        """
+        Serializes the validated items and issues for the prompt; compact=True drops the
+        JSON indentation.
+        """
+        indent = None if compact else 2
+        return (
+            json.dumps(validated_order.get("validated_items", []), indent=indent),
+            json.dumps(validated_order.get("issues", []), indent=indent)
+        )
+
+    def create_prompt(self, validated_order, compact=False):
         """
         Creates the prompt for generating a customer response.
+        compact=True drops the indentation of the instructions and the order data.
         """
-        validated_items_str = json.dumps(validated_order.get("validated_items", []), indent=2)
-        issues_str = json.dumps(validated_order.get("issues", []), indent=2)
-        
-        return f"""
+        validated_items_str, issues_str = self.format_validated_data(validated_order, compact)
+
+        prompt = f"""
         You are a professional customer service representative. Generate a friendly, helpful response to a customer's order request based on the validated order data.
 
         **Validated Order Data:**
@@ -42,34 +156,181 @@ class ResponseAgent:
         **Length:** 2-4 paragraphs
         **Format:** Plain text email response
         """
-    
-    def generate_customer_response(self, validated_order):
+        return drop_indentation(prompt) if compact else prompt
+
+    def build_prompt(self, validated_order, metadata=None):
+        """
+        Builds the response prompt within the stage token budget. While it is over budget
+        the indentation is dropped (level 1), then free-text fields (customer notes,
+        delivery preference, issue messages and suggestions) are truncated to
+        RESPONSE_MAX_FIELD_CHARS (level 2). Token accounting is recorded under
+        metadata["tokens"]["response"].
+        """
+        budget = PromptBudget("response", self.token_budget)
+        prompt = self.create_prompt(validated_order)
+        if not budget.fits(prompt):
+            prompt = self.create_prompt(validated_order, compact=True)
+            budget.compacted(1, "drop_indentation")
+        if not budget.fits(prompt):
+            validated_order = self.truncate_free_text(validated_order)
+            prompt = self.create_prompt(validated_order, compact=True)
+            budget.compacted(2, "truncate_free_text")
+
+        validated_items_str, issues_str = self.format_validated_data(validated_order, budget.level > 0)
+        budget.record(prompt, {
+            "validated_data": estimate_tokens(validated_items_str) + estimate_tokens(issues_str) + estimate_tokens(
+                str(validated_order.get("delivery_preference", "")) + str(validated_order.get("customer_notes", ""))
+            )
+        }, metadata)
+        PROMPT_CHARS.inc(len(prompt), "response")
+        PROMPT_TOKENS.inc(estimate_tokens(prompt), "response")
+        return prompt
+
+    def truncate_free_text(self, validated_order):
+        """
+        Returns a copy of the validated order with long free-text fields cut to
+        RESPONSE_MAX_FIELD_CHARS characters.
+        """
+        def cut(value):
+            value = str(value or "")
+            return value if len(value) <= RESPONSE_MAX_FIELD_CHARS else value[:RESPONSE_MAX_FIELD_CHARS].rstrip() + "..."
+
+        truncated = dict(validated_order)
+        truncated["customer_notes"] = cut(validated_order.get("customer_notes"))
+        truncated["delivery_preference"] = cut(validated_order.get("delivery_preference"))
+        truncated["issues"] = [
+            dict(issue, message=cut(issue.get("message")), suggestion=cut(issue.get("suggestion")))
+            for issue in validated_order.get("issues", [])
+        ]
+        return truncated
+
+    def build_order_summary(self, validated_order):
+        """
+        Builds the order summary returned alongside the email response.
+        """
+        return {
+            "validated_items": validated_order.get("validated_items", []),
+            "issues": validated_order.get("issues", []),
+            "delivery_preference": validated_order.get("delivery_preference", ""),
+            "customer_notes": validated_order.get("customer_notes", "")
+        }
+
+    def prepare_response(self, validated_order, metadata=None, snapshot=None):
+        """
+        Builds the order summary and looks up the result cache.
+
+        Returns:
+            tuple: (order_summary, cache_key, cached email response or None)
+        """
+        order_summary = self.build_order_summary(validated_order)
+
+        # The same validated order against the same catalog, template and token budget reuses the cached email
+        cache_key = None
+        cached_email = None
+        if self.result_cache is not None:
+            catalog = snapshot.products if snapshot is not None else get_cached_products()
+            cache_key = make_cache_key("response", RESPONSE_PROMPT_VERSION, catalog.digest(), self.token_budget, order_summary)
+            cached_email = self.result_cache.get(cache_key)
+            if metadata is not None:
+                metadata.setdefault("cache", {})["response"] = "hit" if cached_email is not None else "miss"
+
+        return order_summary, cache_key, cached_email
+
+    def finish_response(self, order_summary, email_response, cache_key=None):
+        """
+        Stores the generated email in the result cache and builds the structured response.
+        """
+        RESPONSE_CHARS.inc(len(email_response), "response")
+        if cache_key is not None:
+            self.result_cache.set(cache_key, email_response)
+
+        return {
+            "email_response": email_response,
+            "order_summary": order_summary
+        }
+
+    def generate_customer_response(self, validated_order, metadata=None, snapshot=None):
         """
         Generates a customer-friendly response based on validated order data.
-        
+
         Args:
             validated_order (dict): Validated order data from Agent 2
-            
+            metadata (dict, optional): Per-request metadata; receives the cache outcome
+            snapshot (CatalogSnapshot, optional): Catalog snapshot pinned for this order
+
         Returns:
             dict: Response with email content and order summary
         """
         try:
-            # Create prompt
-            prompt = self.create_prompt(validated_order)
-            
+            templated = self.template_response(validated_order, metadata)
+            if templated is not None:
+                return templated
+
+            order_summary, cache_key, cached_email = self.prepare_response(validated_order, metadata, snapshot)
+            if cached_email is not None:
+                return {"email_response": cached_email, "order_summary": order_summary}
+
+            # Create prompt within the token budget
+            prompt = self.build_prompt(validated_order, metadata)
+
             # Get AI response
             response = self.model.generate_content(prompt)
-            
+
             # Return structured response
-            return {
-                "email_response": response.text.strip(),
-                "order_summary": {
-                    "validated_items": validated_order.get("validated_items", []),
-                    "issues": validated_order.get("issues", []),
-                    "delivery_preference": validated_order.get("delivery_preference", ""),
-                    "customer_notes": validated_order.get("customer_notes", "")
-                }
-            }
-            
+            return self.finish_response(order_summary, response.text.strip(), cache_key)
+
+        except Exception as e:
+            raise Exception(f"Response generation failed: {str(e)}")
+
+    async def generate_customer_response_async(self, validated_order, metadata=None, snapshot=None):
+        """
+        Async variant of generate_customer_response; awaits the Gemini call instead of blocking a thread.
+        Result cache access runs on the default thread executor so the event loop is never blocked.
+        """
+        try:
+            templated = self.template_response(validated_order, metadata)
+            if templated is not None:
+                return templated
+
+            order_summary, cache_key, cached_email = await asyncio.to_thread(self.prepare_response, validated_order, metadata, snapshot)
+            if cached_email is not None:
+                return {"email_response": cached_email, "order_summary": order_summary}
+
+            prompt = self.build_prompt(validated_order, metadata)
+            response = await generate_content_async(self.model, prompt)
+
+            return await asyncio.to_thread(self.finish_response, order_summary, response.text.strip(), cache_key)
+
+        except Exception as e:
+            raise Exception(f"Response generation failed: {str(e)}")
+
+    def stream_customer_response(self, validated_order, metadata=None, snapshot=None):
+        """
+        Streams the customer email as Gemini produces it.
+        Yields text chunks; a cached email is yielded as a single chunk. The complete
+        email is stored in the result cache once the stream finishes.
+        """
+        try:
+            templated = self.template_response(validated_order, metadata)
+            if templated is not None:
+                yield templated["email_response"]
+                return
+
+            order_summary, cache_key, cached_email = self.prepare_response(validated_order, metadata, snapshot)
+            if cached_email is not None:
+                yield cached_email
+                return
+
+            prompt = self.build_prompt(validated_order, metadata)
+
+            chunks = []
+            for chunk in self.model.generate_content(prompt, stream=True):
+                text = chunk.text
+                if text:
+                    chunks.append(text)
+                    yield text
+
+            self.finish_response(order_summary, "".join(chunks).strip(), cache_key)
+
         except Exception as e:
-            raise Exception(f"Response generation failed: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Response generation failed: {str(e)}")
@@ -0,0 +1,192 @@
+import re
+import threading
+from catalog_index import normalize_text
+
+SKU_PATTERN = re.compile(r"\b[A-Za-z]{2,5}-\d{2,6}\b")
+SEGMENT_SEPARATOR = re.compile(r"[,;\n]|\s+and\s+|\s+&\s+", re.IGNORECASE)
+BULLET_PREFIX = re.compile(r"^\s*(?:[-*•>]+|\d+[.)](?=\s))\s*")
+QUANTITY_TOKEN = re.compile(r"^(?:x)?(\d+)(?:x|pcs|pc|units?|ea)?$")
+
+# A bare greeting with at most three addressee words ("Hi team,", "Dear Mr. Smith,");
+# "Hello, can you deliver this by Friday?" is not a greeting line
+GREETING_LINE = re.compile(
+    r"^(?i:hi|hello|hey|dear|good (?:morning|afternoon|evening)|greetings)"
+    r"(?:,?\s+(?:(?i:all|team|there|everyone|folks|sir|madam)|(?:Mr|Mrs|Ms|Dr)\.?|[A-Z][\w'-]*)){0,3}\s*[,.!]*$"
+)
+CLOSING_LINE = re.compile(
+    r"^(?:(?:many |thanks? )?thanks?(?: you)?(?: (?:a lot|in advance|so much))?|(?:best|kind|warm|many)? ?regards|best|cheers|sincerely|yours (?:sincerely|truly|faithfully))[\s,.!]*$",
+    re.IGNORECASE
+)
+ORDER_INTRO = (
+    r"(?:(?:please|kindly|could you|can you|would you)\s+)?"
+    r"(?:(?:we|i)(?:'d| would)?\s+(?:like to|want to|need to|wish to)\s+)?"
+    r"(?:(?:we|i)\s+(?:need|want|would like|'d like)\s*|place an order for|order|send|ship|supply|purchase|buy|reorder)"
+    r"(?:\s+(?:us|me|the following(?: items)?|these items|the items below))?"
+)
+INTRO_LINE = re.compile(
+    rf"^(?:{ORDER_INTRO}|(?:new |purchase )?order(?: details)?|items)\s*(?:please)?\s*[:.!]?$", re.IGNORECASE
+)
+INTRO_PREFIX = re.compile(rf"^{ORDER_INTRO}\s*:?\s+", re.IGNORECASE)
+
+# Parts of signature lines after the closing, which may be separated by "|" or "•":
+# a name, title or company (up to six letters-only words in title case, e.g. "Head of
+# Purchasing", "Meyer Office Supplies GmbH"), a phone number of at least seven digits,
+# an email address or a URL
+SIGNATURE_NAME = re.compile(
+    r"^[A-Z][^\W\d_]*(?:[.'&-][^\W\d_]*)*"
+    r"(?:\s+(?:[A-Z][^\W\d_]*(?:[.'&-][^\W\d_]*)*|of|and|for|the|&|-|–)){0,5}\.?$"
+)
+SIGNATURE_CONTACT = re.compile(
+    r"^(?:(?:(?i:tel|phone|mobile|mob|cell|fax|[tmpf])\.?:?\s*)?(?=(?:\D*\d){7})\+?\d[\d\s()./-]{5,}"
+    r"|(?:(?i:e-?mail)\.?:?\s*)?[\w.+-]+@[\w-]+(?:\.[\w-]+)+"
+    r"|(?:https?://|www\.)\S+)$"
+)
+# Words that make a title-case line an instruction rather than a name ("Also Need Chairs",
+# "Please Deliver To Gate B"); matched against the lowercased text
+ORDER_CUE = re.compile(
+    r"\b(?:need|needs|please|pls|add|send|order|want|deliver|ship|also|include|require|bring|get|make|asap|urgent)\b"
+)
+SIGNATURE_SEPARATOR = re.compile(r"\s*[|•]\s*")
+
+# Words that may surround a quantity without changing its meaning, e.g. "qty 12", "12 units of"
+QUANTITY_FILLER = frozenset({
+    "x", "qty", "quantity", "quantities", "unit", "units", "pc", "pcs", "piece", "pieces",
+    "ea", "each", "of", "please", "the", "nos"
+})
+
+class RuleBasedExtractor:
+    """
+    Deterministic extraction for structured order emails such as "DSK-0004 x 12, DSK-0002 x 3".
+    Recognizes catalog SKUs, exact product names and quantity patterns, and only returns a
+    result when every line of the email is accounted for (bare greeting, order intro,
+    order items, or a closing followed only by a signature); anything else, such as
+    delivery instructions or questions, falls back to Gemini. The result has the same structure as the LLM extraction.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"attempts": 0, "hits": 0}
+
+    def extract(self, email_content, snapshot):
+        """
+        Returns the extraction dictionary, or None when the email is not fully covered.
+        """
+        result = self._extract(email_content, snapshot.index)
+        with self._lock:
+            self._stats["attempts"] += 1
+            if result is not None:
+                self._stats["hits"] += 1
+        return result
+
+    def stats(self):
+        """
+        Returns attempt/hit counters and the fraction of emails served without Gemini.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["attempts"], 4) if stats["attempts"] else 0.0
+        return stats
+
+    def _extract(self, email_content, index):
+        items = []
+        lines = str(email_content).splitlines()
+        for number, line in enumerate(lines):
+            line = line.strip()
+            if not line or GREETING_LINE.match(line) or INTRO_LINE.match(line):
+                continue
+            if CLOSING_LINE.match(line):
+                # Only a closing followed by nothing but the signature ends the email;
+                # anything else after it (a P.S., delivery instructions) needs Gemini
+                if not all(is_signature_line(rest) for rest in lines[number + 1:]):
+                    return None
+                break
+
+            line = INTRO_PREFIX.sub("", BULLET_PREFIX.sub("", line))
+            for segment in SEGMENT_SEPARATOR.split(line):
+                segment = segment.strip(" \t.!")
+                if not segment:
+                    continue
+                item = self.parse_segment(segment, index)
+                if item is None:
+                    return None
+                items.append(item)
+
+        if not items:
+            return None
+        return {"items": items, "delivery_preference": "", "customer_notes": ""}
+
+    def parse_segment(self, segment, index):
+        """
+        Parses one order line like "DSK-0004 x 12" or "12 units of Desk TRÄNHOLM 19" into an
+        item, or returns None when it is not exactly one product and one quantity.
+        """
+        skus = SKU_PATTERN.findall(segment)
+        if skus:
+            if len(skus) != 1:
+                return None
+            product = index.get_by_sku(skus[0])
+            if product is None:
+                return None
+            quantity = parse_quantity(normalize_text(segment.replace(skus[0], " ")).split())
+        else:
+            product, quantity = self.match_name(normalize_text(segment).split(), index)
+
+        if product is None or not quantity:
+            return None
+        return {
+            "product_name_mentioned": product["name"],
+            "quantity_mentioned": quantity,
+            "item_description": segment
+        }
+
+    def match_name(self, tokens, index):
+        """
+        Finds the single longest token span that is an exact catalog product name and
+        parses the remaining tokens as the quantity.
+        """
+        best = None
+        for start in range(len(tokens)):
+            for end in range(min(len(tokens), start + index.max_name_tokens), start, -1):
+                product = index.get_by_name(" ".join(tokens[start:end]))
+                if product is None:
+                    continue
+                if best is None or end - start > best[1] - best[0]:
+                    best = (start, end, product)
+                elif end - start == best[1] - best[0] and product["sku"] != best[2]["sku"]:
+                    return None, None
+                break
+
+        if best is None:
+            return None, None
+        start, end, product = best
+        return product, parse_quantity(tokens[:start] + tokens[end:])
+
+def is_signature_line(line):
+    """
+    Returns True for an empty line or one that looks like part of a signature: a name,
+    title or company without order verbs or quantities, a phone number, an email address
+    or a URL (see SIGNATURE_NAME and SIGNATURE_CONTACT).
+    """
+    line = line.strip().rstrip(",")
+    return not line or all(is_signature_part(part) for part in SIGNATURE_SEPARATOR.split(line) if part)
+
+def is_signature_part(part):
+    if SIGNATURE_CONTACT.match(part):
+        return True
+    return SIGNATURE_NAME.match(part) is not None and not ORDER_CUE.search(part.lower())
+
+def parse_quantity(tokens):
+    """
+    Returns the quantity when the tokens are exactly one number plus filler words
+    ("x", "qty", "units of", ...), otherwise None.
+    """
+    quantity = None
+    for token in tokens:
+        match = QUANTITY_TOKEN.match(token)
+        if match:
+            if quantity is not None:
+                return None
+            quantity = int(match.group(1))
+        elif token not in QUANTITY_FILLER:
+            return None
+    return quantity
@@ -1,27 +1,47 @@
-from database import get_product_by_name, get_all_products_for_prompt
+import os
+import asyncio
+import logging
+from itertools import islice
+from database import PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN, get_catalog_snapshot, get_products_by_names
+from reservations import reserve_inventory
+from metrics import VALIDATION_ISSUES
+from logging_config import Payload, should_log_payload
+
+logger = logging.getLogger(__name__)
+
+# "index" resolves items against the in-memory product index built from the cached catalog.
+# "database" resolves all items of an order against PostgreSQL in a single query.
+VALIDATION_MODE = os.environ.get("VALIDATION_MODE", "index")
+# "on" atomically reserves stock for the validated items of every order (see reservations.py)
+INVENTORY_RESERVATION = os.environ.get("INVENTORY_RESERVATION", "off")
 
 class ValidationAgent:
     """
     Agent 2: Database Validation Bridge
     Non-AI, logic-driven component that validates extracted data against the database.
-    Queries Supabase PostgreSQL for each item and applies business logic.
+    Resolves all items of an order in one step (in-memory product index or a single
+    batched database query) and then applies business logic over the resolved set.
     """
-    
-    def __init__(self):
-        pass
-    
-    def validate_order(self, raw_extraction_data):
+
+    def __init__(self, mode=None, reserve=None):
+        self.mode = mode or VALIDATION_MODE
+        self.reserve = (INVENTORY_RESERVATION == "on") if reserve is None else reserve
+
+    def validate_order(self, raw_extraction_data, metadata=None, snapshot=None):
         """
         Main validation function that takes raw extraction data and validates against database.
-        
+
         Args:
             raw_extraction_data (dict): Raw JSON from Agent 1 containing items, delivery_preference, customer_notes
-            
+            metadata (dict, optional): Per-request metadata; receives the validation mode and query count
+            snapshot (CatalogSnapshot, optional): Catalog snapshot pinned for this order
+
         Returns:
             dict: Validated order with validated_items and issues
         """
-        print(f"🔍 VALIDATION AGENT: Starting validation with data: {raw_extraction_data}")
-        
+        if should_log_payload(logger):
+            logger.debug("Starting validation with data: %s", Payload(raw_extraction_data))
+
         # Initialize output structure
         validated_order = {
             "validated_items": [],
@@ -29,91 +49,188 @@ class ValidationAgent:
             "delivery_preference": raw_extraction_data.get("delivery_preference", ""),
             "customer_notes": raw_extraction_data.get("customer_notes", "")
         }
-        
+
         # Get items from raw extraction data
         items = raw_extraction_data.get("items", [])
-        print(f"🔍 VALIDATION AGENT: Processing {len(items)} items")
-        
-        # Debug: Get all available products to see what's in the database
+        logger.debug("Processing %d items in '%s' mode", len(items), self.mode)
+
         try:
-            all_products = get_all_products_for_prompt()
-            print(f"🔍 VALIDATION AGENT: Available products in database: {list(all_products.keys())[:10]}... (total: {len(all_products)})")
+            if snapshot is None:
+                snapshot = get_catalog_snapshot()
+            all_products = snapshot.products
         except Exception as e:
-            print(f"❌ VALIDATION AGENT: Error fetching all products: {e}")
+            logger.error("Error fetching all products: %s", e)
             all_products = {}
-        
-        # Core validation loop
-        for i, item in enumerate(items):
-            print(f"🔍 VALIDATION AGENT: Processing item {i+1}: {item}")
-            
+
+        # Resolve every item in one step, then apply the business rules in a single pass
+        resolved_products, query_count = self.resolve_items(items, snapshot)
+
+        for item, resolved in zip(items, resolved_products):
+            self.apply_rules(item, resolved, all_products, validated_order)
+
+        if self.reserve:
+            self.reserve_items(validated_order, metadata)
+
+        if metadata is not None:
+            metadata["validation"] = {"mode": self.mode, "db_queries": query_count}
+        for issue in validated_order["issues"]:
+            VALIDATION_ISSUES.inc(1, issue["issue_type"])
+
+        logger.debug("Validation complete. Validated: %d, Issues: %d, DB queries: %d",
+                     len(validated_order["validated_items"]), len(validated_order["issues"]), query_count)
+        return validated_order
+
+    async def validate_order_async(self, raw_extraction_data, metadata=None, snapshot=None):
+        """
+        Async variant of validate_order. Catalog, index and psycopg2 work runs on the default
+        thread executor so the event loop is never blocked on the database.
+        """
+        return await asyncio.to_thread(self.validate_order, raw_extraction_data, metadata, snapshot)
+
+    def resolve_items(self, items, snapshot=None):
+        """
+        Resolves the products for all items of an order, against the snapshot's product
+        index or, in database mode, with a single batched query.
+
+        Returns:
+            tuple: (list aligned with items holding a product dict, None or the Exception
+            raised while resolving that item; number of database queries issued)
+        """
+        product_names = [item.get("product_name_mentioned", "") for item in items]
+
+        if self.mode == "database":
+            if not product_names:
+                return [], 0
+            try:
+                return get_products_by_names(product_names), 1
+            except Exception as e:
+                logger.error("Batched product lookup failed: %s", e)
+                return [e] * len(items), 1
+
+        resolved_products = []
+        for product_name in product_names:
             try:
-                # Extract data from the item
-                product_name_mentioned = item.get("product_name_mentioned", "")
-                quantity_mentioned = item.get("quantity_mentioned", 0)
-                item_description = item.get("item_description", "")
-                
-                print(f"🔍 VALIDATION AGENT: Looking for product name '{product_name_mentioned}' with quantity {quantity_mentioned}")
-                
-                # Query the database for this item by name
-                product_data = get_product_by_name(product_name_mentioned)
-                
-                if product_data is None:
-                    print(f"❌ VALIDATION AGENT: Product '{product_name_mentioned}' NOT FOUND in database")
-                    # Product does not exist
-                    validated_order["issues"].append({
-                        "item_mentioned": product_name_mentioned,
-                        "issue_type": "PRODUCT_NOT_FOUND",
-                        "message": f"Product '{product_name_mentioned}' does not exist in our catalog",
-                        "suggestion": f"Available products: {', '.join([p['name'] for p in list(all_products.values())[:3]])}...",
-                        "item_description": item_description
-                    })
-                    
-                else:
-                    print(f"✅ VALIDATION AGENT: Product '{product_name_mentioned}' FOUND: {product_data}")
-                    # Product exists - check business rules
-                    if quantity_mentioned < product_data['min_order_qty']:
-                        print(f"⚠️ VALIDATION AGENT: MOQ not met for {product_data['sku']}")
-                        # Minimum order quantity not met
-                        validated_order["issues"].append({
-                            "item_mentioned": product_name_mentioned,
-                            "issue_type": "MOQ_NOT_MET",
-                            "message": f"Requested quantity ({quantity_mentioned}) is below minimum order quantity ({product_data['min_order_qty']})",
-                            "suggestion": f"Minimum order quantity for {product_data['name']} is {product_data['min_order_qty']}",
-                            "item_description": item_description
-                        })
-                        
-                    elif quantity_mentioned > product_data['inventory']:
-                        print(f"⚠️ VALIDATION AGENT: Insufficient inventory for {product_data['sku']}")
-                        # Insufficient inventory
-                        validated_order["issues"].append({
-                            "item_mentioned": product_name_mentioned,
-                            "issue_type": "INSUFFICIENT_INVENTORY",
-                            "message": f"Requested quantity ({quantity_mentioned}) exceeds available inventory ({product_data['inventory']})",
-                            "suggestion": f"Maximum available quantity for {product_data['name']} is {product_data['inventory']}",
-                            "item_description": item_description
-                        })
-                        
-                    else:
-                        print(f"✅ VALIDATION AGENT: Item {product_data['sku']} is VALID")
-                        # Item is fully valid
-                        validated_order["validated_items"].append({
-                            "sku": product_data['sku'],
-                            "name": product_data['name'],
-                            "quantity": quantity_mentioned,
-                            "price": product_data['price'],
-                            "item_description": item_description
-                        })
-                        
+                product_data, match_score = snapshot.index.best_match(product_name, PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN)
+                logger.debug("Resolved '%s' -> %s (score: %s)", product_name, product_data["sku"] if product_data else None, match_score)
+                resolved_products.append(product_data)
             except Exception as e:
-                print(f"❌ VALIDATION AGENT: Error validating item '{item.get('product_name_mentioned', 'Unknown')}': {e}")
-                # Database error during validation
+                resolved_products.append(e)
+        return resolved_products, 0
+
+    def reserve_items(self, validated_order, metadata=None):
+        """
+        Reserves stock for all validated items in one transaction. The snapshot check in
+        apply_rules can be stale, so items the database can no longer cover are moved to
+        the issues as INSUFFICIENT_INVENTORY and the remaining items are reserved again.
+        The outcome is recorded under metadata["reservation"].
+        """
+        attempts = 0
+        reservation_info = {"status": "none"}
+        while validated_order["validated_items"]:
+            items = validated_order["validated_items"]
+            attempts += 1
+            try:
+                reservation, shortages = reserve_inventory([(item["sku"], item["quantity"]) for item in items])
+            except Exception as e:
+                logger.error("Inventory reservation failed: %s", e)
+                reservation_info = {"status": "failed", "error": str(e)}
+                break
+
+            if reservation is not None:
+                reservation_info = {
+                    "status": "held",
+                    "reservation_id": reservation["reservation_id"],
+                    "expires_at": reservation["expires_at"]
+                }
+                break
+
+            logger.debug("Reservation rejected, short SKUs: %s", shortages)
+            remaining_items = []
+            for item in items:
+                if item["sku"] not in shortages:
+                    remaining_items.append(item)
+                    continue
+                available = shortages[item["sku"]]
                 validated_order["issues"].append({
-                    "item_mentioned": item.get("product_name_mentioned", "Unknown"),
-                    "issue_type": "VALIDATION_ERROR",
-                    "message": f"Error validating item: {str(e)}",
-                    "suggestion": "Please try again or contact support",
+                    "item_mentioned": item["name"],
+                    "issue_type": "INSUFFICIENT_INVENTORY",
+                    "message": f"Requested quantity ({item['quantity']}) exceeds available inventory ({available})",
+                    "suggestion": f"Maximum available quantity for {item['name']} is {available}",
                     "item_description": item.get("item_description", "")
                 })
-        
-        print(f"🔍 VALIDATION AGENT: Validation complete. Validated: {len(validated_order['validated_items'])}, Issues: {len(validated_order['issues'])}")
-        return validated_order 
\ No newline at end of file
+            validated_order["validated_items"] = remaining_items
+
+        if metadata is not None:
+            reservation_info["attempts"] = attempts
+            metadata["reservation"] = reservation_info
+
+    def apply_rules(self, item, resolved, all_products, validated_order):
+        """
+        Applies the existence, MOQ and inventory rules to a single resolved item and
+        appends the outcome to validated_order.
+        """
+        try:
+            if isinstance(resolved, Exception):
+                raise resolved
+
+            # Extract data from the item
+            product_name_mentioned = item.get("product_name_mentioned", "")
+            quantity_mentioned = item.get("quantity_mentioned", 0)
+            item_description = item.get("item_description", "")
+            product_data = resolved
+
+            if product_data is None:
+                logger.debug("Product '%s' not found in catalog", product_name_mentioned)
+                # Product does not exist
+                validated_order["issues"].append({
+                    "item_mentioned": product_name_mentioned,
+                    "issue_type": "PRODUCT_NOT_FOUND",
+                    "message": f"Product '{product_name_mentioned}' does not exist in our catalog",
+                    "suggestion": f"Available products: {', '.join(p['name'] for p in islice(all_products.values(), 3))}...",
+                    "item_description": item_description
+                })
+
+            # Product exists - check business rules
+            elif quantity_mentioned < product_data['min_order_qty']:
+                logger.debug("MOQ not met for %s", product_data["sku"])
+                # Minimum order quantity not met
+                validated_order["issues"].append({
+                    "item_mentioned": product_name_mentioned,
+                    "issue_type": "MOQ_NOT_MET",
+                    "message": f"Requested quantity ({quantity_mentioned}) is below minimum order quantity ({product_data['min_order_qty']})",
+                    "suggestion": f"Minimum order quantity for {product_data['name']} is {product_data['min_order_qty']}",
+                    "item_description": item_description
+                })
+
+            elif quantity_mentioned > product_data['inventory']:
+                logger.debug("Insufficient inventory for %s", product_data["sku"])
+                # Insufficient inventory
+                validated_order["issues"].append({
+                    "item_mentioned": product_name_mentioned,
+                    "issue_type": "INSUFFICIENT_INVENTORY",
+                    "message": f"Requested quantity ({quantity_mentioned}) exceeds available inventory ({product_data['inventory']})",
+                    "suggestion": f"Maximum available quantity for {product_data['name']} is {product_data['inventory']}",
+                    "item_description": item_description
+                })
+
+            else:
+                logger.debug("Item %s is valid", product_data["sku"])
+                # Item is fully valid
+                validated_order["validated_items"].append({
+                    "sku": product_data['sku'],
+                    "name": product_data['name'],
+                    "quantity": quantity_mentioned,
+                    "price": product_data['price'],
+                    "item_description": item_description
+                })
+
+        except Exception as e:
+            logger.warning("Error validating item '%s': %s", item.get("product_name_mentioned", "Unknown"), e)
+            # Database error during validation
+            validated_order["issues"].append({
+                "item_mentioned": item.get("product_name_mentioned", "Unknown"),
+                "issue_type": "VALIDATION_ERROR",
+                "message": f"Error validating item: {str(e)}",
+                "suggestion": "Please try again or contact support",
+                "item_description": item.get("item_description", "")
+            })
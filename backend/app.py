@@ -1,60 +1,210 @@
 import os
+import gc
 import json
+import time
+import logging
 import google.generativeai as genai
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
-from database import initialize_connection_pool, close_connection_pool
+from database import initialize_connection_pool, close_connection_pool, get_cached_products, get_catalog_snapshot, get_catalog_cache_stats, get_connection_pool_stats, start_catalog_change_listener, PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN
 from agents.extraction_agent import ExtractionAgent
 from agents.validation_agent import ValidationAgent
 from agents.response_agent import ResponseAgent
+from result_cache import get_result_cache
+from model_client import ResilientModel, CircuitBreaker, GEMINI_BREAKER_FAILURE_THRESHOLD, GEMINI_BREAKER_RESET_SECONDS
+from pipeline import OrderPipeline
+from coalescing import get_request_coalescer, IdempotencyKeyConflict
+from job_queue import start_job_queue, recover_interrupted_jobs, JobQueueFull
+from reservations import start_reservation_reaper, get_reservation, commit_reservation, release_reservation
+from metrics import registry
+from logging_config import configure_logging, get_dropped_log_records
 
 # Load environment variables from .env file
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # --- Application Setup ---
 app = Flask(__name__)
 # Enable Cross-Origin Resource Sharing (CORS) for our frontend
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 
+# Maximum number of emails accepted by the batch endpoint
+BATCH_MAX_EMAILS = int(os.environ.get("BATCH_MAX_EMAILS", "500"))
+
 # Global variables for agents and model
 model = None
+model_breaker = None
 extraction_agent = None
 validation_agent = None
 response_agent = None
+result_cache = None
+pipeline = None
+request_coalescer = None
+job_queue = None
+# Cold-start timings of this process in seconds, reported under "startup" in /api/health
+startup_stats = {}
 
-def initialize_agents():
+def initialize_agents(generative_model=None, recover_jobs=True):
     """
     Initialize all agents and the Gemini model.
+    A stand-in model (e.g. benchmarks.fakes.FakeGenerativeModel) can be passed instead.
+    recover_jobs=False leaves requeueing interrupted jobs to the server's master process.
     """
-    global model, extraction_agent, validation_agent, response_agent
+    global model, model_breaker, extraction_agent, validation_agent, response_agent, result_cache, pipeline, request_coalescer, job_queue
     
     try:
-        # Configure Gemini API
-        api_key = os.environ["GEMINI_API_KEY"]
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        if generative_model is not None:
+            model = generative_model
+        else:
+            # Configure Gemini API
+            api_key = os.environ["GEMINI_API_KEY"]
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel("gemini-1.5-flash")
+        
+        # Both stages call the same upstream, so they share one circuit breaker
+        model_breaker = CircuitBreaker(GEMINI_BREAKER_FAILURE_THRESHOLD, GEMINI_BREAKER_RESET_SECONDS)
         
         # Initialize agents
-        extraction_agent = ExtractionAgent(model)
+        result_cache = get_result_cache()
+        extraction_agent = ExtractionAgent(ResilientModel(model, "extraction", model_breaker), result_cache=result_cache)
         validation_agent = ValidationAgent()
-        response_agent = ResponseAgent(model)
+        response_agent = ResponseAgent(ResilientModel(model, "response", model_breaker), result_cache=result_cache)
+        pipeline = OrderPipeline(extraction_agent, validation_agent, response_agent)
+        request_coalescer = get_request_coalescer()
+        job_queue = start_job_queue(lambda email_content: pipeline.run(email_content), recover=recover_jobs)
+        if validation_agent.reserve:
+            start_reservation_reaper()
         
-        print("All agents initialized successfully")
+        logger.info("All agents initialized successfully")
         
     except KeyError:
-        print("ERROR: GEMINI_API_KEY not found in .env file.")
+        logger.critical("GEMINI_API_KEY not found in .env file.")
         exit()
     except Exception as e:
-        print(f"ERROR initializing agents: {e}")
+        logger.critical("Error initializing agents: %s", e)
         exit()
 
+def preload_shared_state():
+    """
+    Loads the state worker processes share after fork(): the catalog snapshot with its
+    name index and pre-rendered prompt fragments. The connection pool used for loading is
+    closed again so no database socket is inherited, and the loaded objects are moved out
+    of the collected generations (gc.freeze()) so garbage collection in the workers does
+    not write to, and thereby copy, their pages.
+    """
+    started_at = time.perf_counter()
+    initialize_connection_pool()
+    try:
+        get_cached_products()
+    finally:
+        close_connection_pool()
+    recover_interrupted_jobs()
+    gc.freeze()
+    startup_stats["preload_seconds"] = round(time.perf_counter() - started_at, 3)
+    logger.info("Preloaded shared state in %.3fs", startup_stats["preload_seconds"])
+
+def initialize_worker(recover_jobs=True):
+    """
+    Per-process initialization: opens this process's connection pool, starts the catalog
+    change listener and initializes the agents, result cache and job queue workers.
+    Must run after fork(), since sockets and threads are not fork-safe.
+    """
+    started_at = time.perf_counter()
+    logger.info("Initializing database connection pool...")
+    initialize_connection_pool()
+    start_catalog_change_listener()
+    logger.info("Initializing agents...")
+    initialize_agents(recover_jobs=recover_jobs)
+    startup_stats["worker_init_seconds"] = round(time.perf_counter() - started_at, 3)
+
+def warm_up():
+    """
+    Initializes what the first real request would otherwise pay for lazily, before the
+    process reports ready: the catalog snapshot with its name index, the index's n-gram
+    lookups, the catalog rendering for the extraction prompt, and both prompt templates
+    plus the response template, all for a synthetic "<SKU> x <MOQ>" order of the first
+    catalog product. The components are called directly instead of running the order
+    through the pipeline, so warmup writes nothing to the result cache, reserves no stock
+    and leaves the fast-extractor statistics and request metrics untouched.
+    """
+    started_at = time.perf_counter()
+    try:
+        snapshot = get_catalog_snapshot()
+        product = next(iter(snapshot.products.values()), None)
+        if product is None:
+            logger.warning("Skipping warmup: the catalog is empty")
+            return
+        email_content = f"Please send:\n{product.sku} x {product.min_order_qty}\n\nThanks,"
+        snapshot.index.best_match(product.name, PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN)
+        skus = extraction_agent.select_catalog(email_content, snapshot)
+        extraction_agent.create_prompt(email_content, snapshot.products, skus)
+
+        validated_order = {
+            "validated_items": [{
+                "sku": product.sku, "name": product.name, "quantity": product.min_order_qty,
+                "price": product.price, "item_description": f"{product.sku} x {product.min_order_qty}"
+            }],
+            "issues": [],
+            "delivery_preference": "",
+            "customer_notes": ""
+        }
+        response_agent.render_template_response(validated_order)
+        response_agent.create_prompt(validated_order)
+    except Exception as e:
+        logger.warning("Warmup failed: %s", e)
+    startup_stats["warmup_seconds"] = round(time.perf_counter() - started_at, 3)
+
+def create_app():
+    """
+    Application factory for WSGI servers without preloading, e.g.
+    gunicorn "app:create_app()". Initializes this process, warms it up and
+    returns the Flask application. server.py preloads shared state in the master
+    process instead and initializes each worker after fork().
+    Every worker runs this, including recycled ones, so none of them recovers running
+    jobs at startup; jobs of a dead worker are requeued by the job queue heartbeats of
+    the others once their lease expires.
+    """
+    started_at = time.perf_counter()
+    initialize_worker(recover_jobs=False)
+    warm_up()
+    startup_stats["cold_start_seconds"] = round(time.perf_counter() - started_at, 3)
+    logger.info("Application ready in %.3fs", startup_stats["cold_start_seconds"])
+    return app
+
+def get_fast_extractor_stats():
+    """
+    Returns the rule-based extractor's attempt/hit counters, or None when it is disabled.
+    """
+    if extraction_agent is None or extraction_agent.rule_extractor is None:
+        return None
+    return extraction_agent.rule_extractor.stats()
+
+def get_email_preprocessing_stats():
+    """
+    Returns the email pre-processing byte counters, or None when it is disabled.
+    """
+    if extraction_agent is None or extraction_agent.preprocessor is None:
+        return None
+    return extraction_agent.preprocessor.stats()
+
+def get_idempotency_key(data, headers):
+    """
+    Returns the client-supplied idempotency key from the Idempotency-Key header or the
+    "idempotency_key" body field, or None.
+    """
+    key = headers.get("Idempotency-Key") or data.get("idempotency_key")
+    return str(key) if key else None
+
 # --- API Endpoint ---
 @app.route("/api/extract-order", methods=["POST"])
 def extract_order_details():
     """
     Main API endpoint that orchestrates the three-agent pipeline:
     Email Text -> [Agent 1: Extractor] -> Raw JSON -> [Agent 2: DB Validator] -> Validated Order -> [Agent 3: Response Agent] -> Final Response
+    With ?mode=job the email is queued instead and 202 is returned with a job id to poll
+    at GET /api/jobs/<job_id>.
     """
     try:
         data = request.get_json()
@@ -64,50 +214,210 @@ def extract_order_details():
         
         email_content = data["email_content"]
         
-        # Step 1: Agent 1 - Extract raw order details
-        print("Step 1: Agent 1 (Extractor) processing...")
-        raw_extraction_data = extraction_agent.extract_details(email_content)
-        print(f"Agent 1 completed. Extracted {len(raw_extraction_data.get('items', []))} items")
-        
-        # Step 2: Agent 2 - Database validation
-        print("Step 2: Agent 2 (DB Validator) processing...")
-        validated_order = validation_agent.validate_order(raw_extraction_data)
-        print(f"Agent 2 completed. Validated: {len(validated_order.get('validated_items', []))} items, Issues: {len(validated_order.get('issues', []))}")
+        if request.args.get("mode") == "job":
+            return enqueue_order(email_content)
         
-        # Step 3: Agent 3 - Generate customer response
-        print("Step 3: Agent 3 (Response Agent) processing...")
-        final_response = response_agent.generate_customer_response(validated_order)
-        print("Agent 3 completed. Response generated.")
+        # Run the three agents; per-request metadata is returned under "metadata".
+        # Identical requests already in flight share one execution.
+        if request_coalescer is not None:
+            final_response = request_coalescer.run(
+                email_content, lambda: pipeline.run(email_content), get_idempotency_key(data, request.headers)
+            )
+        else:
+            final_response = pipeline.run(email_content)
         
         # Return the complete response
         return jsonify(final_response), 200
         
+    except IdempotencyKeyConflict as conflict:
+        return jsonify({"error": str(conflict)}), 409
+        
     except json.JSONDecodeError as json_error:
         return jsonify({"error": "Invalid JSON response from AI model", "details": str(json_error)}), 500
         
     except Exception as e:
+        logger.error("Order processing failed: %s", e)
         return jsonify({"error": "Failed to process request", "details": str(e)}), 500
 
+def enqueue_order(email_content):
+    """
+    Queues an email for the pipeline workers and returns 202 with the job id.
+    """
+    if job_queue is None:
+        return jsonify({"error": "Job mode is disabled (set JOB_QUEUE_DB_PATH to enable it)"}), 400
+    try:
+        job_id = job_queue.submit(email_content)
+    except JobQueueFull as full:
+        return jsonify({"error": str(full)}), 503
+    response = jsonify({"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"})
+    response.headers["Location"] = f"/api/jobs/{job_id}"
+    return response, 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_details(job_id):
+    """
+    Returns a queued job's status (queued, running, done, failed) and, once finished,
+    its pipeline result or error.
+    """
+    if job_queue is None:
+        return jsonify({"error": "Job mode is disabled (set JOB_QUEUE_DB_PATH to enable it)"}), 404
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route("/api/extract-order/stream", methods=["POST"])
+def extract_order_details_stream():
+    """
+    Streaming variant of /api/extract-order using Server-Sent Events.
+    Sends the order summary as soon as validation completes, then the customer email
+    token by token, then a final "done" event with metadata (including time to first byte).
+    """
+    data = request.get_json(silent=True)
+
+    if not data or "email_content" not in data:
+        return jsonify({"error": "Missing 'email_content' in request"}), 400
+
+    email_content = data["email_content"]
+
+    def generate():
+        try:
+            for event, payload in pipeline.run_streaming(email_content):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            error = {"error": "Failed to process request", "details": str(e)}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/extract-orders", methods=["POST"])
+def extract_orders_batch():
+    """
+    Batch endpoint: runs a list of emails through the three-agent pipeline with bounded
+    concurrency and streams one JSON line per email as each completes.
+
+    Request body: {"emails": ["...", {"id": "...", "email_content": "..."}, ...]}
+    Each line: {"index": i, "id": ..., "status": "ok" | "error", "result" | "error": ...}
+    """
+    data = request.get_json(silent=True)
+
+    if not data or not isinstance(data.get("emails"), list):
+        return jsonify({"error": "Missing 'emails' list in request"}), 400
+
+    emails = data["emails"]
+    if len(emails) > BATCH_MAX_EMAILS:
+        return jsonify({"error": f"Batch too large: {len(emails)} emails (maximum {BATCH_MAX_EMAILS})"}), 400
+
+    # Accept plain strings or objects carrying an optional client id
+    entries = []
+    invalid = []
+    for index, entry in enumerate(emails):
+        if isinstance(entry, str):
+            entries.append((index, None, entry))
+        elif isinstance(entry, dict) and isinstance(entry.get("email_content"), str):
+            entries.append((index, entry.get("id"), entry["email_content"]))
+        else:
+            invalid.append({"index": index, "id": entry.get("id") if isinstance(entry, dict) else None,
+                            "status": "error", "error": "Missing 'email_content' in batch entry"})
+
+    def generate():
+        for line in invalid:
+            yield json.dumps(line) + "\n"
+        for outcome in pipeline.run_batch([email_content for _, _, email_content in entries]):
+            index, client_id, _ = entries[outcome["index"]]
+            outcome["index"] = index
+            outcome["id"] = client_id
+            yield json.dumps(outcome) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/api/reservations/<reservation_id>", methods=["GET"])
+def reservation_details(reservation_id):
+    """
+    Returns a reservation with its status, expiry and reserved quantities per SKU.
+    """
+    try:
+        reservation = get_reservation(reservation_id)
+    except Exception as e:
+        return jsonify({"error": "Failed to fetch reservation", "details": str(e)}), 500
+    if reservation is None:
+        return jsonify({"error": "Reservation not found"}), 404
+    return jsonify(reservation), 200
+
+@app.route("/api/reservations/<reservation_id>/<action>", methods=["POST"])
+def finish_reservation(reservation_id, action):
+    """
+    Commits (keeps the stock deducted) or releases (returns the stock) a held reservation.
+    """
+    handlers = {"commit": commit_reservation, "release": release_reservation}
+    if action not in handlers:
+        return jsonify({"error": f"Unknown reservation action '{action}'"}), 404
+
+    try:
+        if handlers[action](reservation_id):
+            return jsonify(get_reservation(reservation_id)), 200
+        reservation = get_reservation(reservation_id)
+    except Exception as e:
+        return jsonify({"error": f"Failed to {action} reservation", "details": str(e)}), 500
+
+    if reservation is None:
+        return jsonify({"error": "Reservation not found"}), 404
+    return jsonify({"error": f"Reservation is already {reservation['status']}"}), 409
+
 @app.route("/api/health", methods=["GET"])
 def health_check():
     """
     Health check endpoint to verify the application is running.
     """
-    return jsonify({"status": "healthy", "message": "Three-agent pipeline is operational"}), 200
+    return jsonify({
+        "status": "healthy",
+        "message": "Three-agent pipeline is operational",
+        "catalog_cache": get_catalog_cache_stats(),
+        "result_cache": result_cache.stats() if result_cache else None,
+        "connection_pool": get_connection_pool_stats(),
+        "fast_extractor": get_fast_extractor_stats(),
+        "email_preprocessing": get_email_preprocessing_stats(),
+        "request_coalescing": request_coalescer.stats() if request_coalescer else None,
+        "job_queue": job_queue.stats() if job_queue else None,
+        "gemini_breaker": model_breaker.stats() if model_breaker else None,
+        "startup": startup_stats
+    }), 200
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """
+    Prometheus text format metrics: per-stage latency histograms (with p50/p95/p99
+    estimates), prompt/response sizes, DB query counts, issue counts by issue_type,
+    plus catalog cache, result cache and connection pool gauges.
+    """
+    body = registry.render(gauges={
+        "catalog_cache": get_catalog_cache_stats(),
+        "result_cache": result_cache.stats() if result_cache else None,
+        "db_pool": get_connection_pool_stats(),
+        "fast_extractor": get_fast_extractor_stats(),
+        "email_preprocessing": get_email_preprocessing_stats(),
+        "request_coalescing": request_coalescer.stats() if request_coalescer else None,
+        "job_queue": job_queue.stats() if job_queue else None,
+        "gemini_breaker": model_breaker.stats() if model_breaker else None,
+        "startup": startup_stats,
+        "logging": {"dropped_records": get_dropped_log_records()}
+    })
+    return Response(body, mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
-    # Initialize database connection pool
-    print("Initializing database connection pool...")
-    initialize_connection_pool()
-    
-    # Initialize agents
-    print("Initializing agents...")
-    initialize_agents()
+    # Development server; see server.py for the multi-process production server
+    create_app()
     
     # Start the Flask application
-    print("Starting Flask application...")
+    logger.info("Starting Flask application...")
     app.run(debug=True, port=5001)
     
     # Cleanup on shutdown
-    print("Shutting down...")
-    close_connection_pool()
\ No newline at end of file
+    logger.info("Shutting down...")
+    if job_queue is not None:
+        job_queue.stop(timeout=5)
+    close_connection_pool()
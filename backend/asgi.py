@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+ASGI entry point for the asyncio execution path of the three-agent pipeline.
+Each order is a coroutine instead of a blocked worker thread, so a single process can
+hold hundreds of in-flight orders while they wait on Gemini.
+
+Run with:
+    uvicorn asgi:app --port 5001
+
+The Flask application in app.py keeps serving the synchronous path for comparison.
+"""
+
+import json
+import asyncio
+import logging
+import app as backend
+from database import close_connection_pool, get_catalog_cache_stats, get_connection_pool_stats
+from metrics import registry
+from coalescing import IdempotencyKeyConflict
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the Flask CORS configuration
+ALLOWED_ORIGIN = "http://localhost:3000"
+MAX_BODY_BYTES = 1024 * 1024
+
+async def read_body(receive):
+    """
+    Reads the full request body from the ASGI receive channel.
+    """
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        if not message.get("more_body", False):
+            return body
+
+async def send_json(send, status, payload):
+    """
+    Sends a JSON response with CORS headers.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", ALLOWED_ORIGIN.encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def handle_lifespan(receive, send):
+    """
+    Initializes the connection pool and agents and warms them up on startup, and
+    closes the pool on shutdown.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.to_thread(backend.initialize_worker)
+                # Warm the catalog cache, index and prompts so no request loads them on the event loop
+                await asyncio.to_thread(backend.warm_up)
+                await send({"type": "lifespan.startup.complete"})
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+        elif message["type"] == "lifespan.shutdown":
+            logger.info("Shutting down...")
+            if backend.job_queue is not None:
+                await asyncio.to_thread(backend.job_queue.stop, 5)
+            close_connection_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+def get_header(scope, name):
+    """
+    Returns the value of a request header (name in lower case), or None.
+    """
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+async def extract_order_details(scope, receive, send):
+    """
+    Async counterpart of POST /api/extract-order.
+    """
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict) or "email_content" not in data:
+        await send_json(send, 400, {"error": "Missing 'email_content' in request"})
+        return
+
+    email_content = data["email_content"]
+    try:
+        if backend.request_coalescer is not None:
+            idempotency_key = get_header(scope, b"idempotency-key") or data.get("idempotency_key")
+            final_response = await backend.request_coalescer.run_async(
+                email_content, lambda: backend.pipeline.run_async(email_content),
+                str(idempotency_key) if idempotency_key else None
+            )
+        else:
+            final_response = await backend.pipeline.run_async(email_content)
+        await send_json(send, 200, final_response)
+    except IdempotencyKeyConflict as conflict:
+        await send_json(send, 409, {"error": str(conflict)})
+    except Exception as e:
+        await send_json(send, 500, {"error": "Failed to process request", "details": str(e)})
+
+async def app(scope, receive, send):
+    """
+    Minimal ASGI application exposing the async pipeline, health check and metrics.
+    """
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    method = scope["method"]
+
+    if method == "OPTIONS":
+        await send({
+            "type": "http.response.start",
+            "status": 204,
+            "headers": [
+                (b"access-control-allow-origin", ALLOWED_ORIGIN.encode()),
+                (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+                (b"access-control-allow-headers", b"content-type, idempotency-key"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+    elif path == "/api/extract-order" and method == "POST":
+        await extract_order_details(scope, receive, send)
+    elif path == "/api/health" and method == "GET":
+        await send_json(send, 200, {
+            "status": "healthy",
+            "message": "Three-agent pipeline is operational (async)",
+            "catalog_cache": get_catalog_cache_stats()
+        })
+    elif path == "/api/metrics" and method == "GET":
+        body = registry.render(gauges={
+            "catalog_cache": get_catalog_cache_stats(),
+            "result_cache": backend.result_cache.stats() if backend.result_cache else None,
+            "db_pool": get_connection_pool_stats(),
+            "fast_extractor": backend.get_fast_extractor_stats(),
+            "email_preprocessing": backend.get_email_preprocessing_stats(),
+            "request_coalescing": backend.request_coalescer.stats() if backend.request_coalescer else None,
+            "job_queue": backend.job_queue.stats() if backend.job_queue else None,
+            "gemini_breaker": backend.model_breaker.stats() if backend.model_breaker else None
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4")],
+        })
+        await send({"type": "http.response.body", "body": body})
+    else:
+        await send_json(send, 404, {"error": "Not found"})
@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for the order pipeline. Gemini and PostgreSQL are replaced by the
+deterministic stand-ins in benchmarks.fakes, so no API key or database is needed.
+"""
@@ -0,0 +1,220 @@
+import random
+
+UNKNOWN_PRODUCT_NAME = "Gizmo QWERTZ 0"
+
+ORDER_KINDS = ("valid", "moq", "stock", "unknown")
+DEFAULT_MIX = {"valid": 0.55, "moq": 0.15, "stock": 0.15, "unknown": 0.15}
+
+DELIVERY_NOTES = (
+    "",
+    "Please deliver by the end of next week.",
+    "Standard shipping is fine.",
+    "We need express delivery to our Berlin office.",
+    "Could you split the delivery into two shipments?"
+)
+
+def build_order_email(lines, delivery_note=""):
+    """
+    Renders (quantity, product name) pairs as a customer email in the
+    "<quantity> x <product name>" form understood by FakeGenerativeModel.
+    """
+    body = "\n".join(f"{quantity} x {name}" for quantity, name in lines)
+    email = f"Hello,\n\nWe would like to order the following:\n{body}\n"
+    if delivery_note:
+        email += f"\n{delivery_note}\n"
+    return email + "\nKind regards,\nJordan"
+
+def pick_order_lines(products, kind, count=1, offset=0):
+    """
+    Picks `count` deterministic order lines of the given kind from the catalog:
+    "valid", "moq" (below minimum order quantity), "stock" (above inventory) or "unknown".
+    """
+    if kind == "unknown":
+        return [(1, f"{UNKNOWN_PRODUCT_NAME}{i}") for i in range(count)]
+
+    candidates = []
+    for sku in sorted(products):
+        product = products[sku]
+        moq, inventory = product["min_order_qty"], product["inventory"]
+        if kind == "valid" and inventory >= moq:
+            candidates.append((moq, product["name"]))
+        elif kind == "moq" and moq > 1 and inventory >= moq:
+            candidates.append((moq - 1, product["name"]))
+        elif kind == "stock" and inventory + 1 >= moq:
+            candidates.append((inventory + 1, product["name"]))
+    if not candidates:
+        raise ValueError(f"No catalog products suitable for '{kind}' order lines")
+    return [candidates[(offset + i) % len(candidates)] for i in range(count)]
+
+def sample_emails(products):
+    """
+    A small fixed set of order emails covering the clean and issue paths.
+    """
+    return {
+        "valid": build_order_email(pick_order_lines(products, "valid", 3)),
+        "moq": build_order_email(pick_order_lines(products, "valid", 2) + pick_order_lines(products, "moq")),
+        "stock": build_order_email(pick_order_lines(products, "valid", 2) + pick_order_lines(products, "stock")),
+        "unknown": build_order_email(pick_order_lines(products, "valid", 2) + pick_order_lines(products, "unknown"))
+    }
+
+def parse_mix(text):
+    """
+    Parses an order mix such as "valid=0.55,moq=0.15,stock=0.15,unknown=0.15".
+    Weights are normalized to sum to one.
+    """
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ORDER_KINDS:
+            raise ValueError(f"Unknown order kind '{kind}' (expected one of {', '.join(ORDER_KINDS)})")
+        mix[kind] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Order mix weights must sum to a positive number")
+    return {kind: weight / total for kind, weight in mix.items()}
+
+def generate_corpus(products, count, mix=None, max_items=4, seed=0):
+    """
+    Generates `count` synthetic (kind, email) pairs from the catalog.
+    Every email orders 1..max_items lines; non-valid kinds replace one line with a
+    problematic one. Each email carries a unique reference so result caching does not
+    collapse the corpus.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    corpus = []
+    for n in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        item_count = rng.randint(1, max_items)
+        lines = pick_order_lines(products, "valid", item_count, offset=rng.randrange(len(products)))
+        if kind != "valid":
+            lines[rng.randrange(item_count)] = pick_order_lines(products, kind, 1, offset=rng.randrange(len(products)))[0]
+        email = build_order_email(lines, rng.choice(DELIVERY_NOTES))
+        corpus.append((kind, f"Order reference: PO-{seed}-{n:06d}\n\n{email}"))
+    return corpus
+
+SIGNATURE = (
+    "Jordan Meyer\nHead of Purchasing | Meyer Office Supplies GmbH\n"
+    "Tel: +49 30 1234 5678 | Mobile: +49 170 987 6543\nwww.meyer-office.example"
+)
+DISCLAIMER_TEXT = (
+    "CONFIDENTIALITY NOTICE: This e-mail and any attachments are confidential and intended "
+    "solely for the use of the named recipient. If you have received this message in error, "
+    "please notify the sender immediately and delete it from your system. Any unauthorized "
+    "use, disclosure or copying is strictly prohibited.\n\n"
+    "Please consider the environment before printing this e-mail."
+)
+PREVIOUS_MESSAGES = (
+    "Hello Jordan,\n\nthank you for your order. All items were shipped today; the tracking "
+    "number will follow in a separate email.\n\nBest regards,\nSales Team",
+    "Hi,\n\ncould you send me an updated price list for the next quarter? We are planning "
+    "our purchases and would like to compare a few options.\n\nThanks,\nJordan",
+    "Dear Jordan,\n\nas discussed on the phone, our delivery slots for next week are full. "
+    "Orders placed by Friday ship the week after.\n\nKind regards,\nSales Team"
+)
+
+# Customer questions and notes that must survive pre-processing: one question in the body
+# and, in some templates, a postscript after the closing
+CUSTOMER_QUESTIONS = (
+    "Could you deliver these by Friday?",
+    "Is there a discount for orders above 500 EUR?",
+    "Can you confirm the delivery date once the order ships?"
+)
+POSTSCRIPTS = (
+    "P.S. Please deliver to the loading dock at the back of the building.",
+    "PS: our warehouse is closed on Mondays.",
+    "P.S. Let me know if any of these are out of stock."
+)
+
+def quote(text, depth=1):
+    """
+    Quotes every line of text with `depth` "> " markers, as mail clients do in replies.
+    """
+    return "\n".join(">" * depth + (" " + line if line else "") for line in text.split("\n"))
+
+def reply_chain(rng, length):
+    """
+    Renders `length` earlier messages as nested quoted reply history.
+    """
+    parts = []
+    for depth in range(1, length + 1):
+        header = f"On Mon, Jun {depth + 2}, 2024 at 9:{10 + depth} AM Sales <sales@example.com> wrote:"
+        parts.append(quote(header, depth - 1) if depth > 1 else header)
+        parts.append(quote(rng.choice(PREVIOUS_MESSAGES), depth))
+    return "\n".join(parts)
+
+def html_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def messy_email(lines, template, rng, question, postscript):
+    """
+    Wraps (quantity, product name) order lines, a customer question and a postscript in a
+    realistic messy email: a Gmail reply chain, an Outlook HTML message, a forward, a
+    mobile top-post, a plain email with signature and disclaimer, or an order that only
+    appears in the quoted text. Returns the email and the notes it contains.
+    """
+    items = "\n".join(f"{quantity} x {name}" for quantity, name in lines)
+    if template == "gmail_reply":
+        return (f"Hi team,\n\nplease add the following to our order:\n{items}\n\n{question}\n\nThanks,\n{SIGNATURE}\n\n"
+                f"{postscript}\n\n{reply_chain(rng, rng.randint(2, 4))}\n"), (question, postscript)
+    if template == "outlook_html":
+        list_items = "".join(f"<li><span style=\"font-family:Calibri\">{quantity} x {html_escape(name)}</span></li>" for quantity, name in lines)
+        previous = "".join(f"<p class=\"MsoNormal\">{html_escape(line)}</p>" for line in rng.choice(PREVIOUS_MESSAGES).split("\n"))
+        return (
+            "<html><head><meta charset=\"utf-8\"><style>p.MsoNormal{margin:0cm;font-size:11pt;font-family:Calibri,sans-serif}"
+            "</style></head><body lang=\"EN-US\"><div class=\"WordSection1\">"
+            "<p class=\"MsoNormal\">Hello,</p><p class=\"MsoNormal\">&nbsp;</p>"
+            f"<p class=\"MsoNormal\">We would like to order the following:</p><ul>{list_items}</ul>"
+            f"<p class=\"MsoNormal\">{html_escape(question)}</p>"
+            "<p class=\"MsoNormal\">&nbsp;</p><p class=\"MsoNormal\">Best regards,</p>"
+            f"<p class=\"MsoNormal\">{'<br>'.join(html_escape(line) for line in SIGNATURE.split(chr(10)))}</p>"
+            f"<p class=\"MsoNormal\"><span style=\"font-size:8pt;color:gray\">{html_escape(DISCLAIMER_TEXT.split(chr(10))[0])}</span></p>"
+            "<div style=\"border:none;border-top:solid #E1E1E1 1.0pt;padding:3.0pt 0cm 0cm 0cm\">"
+            "<p class=\"MsoNormal\"><b>From:</b> Sales &lt;sales@example.com&gt;<br><b>Sent:</b> Monday, June 3, 2024 9:12 AM<br>"
+            "<b>To:</b> Jordan Meyer &lt;jordan@example.com&gt;<br><b>Subject:</b> RE: Order</p></div>"
+            f"{previous}</div></body></html>"
+        ), (question,)
+    if template == "forwarded":
+        return (f"FYI, order from our Berlin office below.\n\n---------- Forwarded message ---------\n"
+                f"From: Alex Schmidt <alex@example.com>\nDate: Tue, Jun 4, 2024 at 10:02 AM\n"
+                f"Subject: Order for next week\nTo: Jordan Meyer <jordan@example.com>\n\n"
+                f"Hi Jordan,\n\nplease order:\n{items}\n\n{question}\n\nCheers,\nAlex\n{postscript}\n\n--\n{SIGNATURE}\n"), (question, postscript)
+    if template == "mobile_top_post":
+        return (f"Also need these asap:\n{items}\n{question}\n\nSent from my iPhone\n\n"
+                f"{reply_chain(rng, 1)}\n"), (question,)
+    if template == "signature_disclaimer":
+        return (f"Hello,\n\nWe would like to order the following:\n{items}\n\n{question}\n\nKind regards,\n\n"
+                f"{postscript}\n\n-- \n{SIGNATURE}\n\n{DISCLAIMER_TEXT}\n"), (question, postscript)
+    if template == "quoted_only":
+        return (f"On Tue, Jun 4, 2024 at 10:02 AM Alex Schmidt <alex@example.com> wrote:\n"
+                f"{quote(f'Hi,{chr(10)}{items}{chr(10)}{question}{chr(10)}Thanks')}\n"), (question,)
+    raise ValueError(f"Unknown messy email template '{template}'")
+
+MESSY_TEMPLATES = ("gmail_reply", "outlook_html", "forwarded", "mobile_top_post", "signature_disclaimer", "quoted_only")
+
+def messy_emails(products):
+    """
+    One messy email per template around the same order lines.
+    """
+    rng = random.Random(0)
+    lines = pick_order_lines(products, "valid", 3)
+    return {template: messy_email(lines, template, rng, CUSTOMER_QUESTIONS[0], POSTSCRIPTS[0])[0] for template in MESSY_TEMPLATES}
+
+def generate_messy_corpus(products, count, max_items=4, seed=0):
+    """
+    Generates `count` (template, order lines, notes, email) tuples with random order
+    lines, a customer question and a postscript wrapped in the messy email templates.
+    `notes` are the questions and postscripts the email contains.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        template = rng.choice(MESSY_TEMPLATES)
+        lines = pick_order_lines(products, "valid", rng.randint(1, max_items), offset=rng.randrange(len(products)))
+        email, notes = messy_email(lines, template, rng, rng.choice(CUSTOMER_QUESTIONS), rng.choice(POSTSCRIPTS))
+        corpus.append((template, lines, notes, email))
+    return corpus
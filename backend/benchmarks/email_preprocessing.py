@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the email pre-processing stage over a corpus of realistic messy emails.
+
+Usage (from the backend directory):
+    python -m benchmarks.email_preprocessing                  # 5,000 emails
+    python -m benchmarks.email_preprocessing --count 20000 --seed 1
+
+Wraps random catalog order lines, customer questions and postscripts in Gmail reply
+chains, Outlook HTML messages, forwards, mobile top-posts, signatures with legal
+disclaimers and quoted-only orders (benchmarks.corpus.generate_messy_corpus), runs
+EmailPreprocessor over them and prints bytes and estimated prompt tokens removed per
+email, p50/p95 time per email and throughput for each template. Exits with 1 if any
+order line, question or postscript did not survive.
+"""
+
+import sys
+import time
+import argparse
+import statistics
+from benchmarks.fakes import load_csv_catalog
+from benchmarks.corpus import generate_messy_corpus
+from email_preprocessing import EmailPreprocessor
+from token_budget import estimate_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark email pre-processing on messy emails")
+    parser.add_argument("--count", type=int, default=5000, help="Emails in the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = generate_messy_corpus(load_csv_catalog(), args.count, seed=args.seed)
+    preprocessor = EmailPreprocessor()
+    for _, _, _, email in corpus[:50]:
+        preprocessor.process(email)
+
+    by_template = {}
+    lost_lines = 0
+    for template, lines, notes, email in corpus:
+        started_at = time.perf_counter()
+        text, report = preprocessor.process(email)
+        elapsed = time.perf_counter() - started_at
+        lost = sum(1 for quantity, name in lines if f"{quantity} x {name}" not in text)
+        lost += sum(1 for note in notes if note not in text)
+        lost_lines += lost
+        stats = by_template.setdefault(template, {"seconds": [], "input_bytes": 0, "bytes_removed": 0, "tokens_removed": 0, "lost": 0})
+        stats["seconds"].append(elapsed)
+        stats["input_bytes"] += report["input_bytes"]
+        stats["bytes_removed"] += report["bytes_removed"]
+        stats["tokens_removed"] += estimate_tokens(email) - estimate_tokens(text)
+        stats["lost"] += lost
+
+    print(f"{'template':<22} {'emails':>7} {'bytes/email':>12} {'removed/email':>14} {'removed':>8} "
+          f"{'tokens saved':>13} {'p50 us':>8} {'p95 us':>8} {'MB/s':>7} {'lost':>5}")
+    totals = {"emails": 0, "input_bytes": 0, "bytes_removed": 0, "seconds": []}
+    for template in sorted(by_template):
+        stats = by_template[template]
+        emails = len(stats["seconds"])
+        seconds = sorted(stats["seconds"])
+        print(f"{template:<22} {emails:>7} {stats['input_bytes'] / emails:>12.0f} {stats['bytes_removed'] / emails:>14.0f} "
+              f"{stats['bytes_removed'] / stats['input_bytes']:>8.1%} {stats['tokens_removed'] / emails:>13.0f} "
+              f"{statistics.median(seconds) * 1e6:>8.1f} {seconds[int(0.95 * (emails - 1))] * 1e6:>8.1f} "
+              f"{stats['input_bytes'] / sum(seconds) / 1e6:>7.2f} {stats['lost']:>5}")
+        totals["emails"] += emails
+        totals["input_bytes"] += stats["input_bytes"]
+        totals["bytes_removed"] += stats["bytes_removed"]
+        totals["seconds"].extend(seconds)
+
+    seconds = sorted(totals["seconds"])
+    print(f"\n{totals['emails']} emails, {totals['bytes_removed'] / totals['emails']:.0f} bytes removed per email "
+          f"({totals['bytes_removed'] / totals['input_bytes']:.1%}), p50 {statistics.median(seconds) * 1e6:.1f} us, "
+          f"p95 {seconds[int(0.95 * (len(seconds) - 1))] * 1e6:.1f} us, "
+          f"{totals['emails'] / sum(seconds):.0f} emails/s, {lost_lines} order lines and notes lost")
+    return 1 if lost_lines else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
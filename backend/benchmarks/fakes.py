@@ -0,0 +1,118 @@
+import os
+import re
+import csv
+import json
+import time
+import random
+import asyncio
+import database
+
+# CSV the products table is seeded from (see product_data_insert.py)
+CATALOG_CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "product_data", "Product Catalog.csv")
+
+# Order lines in synthetic emails, e.g. "12 x Desk TRÄNHOLM 19"
+ORDER_LINE_PATTERN = re.compile(r"(\d+)\s*x\s+([^,\n]+?)\s*(?:[,\n]|$)")
+EMAIL_SECTION_PATTERN = re.compile(r"\*\*Email Content:\*\*\s*---\s*(.*?)\s*---", re.DOTALL)
+
+def load_csv_catalog(path=CATALOG_CSV_PATH):
+    """
+    Reads the product catalog CSV into a dictionary of product dictionaries keyed by SKU
+    (the catalog cache converts it to a Catalog like database.get_all_products_for_prompt()).
+    """
+    products = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            products[row["Product_Code"]] = {
+                "name": row["Product_Name"],
+                "price": float(row["Price"]),
+                "min_order_qty": int(row["Min_Order_Quantity"]),
+                "inventory": int(row["Available_in_Stock"])
+            }
+    return products
+
+def install_csv_catalog(path=CATALOG_CSV_PATH):
+    """
+    Replaces the products table as the catalog cache's source with the CSV and
+    returns the loaded products. Queries that bypass the cache still need PostgreSQL.
+    """
+    products = load_csv_catalog(path)
+    database._catalog_cache.loader = lambda: products
+    database.invalidate_catalog_cache()
+    return products
+
+class FakeResponse:
+    """
+    Mimics the parts of a Gemini response object the agents read.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+class FakeGenerativeModel:
+    """
+    Deterministic stand-in for genai.GenerativeModel.
+    Extraction prompts are answered by parsing "<quantity> x <product name>" lines from
+    the email section; response prompts get a fixed reply sized by the order. Every call
+    sleeps for `latency` seconds to model the Gemini round trip.
+    Faults can be injected: a `slow_rate` fraction of calls takes `slow_latency` seconds
+    instead, and a `failure_rate` fraction raises `failure` (default ConnectionError)
+    after the latency. Faults are drawn from a random generator seeded with `seed`.
+    """
+
+    def __init__(self, latency=0.0, stream_chunks=8, slow_rate=0.0, slow_latency=0.0,
+                 failure_rate=0.0, failure=ConnectionError, seed=0):
+        self.latency = latency
+        self.stream_chunks = stream_chunks
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.failure = failure
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def next_call(self):
+        """
+        Counts a call and draws its latency and whether it fails.
+        """
+        self.calls += 1
+        slow = self._random.random() < self.slow_rate
+        fails = self._random.random() < self.failure_rate
+        return (self.slow_latency if slow else self.latency), fails
+
+    def respond(self, prompt):
+        """
+        Returns the response text for a prompt without any latency.
+        """
+        match = EMAIL_SECTION_PATTERN.search(prompt)
+        if match:
+            items = [
+                {"product_name_mentioned": name, "quantity_mentioned": int(quantity), "item_description": f"{quantity} x {name}"}
+                for quantity, name in ORDER_LINE_PATTERN.findall(match.group(1))
+            ]
+            return json.dumps({"items": items, "delivery_preference": "", "customer_notes": ""})
+
+        item_count = prompt.count('"sku"')
+        issue_count = prompt.count('"issue_type"')
+        return (
+            "Dear Customer,\n\nThank you for your order. "
+            f"We can confirm {item_count} item(s) and found {issue_count} issue(s) that need your attention.\n\n"
+            "Best regards,\nCustomer Service Team"
+        )
+
+    def generate_content(self, prompt, stream=False):
+        latency, fails = self.next_call()
+        time.sleep(latency)
+        if fails:
+            raise self.failure("Injected model failure")
+        text = self.respond(prompt)
+        if not stream:
+            return FakeResponse(text)
+        size = max(1, -(-len(text) // self.stream_chunks))
+        return [FakeResponse(text[i:i + size]) for i in range(0, len(text), size)]
+
+    async def generate_content_async(self, prompt):
+        latency, fails = self.next_call()
+        await asyncio.sleep(latency)
+        if fails:
+            raise self.failure("Injected model failure")
+        return FakeResponse(self.respond(prompt))
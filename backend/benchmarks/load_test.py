@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Load generator for a running backend (e.g. benchmarks/serve_fake.py or a real deployment).
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --rate 20 --duration 30                 # open loop, 20 orders/s
+    python -m benchmarks.load_test --rate 0 --concurrency 16 --requests 500  # closed loop
+    python -m benchmarks.load_test --rates 5,10,20,40,80 --duration 20       # sweep to find saturation
+    python -m benchmarks.load_test --endpoint batch --batch-size 50 --rate 1 --duration 30
+
+In open-loop mode requests are issued on a fixed (or Poisson) schedule regardless of how
+fast the server answers, and latency is measured from the scheduled send time, so queueing
+in the client is counted instead of hidden. DB pool wait times are taken from the
+server's /api/metrics before and after each run.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fakes import load_csv_catalog
+from benchmarks.corpus import generate_corpus, parse_mix, DEFAULT_MIX
+
+# A rate counts as saturated when the server completes less than this share of the offered load
+SATURATION_THROUGHPUT_RATIO = 0.95
+SATURATION_ERROR_RATE = 0.01
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+def post_json(url, payload, timeout):
+    """
+    POSTs a JSON payload and returns (status, body text).
+    """
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", "replace")
+
+def scrape_pool_metrics(base_url):
+    """
+    Returns the db_pool_* gauges from /api/metrics, or an empty dict when the server
+    has no connection pool or the scrape fails.
+    """
+    try:
+        with urllib.request.urlopen(f"{base_url}/api/metrics", timeout=5) as response:
+            text = response.read().decode("utf-8")
+    except (urllib.error.URLError, OSError):
+        return {}
+    pool = {}
+    for line in text.splitlines():
+        if line.startswith("db_pool_"):
+            name, _, value = line.partition(" ")
+            pool[name[len("db_pool_"):]] = float(value)
+    return pool
+
+class LoadTest:
+    """
+    Drives one endpoint at a given arrival rate (open loop) or with a fixed number of
+    busy clients (closed loop, rate 0) and collects per-request outcomes.
+    """
+
+    def __init__(self, base_url, endpoint, corpus, concurrency, batch_size=1, timeout=120.0, poisson=False, seed=0):
+        self.base_url = base_url.rstrip("/")
+        self.endpoint = endpoint
+        self.corpus = corpus
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.poisson = poisson
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next = 0
+        self.results = []   # (kind, latency seconds, error or None, emails in request, failed emails)
+
+    def next_payload(self):
+        with self._lock:
+            start = self._next
+            self._next += self.batch_size
+        entries = [self.corpus[(start + i) % len(self.corpus)] for i in range(self.batch_size)]
+        if self.endpoint == "batch":
+            return "batch", {"emails": [email for _, email in entries]}
+        kind, email = entries[0]
+        return kind, {"email_content": email}
+
+    def send(self, scheduled_at):
+        kind, payload = self.next_payload()
+        path = "/api/extract-orders" if self.endpoint == "batch" else "/api/extract-order"
+        error = None
+        emails = len(payload["emails"]) if self.endpoint == "batch" else 1
+        failed = 0
+        try:
+            status, body = post_json(self.base_url + path, payload, self.timeout)
+            if status != 200:
+                error = f"HTTP {status}"
+                failed = emails
+            elif self.endpoint == "batch":
+                lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+                failed = sum(1 for line in lines if line.get("status") != "ok") + max(0, emails - len(lines))
+                if failed:
+                    error = "batch item errors"
+        except Exception as e:
+            error = type(e).__name__
+            failed = emails
+        latency = time.perf_counter() - scheduled_at
+        with self._lock:
+            self.results.append((kind, latency, error, emails, failed))
+
+    def run(self, rate, duration=None, requests=None):
+        """
+        Runs the test and returns a summary dictionary.
+        """
+        total = requests if requests is not None else (int(rate * duration) if rate > 0 else None)
+        pool_before = scrape_pool_metrics(self.base_url)
+        started_at = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load") as executor:
+            if rate > 0:
+                # Open loop: arrivals follow the schedule, not the responses
+                scheduled_at = started_at
+                for _ in range(total):
+                    interval = self.rng.expovariate(rate) if self.poisson else 1.0 / rate
+                    scheduled_at += interval
+                    delay = scheduled_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(self.send, scheduled_at)
+            else:
+                # Closed loop: each client sends its next request once the previous one returns
+                deadline = started_at + duration if duration else None
+                sent = [0]
+                sent_lock = threading.Lock()
+
+                def client():
+                    while True:
+                        with sent_lock:
+                            if (total is not None and sent[0] >= total) or (deadline and time.perf_counter() >= deadline):
+                                return
+                            sent[0] += 1
+                        self.send(time.perf_counter())
+
+                for _ in range(self.concurrency):
+                    executor.submit(client)
+
+        elapsed = time.perf_counter() - started_at
+        pool_after = scrape_pool_metrics(self.base_url)
+        return self.summarize(rate, elapsed, pool_before, pool_after)
+
+    def summarize(self, rate, elapsed, pool_before, pool_after):
+        latencies = sorted(latency for _, latency, _, _, _ in self.results)
+        errors = {}
+        for _, _, error, _, _ in self.results:
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+        emails = sum(count for _, _, _, count, _ in self.results)
+        failed_emails = sum(failed for _, _, _, _, failed in self.results)
+
+        by_kind = {}
+        for kind, latency, error, _, _ in self.results:
+            entry = by_kind.setdefault(kind, {"requests": 0, "errors": 0, "latencies": []})
+            entry["requests"] += 1
+            entry["errors"] += 1 if error else 0
+            entry["latencies"].append(latency)
+        for entry in by_kind.values():
+            entry["p95_ms"] = round(percentile(sorted(entry.pop("latencies")), 0.95) * 1000, 1)
+
+        summary = {
+            "endpoint": self.endpoint,
+            "offered_rate": rate,
+            "concurrency": self.concurrency,
+            "requests": len(self.results),
+            "emails": emails,
+            "elapsed_seconds": round(elapsed, 3),
+            "requests_per_second": round(len(self.results) / elapsed, 2) if elapsed else None,
+            "emails_per_second": round(emails / elapsed, 2) if elapsed else None,
+            "error_rate": round(failed_emails / emails, 4) if emails else None,
+            "errors": errors,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "p95": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+                "p99": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                "max": round(latencies[-1] * 1000, 1) if latencies else None,
+                "mean": round(statistics.fmean(latencies) * 1000, 1) if latencies else None
+            },
+            "by_kind": by_kind,
+            "db_pool": pool_wait_summary(pool_before, pool_after)
+        }
+        return summary
+
+def pool_wait_summary(before, after):
+    """
+    Connection pool checkout/wait deltas over a run, from two /api/metrics scrapes.
+    """
+    if not after:
+        return None
+    delta = {key: after.get(key, 0) - before.get(key, 0) for key in ("checkouts", "waits", "wait_seconds_total", "exhaustion_events", "timeouts")}
+    checkouts = delta["checkouts"]
+    return {
+        "checkouts": int(checkouts),
+        "waits": int(delta["waits"]),
+        "mean_wait_ms": round(delta["wait_seconds_total"] / checkouts * 1000, 3) if checkouts else 0.0,
+        "max_wait_ms": round(after.get("wait_seconds_max", 0) * 1000, 3),
+        "exhaustion_events": int(delta["exhaustion_events"]),
+        "timeouts": int(delta["timeouts"]),
+        "pool_size": int(after.get("size", 0)),
+        "pool_max": int(after.get("maxconn", 0))
+    }
+
+def is_saturated(summary):
+    offered = summary["offered_rate"]
+    achieved = summary["emails_per_second"] if summary["endpoint"] == "batch" else summary["requests_per_second"]
+    if summary["error_rate"] and summary["error_rate"] > SATURATION_ERROR_RATE:
+        return True
+    if offered and achieved is not None:
+        units = offered * (summary["emails"] / summary["requests"] if summary["requests"] else 1)
+        return achieved < units * SATURATION_THROUGHPUT_RATIO
+    return False
+
+def print_summary(summary):
+    latency = summary["latency_ms"]
+    print(
+        f"rate {summary['offered_rate'] or 'closed':>7} | {summary['requests']:>6} req | "
+        f"{summary['requests_per_second']:>8} req/s | {summary['emails_per_second']:>8} emails/s | "
+        f"p50 {latency['p50']} ms | p95 {latency['p95']} ms | p99 {latency['p99']} ms | "
+        f"errors {summary['error_rate']:.2%}"
+    )
+    pool = summary["db_pool"]
+    if pool:
+        print(
+            f"          db pool: {pool['checkouts']} checkouts, {pool['waits']} waited, "
+            f"mean wait {pool['mean_wait_ms']} ms, max wait {pool['max_wait_ms']} ms, "
+            f"{pool['exhaustion_events']} exhaustion events, {pool['timeouts']} timeouts"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the order pipeline API")
+    parser.add_argument("--url", default="http://localhost:5001", help="Base URL of the backend")
+    parser.add_argument("--endpoint", choices=("single", "batch"), default="single")
+    parser.add_argument("--rate", type=float, default=10.0, help="Requests per second (open loop); 0 for closed loop")
+    parser.add_argument("--rates", help="Comma-separated rates to sweep, e.g. 5,10,20,40")
+    parser.add_argument("--poisson", action="store_true", help="Poisson instead of evenly spaced arrivals")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight (closed loop: number of clients)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per run")
+    parser.add_argument("--requests", type=int, help="Number of requests per run (overrides --duration)")
+    parser.add_argument("--batch-size", type=int, default=20, help="Emails per request for --endpoint batch")
+    parser.add_argument("--mix", help=f"Order mix, default {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())}")
+    parser.add_argument("--corpus-size", type=int, default=2000, help="Emails per run in closed loop without --requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, help="Corpus seed (default: current time, so emails do not hit the server's result cache)")
+    parser.add_argument("--output", help="Write all run summaries to this JSON file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    products = load_csv_catalog()
+    seed = args.seed if args.seed is not None else int(time.time())
+    rates = [float(rate) for rate in args.rates.split(",")] if args.rates else [args.rate]
+    batch_size = args.batch_size if args.endpoint == "batch" else 1
+
+    summaries = []
+    saturation = None
+    for run, rate in enumerate(rates):
+        # A fresh, unique corpus per run so no email is answered from the result cache
+        if args.requests is not None:
+            corpus_size = args.requests * batch_size
+        elif rate > 0:
+            corpus_size = int(rate * args.duration) * batch_size
+        else:
+            corpus_size = args.corpus_size
+        corpus = generate_corpus(products, max(1, corpus_size), mix, seed=f"{seed}-{run}")
+        test = LoadTest(args.url, args.endpoint, corpus, args.concurrency, batch_size, args.timeout, args.poisson, seed)
+        summary = test.run(rate, duration=args.duration, requests=args.requests)
+        summaries.append(summary)
+        print_summary(summary)
+        if saturation is None and rate > 0 and is_saturated(summary):
+            saturation = rate
+
+    if len(rates) > 1:
+        if saturation is not None:
+            print(f"\nSaturated at {saturation} req/s (throughput below {SATURATION_THROUGHPUT_RATIO:.0%} of offered load or errors above {SATURATION_ERROR_RATE:.0%})")
+        else:
+            print("\nNo saturation within the swept rates")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"runs": summaries, "saturation_rate": saturation}, f, indent=2)
+            f.write("\n")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
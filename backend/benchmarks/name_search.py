@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Before/after comparison of product name lookup on a scaled-up catalog.
+
+Usage (from the backend directory, with the .env database):
+    python -m benchmarks.name_search                    # 1,000,000 products
+    python -m benchmarks.name_search --rows 200000 --queries 10
+
+Builds a synthetic catalog from the CSV vocabulary in a scratch schema
+(name_search_bench, dropped afterwards unless --keep; run setup_database.py first so
+the pg_trgm and unaccent extensions exist), then times the original
+`name ILIKE '%x%'` lookup, applies schema migrations 4 and 5 (normalized name column and
+trigram indexes) and times PRODUCT_NAME_MATCH_QUERY. Prints the query plans, p50/p95
+latency per mention kind and how often the expected product was returned.
+"""
+
+import os
+import time
+import random
+import argparse
+import statistics
+import psycopg2
+from dotenv import load_dotenv
+from benchmarks.fakes import load_csv_catalog
+from database import PRODUCT_NAME_MATCH_QUERY
+from setup_database import MIGRATIONS
+
+load_dotenv()
+
+BENCH_SCHEMA = "name_search_bench"
+# The lookup get_product_by_name used before the trigram migrations
+ORIGINAL_QUERY = "SELECT sku, name, price, min_order_qty, inventory FROM products WHERE name ILIKE %(pattern)s"
+
+FILL_QUERY = """
+    INSERT INTO products (sku, name, price, min_order_qty, inventory)
+    SELECT 'BEN-' || lpad(i::text, 7, '0'),
+           c.categories[1 + i %% cardinality(c.categories)] || ' ' ||
+           c.words[1 + (i / cardinality(c.categories)) %% cardinality(c.words)] || ' ' || (i %% 1000),
+           round((random() * 1000)::numeric, 2), 1 + i %% 10, i %% 200
+    FROM generate_series(1, %(rows)s) AS i,
+         (SELECT %(categories)s::text[] AS categories, %(words)s::text[] AS words) c
+"""
+
+def fold(text):
+    # Poor man's unaccent for generating folded mentions
+    return text.lower().translate(str.maketrans("äöüåéèøæ", "aouaeeoa"))
+
+def build_mentions(names, rng):
+    """
+    Returns (kind, mention, expected name or None) tuples for sampled catalog names.
+    """
+    mentions = []
+    for name in names:
+        _, rest = name.split(" ", 1)
+        word = rest.split(" ")[0]
+        typo_index = rng.randrange(1, len(word))
+        mentions.append(("exact", name, name))
+        mentions.append(("partial", rest, name))
+        mentions.append(("folded", fold(name), name))
+        mentions.append(("typo", name.replace(word, word[:typo_index] + word[typo_index + 1:]), name))
+        mentions.append(("unknown", f"Gadget ZYXWQ {rng.randrange(100000)}", None))
+    return mentions
+
+def time_queries(cur, query, mentions, params_for):
+    """
+    Runs every mention once and returns {kind: {"latencies_ms": [...], "correct": n, "total": n}}.
+    """
+    results = {}
+    for kind, mention, expected in mentions:
+        started_at = time.perf_counter()
+        cur.execute(query, params_for(mention))
+        rows = cur.fetchall()
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        # Like the original get_product_by_name, take the first row returned
+        found = rows[0][1] if rows else None
+        result = results.setdefault(kind, {"latencies_ms": [], "correct": 0, "total": 0})
+        result["latencies_ms"].append(elapsed_ms)
+        result["total"] += 1
+        result["correct"] += found == expected
+    return results
+
+def explain(cur, query, params):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+    return "\n".join("    " + row[0] for row in cur.fetchall())
+
+def print_results(label, results):
+    print(f"{label}:")
+    print(f"    {'kind':<10}{'p50 ms':>10}{'p95 ms':>10}{'correct':>12}")
+    for kind, result in results.items():
+        latencies = sorted(result["latencies_ms"])
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"    {kind:<10}{statistics.median(latencies):>10.2f}{p95:>10.2f}{result['correct']:>7}/{result['total']}")
+
+def run(rows, per_kind, seed):
+    rng = random.Random(seed)
+    catalog_names = [product["name"] for product in load_csv_catalog().values()]
+    categories = sorted({name.split(" ")[0] for name in catalog_names})
+    words = sorted({name.split(" ")[1] for name in catalog_names if len(name.split(" ")) > 2})
+
+    conn = psycopg2.connect(
+        host=os.environ.get("HOST"),
+        database=os.environ.get("DBNAME"),
+        user=os.environ.get("USER"),
+        password=os.environ.get("PASSWORD"),
+        port=os.environ.get("PORT", "5432")
+    )
+    conn.autocommit = True
+    cur = conn.cursor()
+    # Everything below, including the migrations, is created in the scratch schema
+    cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    cur.execute(f"SET search_path = {BENCH_SCHEMA}, public, extensions")
+    cur.execute(MIGRATIONS[0][2])
+
+    print(f"Generating {rows:,} products from {len(categories)} categories x {len(words)} words...")
+    started_at = time.perf_counter()
+    cur.execute(FILL_QUERY, {"rows": rows, "categories": categories, "words": words})
+    cur.execute("ANALYZE products")
+    print(f"    done in {time.perf_counter() - started_at:.1f}s")
+
+    cur.execute("SELECT setseed(%s)", (rng.random(),))
+    cur.execute("SELECT name FROM products ORDER BY random() LIMIT %s", (per_kind,))
+    mentions = build_mentions([row[0] for row in cur.fetchall()], rng)
+    sample = mentions[1][1]
+
+    original_params = lambda mention: {"pattern": f"%{mention}%"}
+    print()
+    print(f"Before (original ILIKE lookup), plan for '{sample}':")
+    print(explain(cur, ORIGINAL_QUERY, original_params(sample)))
+    before = time_queries(cur, ORIGINAL_QUERY, mentions, original_params)
+
+    print()
+    for version, description, migration_sql in MIGRATIONS[3:5]:
+        started_at = time.perf_counter()
+        cur.execute(migration_sql)
+        print(f"Migration {version} ({description}) took {time.perf_counter() - started_at:.1f}s")
+
+    match_params = lambda mention: {"product_name": mention}
+    print()
+    print(f"After (trigram-ranked lookup), plan for '{sample}':")
+    print(explain(cur, PRODUCT_NAME_MATCH_QUERY, match_params(sample)))
+    after = time_queries(cur, PRODUCT_NAME_MATCH_QUERY, mentions, match_params)
+
+    print()
+    print_results("Before", before)
+    print_results("After", after)
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Product name lookup before/after the trigram migrations")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of synthetic products")
+    parser.add_argument("--queries", type=int, default=20, help="Sampled names per mention kind")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {BENCH_SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    try:
+        run(args.rows, args.queries, args.seed)
+    finally:
+        if not args.keep:
+            conn = psycopg2.connect(
+                host=os.environ.get("HOST"),
+                database=os.environ.get("DBNAME"),
+                user=os.environ.get("USER"),
+                password=os.environ.get("PASSWORD"),
+                port=os.environ.get("PORT", "5432")
+            )
+            with conn.cursor() as drop_cursor:
+                drop_cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            conn.commit()
+            conn.close()
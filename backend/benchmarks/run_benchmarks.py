@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the order pipeline that run without Gemini or PostgreSQL.
+
+Usage (from the backend directory):
+    python -m benchmarks.run_benchmarks                      # run and print results
+    python -m benchmarks.run_benchmarks --save               # also write benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --compare            # compare against benchmarks/baseline.json
+
+The model is replaced by FakeGenerativeModel (deterministic, --latency seconds per call)
+and the products table by the catalog CSV, so results only depend on this machine.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+from datetime import datetime, timezone
+from benchmarks.fakes import FakeGenerativeModel, load_csv_catalog, install_csv_catalog
+from benchmarks.corpus import sample_emails, messy_emails
+from catalog import Catalog
+from catalog_index import ProductNameIndex
+from database import get_catalog_snapshot
+from agents.extraction_agent import ExtractionAgent
+from agents.validation_agent import ValidationAgent
+from agents.response_agent import ResponseAgent
+from email_preprocessing import EmailPreprocessor
+from pipeline import OrderPipeline
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# A benchmark regresses when its median is this much slower than the baseline
+DEFAULT_REGRESSION_THRESHOLD = 0.25
+
+def measure(func, iterations, warmup=3):
+    """
+    Calls func `iterations` times after a warmup and returns timing statistics in
+    microseconds.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started_at = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started_at) * 1e6)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "min_us": round(samples[0], 2),
+        "median_us": round(statistics.median(samples), 2),
+        "mean_us": round(statistics.fmean(samples), 2),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2)
+    }
+
+def measure_memory(build):
+    """
+    Returns the bytes still allocated by the object graph build() returns.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated
+
+def catalog_memory(products):
+    """
+    Memory of the catalog and its name index in the dictionary-of-dictionaries layout
+    against the compact Catalog, plus the prompt text the Catalog keeps pre-rendered.
+    """
+    dict_catalog = {sku: dict(product) for sku, product in products.items()}
+    compact_catalog = Catalog.from_mapping(products)
+    sizes = {
+        "catalog_dicts_bytes": measure_memory(lambda: {sku: dict(product) for sku, product in products.items()}),
+        "catalog_compact_bytes": measure_memory(lambda: Catalog.from_mapping(products)),
+        "index_dicts_bytes": measure_memory(lambda: ProductNameIndex(dict_catalog)),
+        "index_compact_bytes": measure_memory(lambda: ProductNameIndex(compact_catalog)),
+        "prompt_text_compact_bytes": measure_memory(lambda: (compact_catalog.json_text(), compact_catalog.render_table(())))
+    }
+    print()
+    for name, size in sizes.items():
+        print(f"{name:<36} {size / 1024:>12.1f} KiB")
+    return sizes
+
+def run_benchmarks(iterations, latency):
+    """
+    Runs all benchmarks and returns {name: stats}.
+    """
+    products = install_csv_catalog()
+    snapshot = get_catalog_snapshot()
+    emails = sample_emails(products)
+    email = emails["moq"]
+
+    model = FakeGenerativeModel(latency=latency)
+    pruned_agent = ExtractionAgent(model, catalog_mode="pruned", fast_path="rules")
+    full_agent = ExtractionAgent(model, catalog_mode="full")
+    # The full catalog is far over this budget, so every compaction level is exercised
+    compacting_agent = ExtractionAgent(model, catalog_mode="full", token_budget=300)
+    validation_agent = ValidationAgent(mode="index")
+    response_agent = ResponseAgent(model, fast_path="off")
+    preprocessor = EmailPreprocessor()
+    messy = list(messy_emails(products).values())
+    pipeline = OrderPipeline(pruned_agent, validation_agent, ResponseAgent(model))
+
+    raw_extraction = json.loads(model.respond(pruned_agent.create_prompt(email, snapshot.products, [])))
+    validated_order = validation_agent.validate_order(raw_extraction, None, snapshot)
+
+    benchmarks = {
+        "catalog_load_csv": (load_csv_catalog, max(1, iterations // 10)),
+        "catalog_index_build": (lambda: ProductNameIndex(products), max(1, iterations // 10)),
+        "catalog_build_compact": (lambda: Catalog.from_mapping(products).prepare(), max(1, iterations // 10)),
+        "catalog_snapshot_warm": (get_catalog_snapshot, iterations),
+        "extraction_create_prompt_pruned": (lambda: pruned_agent.create_prompt(email, snapshot.products, pruned_agent.select_catalog(email, snapshot)), iterations),
+        "extraction_create_prompt_full": (lambda: full_agent.create_prompt(email, snapshot.products, full_agent.select_catalog(email, snapshot)), iterations),
+        "extraction_build_prompt_compacted": (lambda: compacting_agent.build_prompt(email, snapshot), iterations),
+        "email_preprocess_messy": (lambda: [preprocessor.process(messy_email) for messy_email in messy], iterations),
+        "extraction_rules": (lambda: pruned_agent.rule_extractor.extract(email, snapshot), iterations),
+        "response_create_prompt": (lambda: response_agent.create_prompt(validated_order), iterations),
+        "validate_order": (lambda: validation_agent.validate_order(raw_extraction, None, snapshot), iterations)
+    }
+    for scenario, scenario_email in emails.items():
+        benchmarks[f"pipeline_run_{scenario}"] = (lambda e=scenario_email: pipeline.run(e), max(1, iterations // 10))
+
+    results = {}
+    for name, (func, count) in benchmarks.items():
+        results[name] = measure(func, count)
+        print(f"{name:<36} median {results[name]['median_us']:>12.2f} us   p95 {results[name]['p95_us']:>12.2f} us   (n={count})")
+    return results
+
+def environment_info(latency):
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "model_latency_seconds": latency,
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds")
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Prints current vs baseline medians and returns the names of regressed benchmarks.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<36} {'baseline us':>12} {'current us':>12} {'ratio':>7}")
+    for name, stats in results.items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            print(f"{name:<36} {'-':>12} {stats['median_us']:>12.2f}    new")
+            continue
+        ratio = stats["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<36} {base['median_us']:>12.2f} {stats['median_us']:>12.2f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline order pipeline benchmarks")
+    parser.add_argument("--iterations", type=int, default=200, help="Iterations for the fast benchmarks (slow ones run a tenth)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated Gemini latency per call in seconds")
+    parser.add_argument("--save", nargs="?", const=BASELINE_PATH, help="Write results as the baseline JSON")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, help="Compare results against a baseline JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help="Allowed median slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.iterations, args.latency)
+    memory = catalog_memory(load_csv_catalog())
+    report = {"environment": environment_info(args.latency), "benchmarks": results, "memory": memory}
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["environment"].get("machine") != report["environment"]["machine"]:
+            print("\nWarning: baseline was recorded on a different machine type")
+        if compare(results, baseline, args.threshold):
+            exit_code = 1
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {args.save}")
+
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
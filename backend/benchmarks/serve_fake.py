@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Runs the Flask application with FakeGenerativeModel in place of Gemini, as a target for
+benchmarks/load_test.py.
+
+Usage (from the backend directory):
+    python -m benchmarks.serve_fake --latency 0.8                 # catalog from the CSV, no database
+    python -m benchmarks.serve_fake --latency 0.8 --catalog database
+
+With --catalog database the connection pool is initialized from .env, so validation
+(VALIDATION_MODE=database) and the pool wait metrics reflect a real PostgreSQL instance.
+"""
+
+import argparse
+import app as backend
+from benchmarks.fakes import FakeGenerativeModel, install_csv_catalog
+from database import initialize_connection_pool, close_connection_pool, get_cached_products
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the pipeline with a fake Gemini model")
+    parser.add_argument("--latency", type=float, default=0.8, help="Simulated Gemini latency per call in seconds")
+    parser.add_argument("--catalog", choices=("csv", "database"), default="csv", help="Catalog source")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+
+    if args.catalog == "database":
+        initialize_connection_pool()
+    else:
+        install_csv_catalog()
+    get_cached_products()
+
+    backend.initialize_agents(FakeGenerativeModel(latency=args.latency))
+    try:
+        backend.app.run(port=args.port, threaded=True)
+    finally:
+        close_connection_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import hashlib
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+from catalog_index import ProductNameIndex
+
+# Columns of the compact catalog table sent to the extraction prompt
+CATALOG_TABLE_COLUMNS = ("sku", "name", "price", "min_order_qty", "inventory")
+
+class Product(namedtuple("Product", CATALOG_TABLE_COLUMNS)):
+    """
+    Immutable catalog row stored as a plain tuple (no per-product dictionary).
+    Supports product["name"] and dict(product), so it can be used wherever the agents
+    previously received product dictionaries.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self._fields:
+                raise KeyError(key)
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def to_dict(self):
+        return self._asdict()
+
+class Catalog(Mapping):
+    """
+    Immutable catalog snapshot: a read-only mapping of SKU to Product backed by a tuple of
+    rows and a SKU position index. Everything derived from the rows (the product name
+    index, the pretty-printed JSON catalog and the pre-rendered table rows for the
+    extraction prompt) is built once, by prepare() or on first use, and shared by every
+    request that sees this catalog version.
+    """
+
+    __slots__ = ("_products", "_positions", "_lock", "_index", "_json_text", "_table_rows", "_digest")
+
+    def __init__(self, products):
+        self._products = tuple(products)
+        self._positions = {product.sku: position for position, product in enumerate(self._products)}
+        self._lock = threading.Lock()
+        self._index = None
+        self._json_text = None
+        self._table_rows = None
+        self._digest = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a catalog from (sku, name, price, min_order_qty, inventory) rows.
+        """
+        return cls(Product(sku, name, float(price), min_order_qty, inventory) for sku, name, price, min_order_qty, inventory in rows)
+
+    @classmethod
+    def from_mapping(cls, products):
+        """
+        Builds a catalog from a dictionary of product dictionaries keyed by SKU.
+        """
+        return cls(
+            Product(sku, product["name"], float(product["price"]), product["min_order_qty"], product["inventory"])
+            for sku, product in products.items()
+        )
+
+    def __getitem__(self, sku):
+        return self._products[self._positions[sku]]
+
+    def __contains__(self, sku):
+        return sku in self._positions
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._products)
+
+    def __eq__(self, other):
+        if isinstance(other, Catalog):
+            return self._products == other._products
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def values(self):
+        """
+        Returns the products as a tuple, in catalog order.
+        """
+        return self._products
+
+    def items(self):
+        return ((product.sku, product) for product in self._products)
+
+    @property
+    def index(self):
+        """
+        The ProductNameIndex for this catalog, built once.
+        """
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = ProductNameIndex(self)
+        return self._index
+
+    def prepare(self):
+        """
+        Builds the name index, the prompt renderings and the content digest ahead of the
+        first request.
+        """
+        self.index
+        self.json_text()
+        self.render_table(())
+        self.digest()
+        return self
+
+    def digest(self):
+        """
+        SHA-256 of every product row, computed once. Unlike the in-process catalog
+        version, it is the same in every process and across restarts, so it can key
+        results that outlive this process (the result cache's disk tier).
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.render_table().encode("utf-8")).hexdigest()
+        return self._digest
+
+    def to_dict(self):
+        """
+        Returns the catalog as a dictionary of product dictionaries keyed by SKU (without
+        the SKU inside each product), the shape used in the full JSON prompt.
+        """
+        return {
+            product.sku: {
+                "name": product.name,
+                "price": product.price,
+                "min_order_qty": product.min_order_qty,
+                "inventory": product.inventory
+            }
+            for product in self._products
+        }
+
+    def json_text(self):
+        """
+        The whole catalog as pretty-printed JSON, rendered once.
+        """
+        if self._json_text is None:
+            self._json_text = json.dumps(self.to_dict(), indent=2)
+        return self._json_text
+
+    def render_table(self, skus=None):
+        """
+        Renders the given SKUs (default: the whole catalog) as a compact pipe-separated
+        table from pre-rendered rows. Unknown SKUs are skipped.
+        """
+        rows = self._table_rows
+        if rows is None:
+            rows = self._table_rows = tuple(
+                f"{product.sku}|{product.name}|{product.price}|{product.min_order_qty}|{product.inventory}"
+                for product in self._products
+            )
+        if skus is None:
+            selected = rows
+        else:
+            positions = self._positions
+            selected = [rows[positions[sku]] for sku in skus if sku in positions]
+        return "\n".join(("|".join(CATALOG_TABLE_COLUMNS), *selected))
@@ -0,0 +1,240 @@
+import re
+import math
+import unicodedata
+from collections import Counter
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_SKU_PATTERN = re.compile(r"[A-Za-z]{2,5}-\d{2,6}")
+
+# Weights for combining token containment and character n-gram similarity
+TOKEN_WEIGHT = 0.6
+NGRAM_WEIGHT = 0.4
+NGRAM_SIZE = 3
+# Trigram similarity above which a misspelled query word counts as a name word
+# ("chiar" for "chair"). Only common words such as categories may be misspelled: model
+# words (shared by less than COMMON_TOKEN_MIN_SHARE of the catalog) and words with
+# digits must match exactly
+FUZZY_TOKEN_MIN_SIMILARITY = 0.5
+COMMON_TOKEN_MIN_SHARE = 0.03
+
+def normalize_text(text):
+    """
+    Lowercases text and folds diacritics so that 'TRÄNHOLM' and 'tranholm' compare equal.
+    """
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(_TOKEN_PATTERN.findall(folded.casefold()))
+
+def tokenize(text):
+    """
+    Splits text into normalized alphanumeric tokens.
+    """
+    return normalize_text(text).split()
+
+def char_ngrams(normalized_text, n=NGRAM_SIZE):
+    """
+    Returns the set of character n-grams of an already normalized string, padded with spaces.
+    """
+    padded = f" {normalized_text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class ProductNameIndex:
+    """
+    In-memory name-resolution index built from a catalog snapshot (a Catalog or a
+    dictionary of product dictionaries keyed by SKU).
+    Resolves product mentions without a database round-trip using exact SKU lookup,
+    exact normalized-name lookup, token containment and character n-gram similarity.
+    Results are ranked deterministically by score, then SKU.
+    """
+
+    def __init__(self, products):
+        self.size = len(products)
+        # Longest product name in tokens, bounds name spans searched in free text
+        self.max_name_tokens = 0
+        self._products = {}
+        self._by_sku = {}
+        self._by_name = {}
+        # Normalized names shared by several products, with all their SKUs
+        self._duplicate_names = {}
+        self._tokens = {}
+        self._ngram_counts = {}
+        self._token_postings = {}
+        self._ngram_postings = {}
+
+        for sku in sorted(products):
+            product = products[sku]
+            # Catalog products are shared as-is; plain dictionaries are copied with their SKU
+            if isinstance(product, dict):
+                product = dict(product, sku=sku)
+            normalized_name = normalize_text(product["name"])
+            tokens = frozenset(normalized_name.split())
+            ngrams = char_ngrams(normalized_name)
+            self.max_name_tokens = max(self.max_name_tokens, len(normalized_name.split()))
+
+            self._products[sku] = product
+            self._by_sku[sku.upper()] = sku
+            first_sku = self._by_name.setdefault(normalized_name, sku)
+            if first_sku != sku:
+                self._duplicate_names.setdefault(normalized_name, [first_sku]).append(sku)
+            self._tokens[sku] = tokens
+            self._ngram_counts[sku] = len(ngrams)
+            for token in tokens:
+                self._token_postings.setdefault(token, []).append(sku)
+            for gram in ngrams:
+                self._ngram_postings.setdefault(gram, []).append(sku)
+
+        self._token_ngrams = {}
+        # Name words that may be matched by a misspelled query word
+        common_min_products = max(2, COMMON_TOKEN_MIN_SHARE * self.size)
+        self._common_tokens = frozenset(
+            token for token, skus in self._token_postings.items()
+            if len(skus) >= common_min_products and not any(ch.isdigit() for ch in token)
+        )
+
+        # Inverse document frequency of name tokens, used to rank products for free text
+        self._idf = {
+            token: math.log(1.0 + self.size / len(skus))
+            for token, skus in self._token_postings.items()
+        }
+
+    def get_by_sku(self, sku):
+        """
+        Exact, case-insensitive SKU lookup. Returns the product dictionary or None.
+        """
+        sku = self._by_sku.get(str(sku).strip().upper())
+        return self._products[sku] if sku else None
+
+    def get_by_name(self, name):
+        """
+        Exact lookup by normalized product name. Returns the product dictionary, or None
+        when no product or more than one product has that name.
+        """
+        normalized_name = normalize_text(name)
+        if normalized_name in self._duplicate_names:
+            return None
+        sku = self._by_name.get(normalized_name)
+        return self._products[sku] if sku else None
+
+    def token_similarity(self, token, name_tokens):
+        """
+        Returns how well a query word matches one of a product's name words: 1.0 for an
+        exact match, the trigram similarity of the closest common name word for a
+        misspelled word (0.0 below FUZZY_TOKEN_MIN_SIMILARITY), and 0.0 otherwise, so
+        "19" never matches "20" and "NORDMARK" never matches "LUNDMARK".
+        """
+        if token in name_tokens:
+            return 1.0
+        if any(ch.isdigit() for ch in token):
+            return 0.0
+        token_ngrams = self._ngrams_of(token)
+        best = 0.0
+        for name_token in name_tokens & self._common_tokens:
+            name_ngrams = self._ngrams_of(name_token)
+            best = max(best, 2.0 * len(token_ngrams & name_ngrams) / (len(token_ngrams) + len(name_ngrams)))
+        return best if best >= FUZZY_TOKEN_MIN_SIMILARITY else 0.0
+
+    def _ngrams_of(self, token):
+        ngrams = self._token_ngrams.get(token)
+        if ngrams is None:
+            ngrams = self._token_ngrams[token] = char_ngrams(token)
+        return ngrams
+
+    def search(self, query, limit=5):
+        """
+        Returns up to `limit` ranked (product, score) tuples for a product mention.
+        Scores are between 0.0 and 1.0; exact SKU or name matches score 1.0 (a name
+        shared by several products returns all of them). A fuzzy candidate is only
+        returned when every word of the query matches one of its name words (see
+        token_similarity), so variants that do not exist never resolve to a sibling.
+        """
+        if not query:
+            return []
+
+        # Exact SKU mentioned anywhere in the query
+        for candidate in _SKU_PATTERN.findall(str(query)):
+            product = self.get_by_sku(candidate)
+            if product:
+                return [(product, 1.0)]
+
+        normalized_query = normalize_text(query)
+        if not normalized_query:
+            return []
+
+        if normalized_query in self._duplicate_names:
+            return [(self._products[sku], 1.0) for sku in self._duplicate_names[normalized_query][:limit]]
+        exact_sku = self._by_name.get(normalized_query)
+        if exact_sku:
+            return [(self._products[exact_sku], 1.0)]
+
+        query_tokens = set(normalized_query.split())
+        query_ngrams = char_ngrams(normalized_query)
+
+        # Count shared n-grams per candidate straight from the postings lists
+        shared_ngrams = Counter()
+        for gram in query_ngrams:
+            shared_ngrams.update(self._ngram_postings.get(gram, ()))
+
+        scored = []
+        for sku, shared in shared_ngrams.items():
+            name_tokens = self._tokens[sku]
+            similarities = [self.token_similarity(token, name_tokens) for token in query_tokens]
+            if not all(similarities):
+                continue
+            token_score = sum(similarities) / len(query_tokens)
+            ngram_score = 2.0 * shared / (len(query_ngrams) + self._ngram_counts[sku])
+            score = TOKEN_WEIGHT * token_score + NGRAM_WEIGHT * ngram_score
+            scored.append((-score, sku))
+
+        scored.sort()
+        return [(self._products[sku], round(-neg_score, 4)) for neg_score, sku in scored[:limit]]
+
+    def rank_for_text(self, text, limit=20):
+        """
+        Returns up to `limit` SKUs of the products most relevant to a free-text email.
+        Products are scored by the IDF-weighted name tokens that appear in the text;
+        numeric tokens only count when an alphabetic token of the same name matched too.
+        SKUs mentioned verbatim are always ranked first.
+        """
+        mentioned_skus = []
+        for candidate in _SKU_PATTERN.findall(str(text)):
+            sku = self._by_sku.get(candidate.upper())
+            if sku and sku not in mentioned_skus:
+                mentioned_skus.append(sku)
+
+        text_tokens = set(tokenize(text))
+        word_scores = Counter()
+        number_scores = Counter()
+        for token in text_tokens:
+            skus = self._token_postings.get(token)
+            if not skus:
+                continue
+            target = number_scores if token.isdigit() else word_scores
+            idf = self._idf[token]
+            for sku in skus:
+                target[sku] += idf
+
+        scored = sorted(
+            (-(score + number_scores[sku]), sku)
+            for sku, score in word_scores.items()
+            if sku not in mentioned_skus
+        )
+        ranked = mentioned_skus + [sku for _, sku in scored]
+        return ranked[:limit]
+
+    def best_match(self, query, min_score=0.75, min_margin=0.05):
+        """
+        Returns the highest ranked (product, score) tuple, or (None, score) when the best
+        candidate scores below `min_score` or is ambiguous: the runner-up scores within
+        `min_margin` of it (e.g. a bare "Desk", or a name shared by several products).
+        """
+        matches = self.search(query, limit=2)
+        if not matches:
+            return None, 0.0
+        product, score = matches[0]
+        if score < min_score:
+            return None, score
+        if len(matches) > 1 and score - matches[1][1] < min_margin:
+            return None, score
+        return product, score
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Incremental catalog ingest.
+Streams the product CSV into a staging table with COPY, diffs it against the products
+table by content hash and applies only the inserts, updates and deletes, all in one
+transaction. Unchanged rows are never rewritten. When anything changed, the catalog
+version is bumped and a `catalog_changed` notification is sent so running backends
+invalidate their catalog cache.
+
+Usage:
+    python catalog_ingest.py [--csv PATH] [--no-delete] [--dry-run]
+"""
+
+import os
+import csv
+import time
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+from database import CATALOG_CHANGED_CHANNEL
+from setup_database import MIGRATIONS
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# --- Configuration ---
+CSV_FILE_PATH = "./product_data/Product Catalog.csv"
+CSV_COLUMNS = ["Product_Code", "Product_Name", "Price", "Available_in_Stock", "Min_Order_Quantity", "Description"]
+# Refuse to delete more than this fraction of the catalog in one run (e.g. a truncated CSV)
+MAX_DELETE_FRACTION = float(os.environ.get("CATALOG_INGEST_MAX_DELETE_FRACTION", "0.5"))
+
+# Content hash over every column the CSV owns; computed identically for both sides
+CONTENT_HASH = "md5(ROW({0}name, {0}price, {0}inventory, {0}min_order_qty, {0}description)::text)"
+
+def connect():
+    return psycopg2.connect(
+        host=os.environ.get("HOST"),
+        dbname=os.environ.get("DBNAME"),
+        user=os.environ.get("USER"),
+        password=os.environ.get("PASSWORD"),
+        port=os.environ.get("PORT", "5432"),
+    )
+
+def require_migrated_schema(cur):
+    """
+    Fails unless every schema migration of setup_database.py has been applied; the ingest
+    relies on the products, reservation and catalog_version tables they create.
+    """
+    latest = MIGRATIONS[-1][0]
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    version = None
+    if cur.fetchone()[0]:
+        cur.execute("SELECT max(version) FROM schema_migrations")
+        version = cur.fetchone()[0]
+    if version is None or version < latest:
+        raise ValueError(
+            f"Database schema is at version {version or 0}, expected {latest}: run setup_database.py first"
+        )
+
+def stage_csv(cur, csv_path):
+    """
+    Streams the CSV into a temporary staging table with COPY; nothing is held in memory.
+    Columns are staged as text so malformed rows can be counted instead of aborting COPY.
+    Returns the number of rows copied.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE products_staging (
+            line_no BIGSERIAL,
+            sku TEXT, name TEXT, price TEXT, inventory TEXT, min_order_qty TEXT, description TEXT
+        ) ON COMMIT DROP;
+    """)
+    with open(csv_path, mode="r", encoding="utf-8", newline="") as csvfile:
+        header = next(csv.reader([csvfile.readline()]), [])
+        if [column.strip() for column in header] != CSV_COLUMNS:
+            raise ValueError(f"Unexpected CSV header {header}, expected {CSV_COLUMNS}")
+        cur.copy_expert(
+            "COPY products_staging (sku, name, price, inventory, min_order_qty, description) FROM STDIN WITH (FORMAT csv)",
+            csvfile
+        )
+    cur.execute("SELECT count(*) FROM products_staging")
+    return cur.fetchone()[0]
+
+def build_incoming(cur):
+    """
+    Validates and types the staged rows into products_incoming (last row wins for
+    duplicate SKUs). Returns (valid rows, invalid rows).
+    """
+    cur.execute(f"""
+        CREATE TEMP TABLE products_incoming ON COMMIT DROP AS
+        SELECT DISTINCT ON (sku)
+            sku, name, price, inventory, min_order_qty, description,
+            {CONTENT_HASH.format('')} AS content_hash
+        FROM (
+            SELECT line_no, trim(sku) AS sku, name,
+                   price::numeric(10,2) AS price, inventory::integer AS inventory,
+                   min_order_qty::integer AS min_order_qty, description
+            FROM products_staging
+            WHERE trim(coalesce(sku, '')) <> '' AND trim(coalesce(name, '')) <> ''
+              AND price ~ '^\\s*[0-9]+(\\.[0-9]+)?\\s*$'
+              AND inventory ~ '^\\s*[0-9]+\\s*$'
+              AND min_order_qty ~ '^\\s*[0-9]+\\s*$'
+        ) typed
+        ORDER BY sku, line_no DESC;
+        CREATE UNIQUE INDEX ON products_incoming (sku);
+        ANALYZE products_incoming;
+    """)
+    cur.execute("SELECT count(*) FROM products_incoming")
+    valid = cur.fetchone()[0]
+    cur.execute("""
+        SELECT count(*) FROM products_staging
+        WHERE NOT (trim(coalesce(sku, '')) <> '' AND trim(coalesce(name, '')) <> ''
+              AND coalesce(price ~ '^\\s*[0-9]+(\\.[0-9]+)?\\s*$', false)
+              AND coalesce(inventory ~ '^\\s*[0-9]+\\s*$', false)
+              AND coalesce(min_order_qty ~ '^\\s*[0-9]+\\s*$', false))
+    """)
+    invalid = cur.fetchone()[0]
+    return valid, invalid
+
+def subtract_held_inventory(cur):
+    """
+    Turns the CSV stock of products_incoming into available stock by subtracting the
+    quantities of reservations that are still held, the same way reserve_inventory
+    decremented products.inventory. Releasing or expiring those reservations later adds
+    the quantities back, so stock ends at the CSV value instead of above it.
+    The products table is locked against reservations, releases and expiries (which all
+    update it) until the ingest commits, so the held totals cannot change in between.
+    Returns the number of SKUs with held stock.
+    """
+    cur.execute("LOCK TABLE products IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute("""
+        UPDATE products_incoming i SET
+            inventory = greatest(i.inventory - held.quantity, 0),
+            content_hash = md5(ROW(i.name, i.price, greatest(i.inventory - held.quantity, 0), i.min_order_qty, i.description)::text)
+        FROM (
+            SELECT ri.sku, SUM(ri.quantity) AS quantity
+            FROM reservation_items ri JOIN reservations r ON r.id = ri.reservation_id
+            WHERE r.status = 'held'
+            GROUP BY ri.sku
+        ) held
+        WHERE i.sku = held.sku
+    """)
+    return cur.rowcount
+
+def apply_delta(cur, delete_missing):
+    """
+    Applies the diff between products_incoming and products.
+    Returns a dictionary of inserted/updated/deleted/unchanged/kept row counts.
+    """
+    counts = {}
+
+    # Stock still held by reservations stays reserved
+    counts["held_skus"] = subtract_held_inventory(cur)
+
+    cur.execute(f"""
+        UPDATE products p SET
+            name = i.name, price = i.price, inventory = i.inventory,
+            min_order_qty = i.min_order_qty, description = i.description
+        FROM products_incoming i
+        WHERE p.sku = i.sku AND {CONTENT_HASH.format('p.')} <> i.content_hash
+    """)
+    counts["updated"] = cur.rowcount
+
+    cur.execute("""
+        INSERT INTO products (sku, name, price, inventory, min_order_qty, description)
+        SELECT i.sku, i.name, i.price, i.inventory, i.min_order_qty, i.description
+        FROM products_incoming i
+        WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.sku = i.sku)
+    """)
+    counts["inserted"] = cur.rowcount
+
+    counts["deleted"] = 0
+    counts["kept"] = 0
+    if delete_missing:
+        cur.execute("SELECT count(*) FROM products")
+        total = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM products p WHERE NOT EXISTS (SELECT 1 FROM products_incoming i WHERE i.sku = p.sku)")
+        missing = cur.fetchone()[0]
+        if total and missing / total > MAX_DELETE_FRACTION:
+            raise ValueError(
+                f"Refusing to delete {missing} of {total} products (more than {MAX_DELETE_FRACTION:.0%}); "
+                "check the CSV or run with --no-delete"
+            )
+
+        # Products still referenced by reservations cannot be deleted
+        cur.execute("""
+            DELETE FROM products p
+            WHERE NOT EXISTS (SELECT 1 FROM products_incoming i WHERE i.sku = p.sku)
+              AND NOT EXISTS (SELECT 1 FROM reservation_items r WHERE r.sku = p.sku)
+        """)
+        counts["deleted"] = cur.rowcount
+        counts["kept"] = missing - counts["deleted"]
+
+    return counts
+
+def bump_catalog_version(cur):
+    """
+    Increments the catalog version and notifies listening backends (delivered on commit).
+    """
+    cur.execute("""
+        INSERT INTO catalog_version (id, version) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET version = catalog_version.version + 1, updated_at = now()
+        RETURNING version
+    """)
+    version = cur.fetchone()[0]
+    cur.execute("SELECT pg_notify(%s, %s)", (CATALOG_CHANGED_CHANNEL, str(version)))
+    return version
+
+def ingest(csv_path, delete_missing=True, dry_run=False):
+    """
+    Runs the full ingest in one transaction and returns the report dictionary.
+    """
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            require_migrated_schema(cur)
+            started_at = time.perf_counter()
+            staged = stage_csv(cur, csv_path)
+            copy_seconds = time.perf_counter() - started_at
+
+            valid, invalid = build_incoming(cur)
+            if valid == 0:
+                raise ValueError("No valid products found in the CSV")
+
+            counts = apply_delta(cur, delete_missing)
+            counts["unchanged"] = valid - counts["updated"] - counts["inserted"]
+            changed = counts["inserted"] + counts["updated"] + counts["deleted"]
+
+            version = None
+            if dry_run:
+                conn.rollback()
+            else:
+                if changed:
+                    version = bump_catalog_version(cur)
+                conn.commit()
+            total_seconds = time.perf_counter() - started_at
+
+        return {
+            "rows_read": staged,
+            "rows_valid": valid,
+            "rows_invalid": invalid,
+            "copy_rows_per_second": round(staged / copy_seconds) if copy_seconds else None,
+            "total_rows_per_second": round(staged / total_seconds) if total_seconds else None,
+            "seconds": round(total_seconds, 3),
+            "catalog_version": version,
+            "dry_run": dry_run,
+            **counts
+        }
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental COPY-based catalog ingest")
+    parser.add_argument("--csv", default=CSV_FILE_PATH, help="Path to the product catalog CSV")
+    parser.add_argument("--no-delete", action="store_true", help="Keep products that are missing from the CSV")
+    parser.add_argument("--dry-run", action="store_true", help="Compute the delta and roll back")
+    args = parser.parse_args()
+
+    try:
+        print(f"Ingesting {args.csv}...")
+        report = ingest(args.csv, delete_missing=not args.no_delete, dry_run=args.dry_run)
+        print(f"Read {report['rows_read']} rows ({report['rows_invalid']} invalid) in {report['seconds']}s: "
+              f"COPY {report['copy_rows_per_second']} rows/s, end-to-end {report['total_rows_per_second']} rows/s")
+        print(f"Inserted: {report['inserted']}, updated: {report['updated']}, deleted: {report['deleted']}, "
+              f"unchanged: {report['unchanged']}, kept (still referenced): {report['kept']}, "
+              f"with held stock: {report['held_skus']}")
+        if report["dry_run"]:
+            print("Dry run: no changes were committed.")
+        elif report["catalog_version"] is not None:
+            print(f"Catalog version bumped to {report['catalog_version']}.")
+        else:
+            print("Catalog unchanged; version not bumped.")
+    except FileNotFoundError:
+        print(f"Error: The file {args.csv} was not found.")
+    except psycopg2.Error as e:
+        print(f"Database error: {e}")
+    except Exception as e:
+        print(f"Ingest failed: {e}")
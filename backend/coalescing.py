@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from result_cache import make_cache_key, normalize_email
+from metrics import COALESCED_REQUESTS
+
+# Load environment variables
+load_dotenv()
+
+# --- Request Coalescing Configuration ---
+REQUEST_COALESCING_ENABLED = os.environ.get("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+# How long the result for a client-supplied idempotency key is replayed after it completes
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+class IdempotencyKeyConflict(Exception):
+    """
+    Raised when an idempotency key is reused with different email content.
+    """
+
+class _Flight:
+    """
+    One in-flight pipeline execution that later identical requests attach to.
+    """
+
+    __slots__ = ("content_hash", "done", "result", "error")
+
+    def __init__(self, content_hash):
+        self.content_hash = content_hash
+        # threading.Event for the sync path, the shared asyncio task for the async path
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class RequestCoalescer:
+    """
+    Single-flight deduplication in front of the pipeline.
+    Concurrent requests with the same normalized email content (or the same client-supplied
+    idempotency key) attach to the one in-flight execution and share its result or error
+    instead of running the pipeline again. Results for idempotency keys are also replayed
+    for IDEMPOTENCY_TTL_SECONDS after completion, so a retried request never runs twice.
+    Every caller gets its own copy of the result; coalesced copies are marked in
+    metadata["coalesced"].
+    """
+
+    def __init__(self, idempotency_ttl_seconds=600, idempotency_max_entries=10000):
+        self.idempotency_ttl_seconds = idempotency_ttl_seconds
+        self.idempotency_max_entries = idempotency_max_entries
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._async_flights = {}
+        # idempotency key -> (content hash, serialized result, expiry)
+        self._completed = OrderedDict()
+        self._stats = {"executions": 0, "coalesced": 0, "replayed": 0, "conflicts": 0}
+
+    def run(self, email_content, func, idempotency_key=None):
+        """
+        Returns func()'s result, running it only if no identical request is in flight.
+        """
+        flight_key, content_hash = self._keys(email_content, idempotency_key)
+        with self._lock:
+            replay = self._replay(idempotency_key, content_hash)
+            if replay is None:
+                flight = self._flights.get(flight_key)
+                self._check_conflict(flight, content_hash)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[flight_key] = _Flight(content_hash)
+                    self._stats["executions"] += 1
+                else:
+                    self._stats["coalesced"] += 1
+        if replay is not None:
+            return replay
+
+        if not leader:
+            COALESCED_REQUESTS.inc(1, "in_flight")
+            flight.done.wait()
+            if flight.result is None:
+                raise flight.error or RuntimeError("Coalesced request failed")
+            return self._copy(flight.result, "in_flight")
+
+        try:
+            result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            flight.result = json.dumps(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+                if idempotency_key and flight.result is not None:
+                    self._remember(idempotency_key, content_hash, flight.result)
+            flight.done.set()
+
+    async def run_async(self, email_content, coroutine_func, idempotency_key=None):
+        """
+        Event-loop counterpart of run(): the execution runs as a shielded task, so it
+        completes for the attached requests even if the first client disconnects.
+        """
+        flight_key, content_hash = self._keys(email_content, idempotency_key)
+        with self._lock:
+            replay = self._replay(idempotency_key, content_hash)
+            if replay is None:
+                flight = self._async_flights.get(flight_key)
+                self._check_conflict(flight, content_hash)
+                leader = flight is None
+                if leader:
+                    flight = self._async_flights[flight_key] = _Flight(content_hash)
+                    flight.done = asyncio.ensure_future(coroutine_func())
+                    self._stats["executions"] += 1
+                else:
+                    self._stats["coalesced"] += 1
+        if replay is not None:
+            return replay
+
+        if leader:
+            flight.done.add_done_callback(lambda task: self._finish_async(flight_key, idempotency_key, content_hash, task))
+            return await asyncio.shield(flight.done)
+
+        COALESCED_REQUESTS.inc(1, "in_flight")
+        result = await asyncio.shield(flight.done)
+        return self._copy(json.dumps(result), "in_flight")
+
+    def stats(self):
+        """
+        Returns execution/coalesced/replayed counters and the number of in-flight executions.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "in_flight": len(self._flights) + len(self._async_flights),
+                "idempotency_entries": len(self._completed)
+            })
+            return stats
+
+    def _keys(self, email_content, idempotency_key):
+        content_hash = make_cache_key("order", normalize_email(email_content))
+        flight_key = f"key:{idempotency_key}" if idempotency_key else f"content:{content_hash}"
+        return flight_key, content_hash
+
+    def _check_conflict(self, flight, content_hash):
+        # Must be called with self._lock held
+        if flight is not None and flight.content_hash != content_hash:
+            self._stats["conflicts"] += 1
+            raise IdempotencyKeyConflict("Idempotency key was already used with different email content")
+
+    def _replay(self, idempotency_key, content_hash):
+        # Must be called with self._lock held; returns a copy of a completed keyed result
+        if not idempotency_key:
+            return None
+        entry = self._completed.get(idempotency_key)
+        if entry is None:
+            return None
+        stored_hash, serialized, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._completed[idempotency_key]
+            return None
+        if stored_hash != content_hash:
+            self._stats["conflicts"] += 1
+            raise IdempotencyKeyConflict("Idempotency key was already used with different email content")
+        self._stats["replayed"] += 1
+        COALESCED_REQUESTS.inc(1, "idempotent_replay")
+        return self._copy(serialized, "idempotent_replay")
+
+    def _remember(self, idempotency_key, content_hash, serialized):
+        # Must be called with self._lock held
+        self._completed[idempotency_key] = (content_hash, serialized, time.monotonic() + self.idempotency_ttl_seconds)
+        self._completed.move_to_end(idempotency_key)
+        while len(self._completed) > self.idempotency_max_entries:
+            self._completed.popitem(last=False)
+
+    def _finish_async(self, flight_key, idempotency_key, content_hash, task):
+        with self._lock:
+            del self._async_flights[flight_key]
+            if idempotency_key and not task.cancelled() and task.exception() is None:
+                self._remember(idempotency_key, content_hash, json.dumps(task.result()))
+
+    @staticmethod
+    def _copy(serialized, reason):
+        result = json.loads(serialized)
+        if isinstance(result.get("metadata"), dict):
+            result["metadata"]["coalesced"] = reason
+        return result
+
+_request_coalescer = None
+_request_coalescer_lock = threading.Lock()
+
+def get_request_coalescer():
+    """
+    Returns the process-wide request coalescer configured from the environment,
+    or None when REQUEST_COALESCING_ENABLED is false.
+    """
+    global _request_coalescer
+    if not REQUEST_COALESCING_ENABLED:
+        return None
+    with _request_coalescer_lock:
+        if _request_coalescer is None:
+            _request_coalescer = RequestCoalescer(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
+        return _request_coalescer
@@ -0,0 +1,236 @@
+import time
+import threading
+from collections import deque
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection became available within the checkout timeout.
+    """
+
+class BlockingConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+    Unlike psycopg2's SimpleConnectionPool, getconn() waits (up to a timeout) for a
+    connection to be returned instead of failing with "connection pool exhausted".
+    Connections are validated before reuse: closed connections and connections older
+    than max_lifetime are replaced, and connections idle for longer than max_idle are
+    pinged with SELECT 1 first. Wait time, checkout duration and exhaustion events are
+    tracked for monitoring.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=30.0, max_idle=300.0, max_lifetime=3600.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()        # (connection, created_at, returned_at), most recently returned last
+        self._in_use = {}           # id(connection) -> (connection, created_at, checked_out_at)
+        self._size = 0              # open connections plus connections being opened
+        self._waiting = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "checkout_seconds_total": 0.0,
+            "checkout_seconds_max": 0.0,
+            "exhaustion_events": 0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_recycled": 0,
+            "validation_failures": 0
+        }
+
+    def prewarm(self):
+        """
+        Opens connections until the pool holds at least minconn of them.
+        """
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                connection = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+            with self._cond:
+                self._idle.append((connection, time.monotonic(), time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self, timeout=None):
+        """
+        Checks out a connection, waiting up to `timeout` seconds (default: pool timeout)
+        for one to become available. Raises PoolTimeoutError when none does.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+        waited = False
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+
+                    # Pool exhausted: wait for a connection to be returned
+                    if not waited:
+                        waited = True
+                        self._stats["exhaustion_events"] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(f"No database connection available within {timeout:.1f}s (pool size {self.maxconn})")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            # Open or validate outside the lock so other threads are not blocked on I/O
+            if entry is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                created_at = time.monotonic()
+            else:
+                connection, created_at, returned_at = entry
+                if not self._is_usable(connection, created_at, returned_at):
+                    self._discard(connection)
+                    continue
+
+            now = time.monotonic()
+            wait_seconds = now - started_at
+            with self._cond:
+                self._in_use[id(connection)] = (connection, created_at, now)
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                self._stats["wait_seconds_total"] += wait_seconds
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait_seconds)
+            return connection
+
+    def putconn(self, connection, discard=False):
+        """
+        Returns a connection to the pool. Broken, expired or discarded connections are
+        closed and their slot is freed for a new connection.
+        """
+        now = time.monotonic()
+        with self._cond:
+            entry = self._in_use.pop(id(connection), None)
+            if entry is None:
+                raise PoolError("trying to put unkeyed connection")
+            _, created_at, checked_out_at = entry
+            checkout_seconds = now - checked_out_at
+            self._stats["checkout_seconds_total"] += checkout_seconds
+            self._stats["checkout_seconds_max"] = max(self._stats["checkout_seconds_max"], checkout_seconds)
+
+        if not discard and not connection.closed:
+            # Mirror psycopg2's pool: never hand out a connection with an open transaction
+            status = connection.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except Exception:
+                    discard = True
+
+        if discard or connection.closed or self._closed or now - created_at > self.max_lifetime:
+            self._discard(connection)
+            return
+
+        with self._cond:
+            self._idle.append((connection, created_at, now))
+            self._cond.notify()
+
+    def closeall(self):
+        """
+        Closes all idle connections and refuses further checkouts.
+        Connections still in use are closed when they are returned.
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for connection, _, _ in idle:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """
+        Returns pool sizes and checkout/wait/exhaustion metrics.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waiting": self._waiting
+            })
+        for key in ("wait_seconds_total", "wait_seconds_max", "checkout_seconds_total", "checkout_seconds_max"):
+            stats[key] = round(stats[key], 6)
+        return stats
+
+    def _connect(self):
+        connection = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self._stats["connections_opened"] += 1
+        return connection
+
+    def _is_usable(self, connection, created_at, returned_at):
+        now = time.monotonic()
+        if connection.closed or now - created_at > self.max_lifetime:
+            with self._cond:
+                self._stats["connections_recycled"] += 1
+            return False
+        if now - returned_at > self.max_idle:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except Exception:
+                with self._cond:
+                    self._stats["validation_failures"] += 1
+                return False
+        return True
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
@@ -1,77 +1,139 @@
 import os
+import time
+import select
+import logging
+import threading
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
 from dotenv import load_dotenv
 from contextlib import contextmanager
+from collections import namedtuple
+from catalog import Catalog
+from connection_pool import BlockingConnectionPool
+from metrics import DB_QUERIES
 
 # Load environment variables
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Global connection pool
 _connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+# --- Connection Pool Configuration ---
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+# How long a request waits for a free connection before failing
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "10"))
+# Idle connections older than this are checked with SELECT 1 before reuse
+DB_POOL_MAX_IDLE_SECONDS = float(os.environ.get("DB_POOL_MAX_IDLE_SECONDS", "300"))
+# Connections older than this are closed and replaced
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.environ.get("DB_POOL_MAX_LIFETIME_SECONDS", "3600"))
+
+# --- Catalog Cache Configuration ---
+# How long a catalog snapshot is served before a background refresh is triggered
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get("CATALOG_CACHE_TTL_SECONDS", "300"))
+# Minimum confidence score for a name match from the in-memory product index
+PRODUCT_MATCH_MIN_SCORE = float(os.environ.get("PRODUCT_MATCH_MIN_SCORE", "0.75"))
+# A match is ambiguous (not found) when the runner-up scores within this margin of it
+PRODUCT_MATCH_MIN_MARGIN = float(os.environ.get("PRODUCT_MATCH_MIN_MARGIN", "0.05"))
+# "on" listens for catalog_changed notifications from catalog_ingest.py and refreshes immediately
+CATALOG_CHANGE_LISTENER = os.environ.get("CATALOG_CHANGE_LISTENER", "on").lower()
+CATALOG_CHANGED_CHANNEL = "catalog_changed"
+
+# Requires schema migrations 4 and 5 from setup_database.py (name_normalized column and
+# trigram indexes). normalize_product_name() of a constant is folded at plan time, so the
+# substring predicate can use products_name_normalized_trgm_idx; similarity only ranks.
+PRODUCT_NAME_MATCH_QUERY = """
+    SELECT sku, name, price, min_order_qty, inventory,
+           similarity(name_normalized, normalize_product_name(%(product_name)s)) AS score
+    FROM products
+    WHERE name_normalized LIKE '%%' || normalize_product_name(%(product_name)s) || '%%'
+    ORDER BY name_normalized = normalize_product_name(%(product_name)s) DESC, score DESC, id
+    LIMIT 1
+"""
 
 def initialize_connection_pool():
     """
-    Initialize the database connection pool.
-    Should be called once when the application starts.
+    Initialize the database connection pool and pre-warm DB_POOL_MIN connections.
+    Should be called once when the application starts; safe to call from several threads.
     """
     global _connection_pool
-    try:
-        _connection_pool = psycopg2.pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            host=os.environ.get("HOST"),
-            database=os.environ.get("DBNAME"),
-            user=os.environ.get("USER"),
-            password=os.environ.get("PASSWORD"),
-            port=os.environ.get("PORT", "5432")
-        )
-        print("Database connection pool initialized successfully")
-    except Exception as e:
-        raise Exception(f"Failed to initialize connection pool: {str(e)}")
+    with _connection_pool_lock:
+        if _connection_pool is not None:
+            return
+        try:
+            connection_pool = BlockingConnectionPool(
+                minconn=DB_POOL_MIN,
+                maxconn=DB_POOL_MAX,
+                timeout=DB_POOL_TIMEOUT_SECONDS,
+                max_idle=DB_POOL_MAX_IDLE_SECONDS,
+                max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+                host=os.environ.get("HOST"),
+                database=os.environ.get("DBNAME"),
+                user=os.environ.get("USER"),
+                password=os.environ.get("PASSWORD"),
+                port=os.environ.get("PORT", "5432")
+            )
+            connection_pool.prewarm()
+            _connection_pool = connection_pool
+            logger.info("Database connection pool initialized successfully (min: %d, max: %d)", DB_POOL_MIN, DB_POOL_MAX)
+        except Exception as e:
+            raise Exception(f"Failed to initialize connection pool: {str(e)}")
 
 @contextmanager
 def get_database_connection():
     """
     Context manager for database connections.
-    Automatically handles connection borrowing and returning.
+    Automatically handles connection borrowing and returning. Blocks for up to
+    DB_POOL_TIMEOUT_SECONDS when all connections are in use.
     """
     if _connection_pool is None:
         initialize_connection_pool()
     
+    connection_pool = _connection_pool
     connection = None
+    broken = False
     try:
-        connection = _connection_pool.getconn()
+        connection = connection_pool.getconn()
         yield connection
     except Exception as e:
         if connection:
-            connection.rollback()
+            try:
+                connection.rollback()
+            except Exception:
+                broken = True
+        if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            broken = True
         raise Exception(f"Database operation failed: {str(e)}")
     finally:
         if connection:
-            _connection_pool.putconn(connection)
+            connection_pool.putconn(connection, discard=broken)
+
+def get_connection_pool_stats():
+    """
+    Returns connection pool sizes and wait/checkout/exhaustion metrics,
+    or None if the pool has not been initialized.
+    """
+    if _connection_pool is None:
+        return None
+    return _connection_pool.stats()
 
 def get_all_products_for_prompt():
     """
-    Fetches all products from the database and formats them for the AI prompt.
-    Returns a dictionary keyed by SKU for easy lookup and JSON serialization.
+    Fetches all products from the database as an immutable Catalog snapshot.
+    The Catalog is a read-only mapping keyed by SKU, ordered by SKU, whose products support
+    product['name']-style access.
     """
     try:
         with get_database_connection() as connection:
-            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            cursor = connection.cursor()
             
-            query = "SELECT sku, name, price, min_order_qty, inventory FROM products"
+            query = "SELECT sku, name, price, min_order_qty, inventory FROM products ORDER BY sku"
+            DB_QUERIES.inc(1, "all_products")
             cursor.execute(query)
             
-            products = {}
-            for row in cursor.fetchall():
-                products[row['sku']] = {
-                    "name": row['name'],
-                    "price": float(row['price']),
-                    "min_order_qty": row['min_order_qty'],
-                    "inventory": row['inventory']
-                }
+            products = Catalog.from_rows(cursor.fetchall())
             
             cursor.close()
             return products
@@ -89,6 +151,7 @@ def get_product_by_sku(sku):
             cursor = connection.cursor(cursor_factory=RealDictCursor)
             
             query = "SELECT sku, name, price, min_order_qty, inventory FROM products WHERE sku = %s"
+            DB_QUERIES.inc(1, "product_by_sku")
             cursor.execute(query, (sku,))
             
             row = cursor.fetchone()
@@ -111,23 +174,23 @@ def get_product_by_sku(sku):
 def get_product_by_name(product_name):
     """
     Fetches a specific product by name from the database.
-    Uses case-insensitive search and partial matching.
+    Matches the accent- and case-folded name column by substring (served by the trigram
+    GIN index) and returns the best-ranked match: an exact name first, then the most
+    similar name by trigram similarity. Similar names that do not contain the mention
+    (other variants of a product) never match.
     Returns a dictionary with product details or None if not found.
     """
     try:
         with get_database_connection() as connection:
             cursor = connection.cursor(cursor_factory=RealDictCursor)
             
-            # Use ILIKE for case-insensitive search and % for partial matching
-            query = "SELECT sku, name, price, min_order_qty, inventory FROM products WHERE name ILIKE %s"
-            cursor.execute(query, (f"%{product_name}%",))
+            DB_QUERIES.inc(1, "product_by_name")
+            cursor.execute(PRODUCT_NAME_MATCH_QUERY, {"product_name": str(product_name)})
             
-            rows = cursor.fetchall()
+            row = cursor.fetchone()
             cursor.close()
             
-            if rows:
-                # Return the first match (most relevant)
-                row = rows[0]
+            if row:
                 return {
                     "sku": row['sku'],
                     "name": row['name'],
@@ -141,12 +204,307 @@ def get_product_by_name(product_name):
     except Exception as e:
         raise Exception(f"Failed to fetch product by name '{product_name}': {str(e)}")
 
+class CatalogCache:
+    """
+    In-process cache for the product catalog returned by get_all_products_for_prompt.
+    Keeps a versioned snapshot in memory and refreshes it in a background thread once
+    the TTL has expired, so requests keep reading the previous snapshot instead of
+    waiting on the database. Only the very first load (or a load after a failed cold
+    start) is done synchronously. Loaders may also return a dictionary of product
+    dictionaries, which is converted to a Catalog.
+    """
+
+    def __init__(self, loader, ttl_seconds):
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._products = None
+        self._version = 0
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "invalidations": 0
+        }
+
+    def get(self):
+        """
+        Returns the current catalog snapshot (an immutable Catalog keyed by SKU).
+        The same Catalog object is shared by all requests until the contents change.
+        """
+        return self.get_versioned()[1]
+
+    def get_version(self):
+        """
+        Returns the version of the current snapshot, loading the catalog if needed.
+        The version only changes when the catalog contents change.
+        """
+        return self.get_versioned()[0]
+
+    def get_versioned(self):
+        """
+        Returns a consistent (version, products) pair for the current snapshot.
+        """
+        with self._lock:
+            if self._products is not None:
+                self._stats["hits"] += 1
+                self._schedule_refresh_if_stale()
+                return self._version, self._products
+            self._stats["misses"] += 1
+
+        # Cold cache: load synchronously, letting only one thread hit the database
+        with self._load_lock:
+            with self._lock:
+                if self._products is not None:
+                    return self._version, self._products
+            products = self.loader()
+            self._store(products)
+            with self._lock:
+                return self._version, self._products
+
+    def invalidate(self):
+        """
+        Marks the current snapshot as expired and starts a background refresh.
+        Requests keep being served from the old snapshot until the refresh completes.
+        """
+        with self._lock:
+            self._stats["invalidations"] += 1
+            self._loaded_at = 0.0
+            if self._products is not None:
+                self._schedule_refresh_if_stale()
+
+    def stats(self):
+        """
+        Returns hit/miss/refresh counters and snapshot details.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "version": self._version,
+                "products": len(self._products) if self._products is not None else 0,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 3) if self._products is not None else None,
+                "ttl_seconds": self.ttl_seconds,
+                "refreshing": self._refreshing
+            })
+            return stats
+
+    def _schedule_refresh_if_stale(self):
+        # Must be called with self._lock held
+        if self._refreshing or time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh, name="catalog-cache-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            products = self.loader()
+            self._store(products)
+            with self._lock:
+                self._stats["refreshes"] += 1
+        except Exception as e:
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+            logger.warning("Catalog cache refresh failed, serving previous snapshot: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _store(self, products):
+        if not isinstance(products, Catalog):
+            products = Catalog.from_mapping(products)
+        if products != self._products:
+            # Build the index and prompt text before publishing, so no request pays for them
+            products.prepare()
+        with self._lock:
+            if products != self._products:
+                self._products = products
+                self._version += 1
+            self._loaded_at = time.monotonic()
+
+_catalog_cache = CatalogCache(get_all_products_for_prompt, CATALOG_CACHE_TTL_SECONDS)
+
+def get_cached_products():
+    """
+    Returns the product catalog from the in-process cache.
+    Same shape as get_all_products_for_prompt, but only hits the database on a cold start.
+    """
+    return _catalog_cache.get()
+
+def get_catalog_version():
+    """
+    Returns the version number of the cached catalog snapshot.
+    """
+    return _catalog_cache.get_version()
+
+def invalidate_catalog_cache():
+    """
+    Expires the cached catalog and triggers a background refresh.
+    Call this after the products table has been modified.
+    """
+    _catalog_cache.invalidate()
+
+def get_catalog_cache_stats():
+    """
+    Returns hit/miss/refresh counters for the catalog cache.
+    """
+    return _catalog_cache.stats()
+
+class CatalogChangeListener:
+    """
+    Daemon thread that LISTENs on the catalog_changed channel (notified by catalog_ingest.py
+    when it bumps the catalog version) and invalidates the catalog cache, so a new catalog
+    is picked up immediately instead of after the cache TTL. Uses its own connection
+    outside the pool and reconnects with backoff if it is lost.
+    """
+
+    def __init__(self, channel=CATALOG_CHANGED_CHANNEL):
+        self.channel = channel
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-change-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(
+                    host=os.environ.get("HOST"),
+                    database=os.environ.get("DBNAME"),
+                    user=os.environ.get("USER"),
+                    password=os.environ.get("PASSWORD"),
+                    port=os.environ.get("PORT", "5432")
+                )
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                # Changes made while we were disconnected would otherwise be missed
+                invalidate_catalog_cache()
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], 5.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    if connection.notifies:
+                        versions = [notify.payload for notify in connection.notifies]
+                        connection.notifies.clear()
+                        logger.info("Catalog version %s published, invalidating catalog cache", versions[-1])
+                        invalidate_catalog_cache()
+            except Exception as e:
+                logger.warning("Catalog change listener failed, retrying in %.0fs: %s", backoff, e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+_catalog_listener = None
+_catalog_listener_lock = threading.Lock()
+
+def start_catalog_change_listener():
+    """
+    Starts the process-wide catalog change listener once (no-op when disabled).
+    """
+    global _catalog_listener
+    if CATALOG_CHANGE_LISTENER != "on":
+        return
+    with _catalog_listener_lock:
+        if _catalog_listener is None:
+            _catalog_listener = CatalogChangeListener()
+            _catalog_listener.start()
+
+CatalogSnapshot = namedtuple("CatalogSnapshot", ["version", "products", "index"])
+
+def get_product_index():
+    """
+    Returns the ProductNameIndex for the current catalog snapshot.
+    The index is built once per snapshot and shared by all requests.
+    """
+    return get_cached_products().index
+
+def get_catalog_snapshot():
+    """
+    Returns the current catalog as a CatalogSnapshot (version, products, index).
+    Pin one snapshot per order or batch so every stage sees the same catalog.
+    """
+    version, products = _catalog_cache.get_versioned()
+    return CatalogSnapshot(version, products, products.index)
+
+def find_product_by_name(product_name):
+    """
+    Resolves a product mention against the in-memory product index.
+    Returns a tuple of (product dictionary or None, confidence score).
+    The product dictionary has the same shape as get_product_by_name.
+    """
+    return get_product_index().best_match(product_name, PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN)
+
+def get_products_by_names(product_names):
+    """
+    Resolves a list of product names against the database in a single round-trip.
+    Each name is matched server-side with the same ranking as get_product_by_name.
+    Returns a list aligned with product_names containing a product
+    dictionary or None for each name.
+    """
+    if not product_names:
+        return []
+
+    try:
+        with get_database_connection() as connection:
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            # unnest ... WITH ORDINALITY keeps the results aligned with the input order
+            query = """
+                SELECT q.ord, p.sku, p.name, p.price, p.min_order_qty, p.inventory
+                FROM unnest(%s::text[]) WITH ORDINALITY AS q(product_name, ord)
+                CROSS JOIN LATERAL normalize_product_name(q.product_name) AS n(term)
+                LEFT JOIN LATERAL (
+                    SELECT sku, name, price, min_order_qty, inventory
+                    FROM products
+                    WHERE name_normalized LIKE '%%' || n.term || '%%'
+                    ORDER BY name_normalized = n.term DESC, similarity(name_normalized, n.term) DESC, id
+                    LIMIT 1
+                ) p ON TRUE
+                ORDER BY q.ord
+            """
+            DB_QUERIES.inc(1, "products_by_names")
+            cursor.execute(query, ([str(name) for name in product_names],))
+            
+            rows = cursor.fetchall()
+            cursor.close()
+            
+            return [
+                {
+                    "sku": row['sku'],
+                    "name": row['name'],
+                    "price": float(row['price']),
+                    "min_order_qty": row['min_order_qty'],
+                    "inventory": row['inventory']
+                } if row['sku'] is not None else None
+                for row in rows
+            ]
+            
+    except Exception as e:
+        raise Exception(f"Failed to fetch products by name: {str(e)}")
+
 def close_connection_pool():
     """
     Close the database connection pool.
     Should be called when the application shuts down.
     """
     global _connection_pool
-    if _connection_pool:
-        _connection_pool.closeall()
-        print("Database connection pool closed") 
\ No newline at end of file
+    with _connection_pool_lock:
+        if _connection_pool:
+            _connection_pool.closeall()
+            _connection_pool = None
+            logger.info("Database connection pool closed") 
\ No newline at end of file
@@ -0,0 +1,327 @@
+import re
+import threading
+from html import unescape
+from html.parser import HTMLParser
+from metrics import EMAIL_BYTES, EMAIL_BYTES_REMOVED
+from agents.rule_extractor import CLOSING_LINE, SKU_PATTERN, ORDER_CUE, is_signature_line
+
+# Anything that looks like markup of an HTML email body
+HTML_HINT = re.compile(r"<\s*(?:html|body|div|p|br|table|span|font|blockquote)\b", re.IGNORECASE)
+
+# Start of quoted reply history: Gmail/Apple "On <date>, <name> wrote:" (possibly wrapped
+# over two lines) and Outlook's "-----Original Message-----"
+REPLY_HEADER = re.compile(
+    r"^[ \t]*(?:On\s[^\n]{0,200}?(?:\n[^\n]{0,200}?)?\swrote:|-{2,}\s*Original Message\s*-{2,})[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+# Outlook reply header block without a separator line: "From: ..." followed by "Sent:" /
+# "Date:" and optionally "To:", "Cc:" and "Subject:" lines. Only a block with an address on
+# the From: line and a date on the Sent:/Date: line, and either a To:/Subject: line or a
+# blank line before it, is a header (see find_outlook_header)
+OUTLOOK_HEADER = re.compile(
+    r"^[ \t]*From:(?P<sender>[^\n]*)\n(?P<recipients>[ \t]*(?:To|Cc):[^\n]*\n)?"
+    r"[ \t]*(?:Sent|Date):(?P<date>[^\n]*)(?P<rest>(?:\n[ \t]*(?:To|Cc|Subject):[^\n]*)*)",
+    re.IGNORECASE | re.MULTILINE
+)
+HEADER_ADDRESS = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+|<[^<>\n]+>")
+MONTH = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+HEADER_DATE = re.compile(
+    r"\b(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[./]\d{1,2}[./]\d{2,4}"
+    rf"|{MONTH}\s+\d{{1,2}},?\s+\d{{4}}|\d{{1,2}}\.?\s+{MONTH}\s+\d{{4}})\b",
+    re.IGNORECASE
+)
+BLANK_LINE_AT_END = re.compile(r"(?:^|\n)[ \t]*\n$")
+# Forwarded message separators; the forwarded body is kept since it may hold the order
+FORWARD_MARKER = re.compile(
+    r"^[ \t]*(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+HEADER_LINE = re.compile(r"^[ \t]*(?:From|To|Cc|Bcc|Date|Sent|Subject|Reply-To):", re.IGNORECASE)
+
+# "-- " signature delimiter (RFC 3676) and mobile client signatures
+SIGNATURE_DELIMITER = re.compile(r"^--[ \t]*$", re.MULTILINE)
+MOBILE_SIGNATURE = re.compile(
+    r"^[ \t]*(?:Sent from my \w+[^\n]*|Sent from (?:Mail|Outlook|Yahoo Mail)[^\n]*|Get Outlook for \w+[^\n]*)$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Quantities ("12 x", "x 12", "qty 12", "5 chairs") that mark text as order content,
+# which is never removed as a signature or footer
+QUANTITY_HINT = re.compile(r"\b\d+\s*(?:x\b|[^\W\d_]{2,})|\bx\s*\d+\b|\bqty\b", re.IGNORECASE)
+
+# Legal footers: confidentiality notices, "intended recipient", unsubscribe and print footers.
+# The regex only runs on paragraphs containing one of the (lowercase) keywords, and only a
+# trailing block of such paragraphs with at least DISCLAIMER_MIN_MARKERS matches is removed.
+DISCLAIMER_KEYWORDS = ("recipient", "addressee", "received", "confidential", "privileged", "disclaimer", "unsubscribe", "environment", "virus")
+DISCLAIMER = re.compile(
+    r"\b(?:intended (?:solely )?(?:only )?for the (?:use of the )?(?:named )?(?:addressee|recipient)|"
+    r"if you (?:have received|are not the intended)|confidential(?:ity)? (?:notice|information)|"
+    r"(?:e-?mail|message)(?: and any (?:files|attachments)(?: transmitted with it)?)? (?:is|are|may be) (?:strictly )?(?:confidential|privileged)|"
+    r"disclaimer|unsubscribe|please consider the environment|virus(?:es)? (?:free|scan|check))",
+    re.IGNORECASE
+)
+DISCLAIMER_MIN_MARKERS = 2
+
+# Zero-width characters and soft hyphens are dropped, non-breaking spaces and tabs become spaces
+INVISIBLE_CHARACTERS = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad\r]")
+SPACE_CHARACTERS = re.compile("[\u00a0\t]")
+LINE_EDGE_SPACES = re.compile(r" *\n *")
+MULTIPLE_SPACES = re.compile(r" {2,}")
+MULTIPLE_BLANK_LINES = re.compile(r"\n{3,}")
+
+class _HtmlToText(HTMLParser):
+    """
+    Flattens an HTML email body to text: block elements become line breaks, list items
+    bullets, <blockquote> content is quoted with "> ", and scripts, styles and the head
+    are dropped.
+    """
+
+    BLOCK_TAGS = frozenset({"p", "div", "br", "tr", "table", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "blockquote", "pre"})
+    SKIPPED_TAGS = frozenset({"script", "style", "head", "title"})
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+        self.quote_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag == "td":
+            self.parts.append(" ")
+        if tag == "blockquote":
+            self.quote_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+        if tag == "blockquote":
+            self.quote_depth = max(self.quote_depth - 1, 0)
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        # Markup whitespace is not significant; line breaks come from the tags
+        data = " ".join(data.split()) if data.strip() else (" " if data else "")
+        if self.quote_depth and data.strip():
+            data = "> " + data
+        self.parts.append(data)
+
+    def text(self):
+        return "".join(self.parts)
+
+def html_to_text(html):
+    """
+    Converts an HTML email body to plain text.
+    """
+    parser = _HtmlToText()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # Malformed markup: fall back to dropping the tags
+        return unescape(re.sub(r"<[^>]+>", " ", html))
+    return parser.text()
+
+def _has_content(text):
+    return any(line.strip() and not line.lstrip().startswith(">") for line in text.splitlines())
+
+def remove_forward_headers(text):
+    """
+    Removes forwarded-message separators and the header lines right after them
+    (From:, Date:, Subject:, To:, ...), keeping the forwarded body.
+    """
+    while "forward" in text.lower():
+        match = FORWARD_MARKER.search(text)
+        if match is None:
+            return text
+        lines = text[match.end():].split("\n")
+        index = 1 if lines and not lines[0].strip() else 0
+        while index < len(lines) and (HEADER_LINE.match(lines[index]) or not lines[index].strip()):
+            index += 1
+        text = text[:match.start()] + "\n".join(lines[index:])
+    return text
+
+def has_order_content(text):
+    """
+    Returns True when the text contains a quantity or a SKU.
+    """
+    if not any(character.isdigit() for character in text):
+        # Both need a digit; only "qty" can mark a quantity without one
+        return "qty" in text.lower()
+    return bool(QUANTITY_HINT.search(text) or SKU_PATTERN.search(text))
+
+def find_outlook_header(text):
+    """
+    Returns the match of the first Outlook reply header block in the text, or None.
+    Body lines such as "From: Building A" followed by "Date: next Monday" are not headers.
+    """
+    for match in OUTLOOK_HEADER.finditer(text):
+        if not (HEADER_ADDRESS.search(match.group("sender")) and HEADER_DATE.search(match.group("date"))):
+            continue
+        before = text[:match.start()]
+        if match.group("recipients") or match.group("rest") or not before.strip() or BLANK_LINE_AT_END.search(before):
+            return match
+    return None
+
+def remove_quoted_reply(text):
+    """
+    Cuts quoted reply history: everything from the first reply header ("On ... wrote:",
+    "-----Original Message-----" or an Outlook From:/Sent: block) and every line quoted
+    with ">". When nothing but the quote would remain, the quoted text is kept without
+    its header and quote markers instead, since the order is then in the quote.
+    """
+    lowered = text.lower()
+    matches = []
+    if "wrote:" in lowered or "original message" in lowered:
+        matches.append(REPLY_HEADER.search(text))
+    if "from:" in lowered:
+        matches.append(find_outlook_header(text))
+    matches = [match for match in matches if match]
+    if matches:
+        start = min(match.start() for match in matches)
+        if _has_content(text[:start]):
+            text = text[:start]
+        else:
+            header = min(matches, key=lambda match: match.start())
+            text = text[:header.start()] + text[header.end():]
+
+    if ">" not in text:
+        return text
+    if _has_content(text):
+        return "\n".join(line for line in text.split("\n") if not line.lstrip().startswith(">"))
+    return "\n".join(re.sub(r"^\s*(?:>\s?)+", "", line) for line in text.split("\n"))
+
+def remove_signature(text):
+    """
+    Removes the signature: everything after a "-- " delimiter, mobile client signatures
+    ("Sent from my iPhone") and the lines after the last closing line ("Best regards,")
+    when every one of them looks like part of a signature (name, title, company, phone,
+    email address or URL; see agents.rule_extractor.is_signature_line) and none has an
+    order verb ("need", "please", "add", "send", ...), a quantity or a SKU. A P.S., a
+    question or an order line after the closing keeps the whole tail. The closing line
+    itself is kept.
+    """
+    match = SIGNATURE_DELIMITER.search(text) if "--" in text else None
+    if match and _has_content(text[:match.start()]):
+        text = text[:match.start()]
+    lowered = text.lower()
+    if "sent from" in lowered or "get outlook" in lowered:
+        text = MOBILE_SIGNATURE.sub("", text)
+
+    lines = text.rstrip().split("\n")
+    for index in range(len(lines) - 1, -1, -1):
+        line = lines[index].strip()
+        # Closings are short; skip the regex for everything else
+        if len(line) <= 40 and CLOSING_LINE.match(line):
+            trailing = lines[index + 1:]
+            if all(is_signature_line(line) and not ORDER_CUE.search(line.lower()) and not has_order_content(line) for line in trailing):
+                lines = lines[:index + 1]
+            break
+    return "\n".join(lines)
+
+def remove_disclaimers(text):
+    """
+    Drops the legal footer at the end of the email: the trailing paragraphs that read
+    like confidentiality, unsubscribe or environment notices, when together they contain
+    at least DISCLAIMER_MIN_MARKERS footer phrases. Everything before the last paragraph
+    without such a phrase, and any paragraph with a quantity or SKU, is always kept.
+    """
+    lowered = text.lower()
+    if not any(keyword in lowered for keyword in DISCLAIMER_KEYWORDS):
+        return text
+    paragraphs = re.split(r"\n[ \t]*\n", text)
+    start = len(paragraphs)
+    markers = 0
+    while start > 1:
+        paragraph = paragraphs[start - 1]
+        if paragraph.strip():
+            found = len(DISCLAIMER.findall(paragraph)) if any(keyword in paragraph.lower() for keyword in DISCLAIMER_KEYWORDS) else 0
+            if not found or has_order_content(paragraph):
+                break
+            markers += found
+        start -= 1
+    if markers < DISCLAIMER_MIN_MARKERS:
+        return text
+    return "\n\n".join(paragraphs[:start])
+
+def collapse_whitespace(text):
+    """
+    Removes invisible characters, trims every line, collapses runs of spaces and of
+    blank lines, and strips the result.
+    """
+    if not text.isascii():
+        text = SPACE_CHARACTERS.sub(" ", INVISIBLE_CHARACTERS.sub("", text))
+    elif "\t" in text or "\r" in text:
+        text = text.replace("\t", " ").replace("\r", "")
+    text = LINE_EDGE_SPACES.sub("\n", MULTIPLE_SPACES.sub(" ", text))
+    return MULTIPLE_BLANK_LINES.sub("\n\n", text).strip()
+
+class EmailPreprocessor:
+    """
+    Deterministic normalization of customer emails before extraction: HTML to text,
+    forwarded-header and quoted-reply removal, signature and disclaimer stripping and
+    whitespace collapse. Only text that never contains order lines is removed, so the
+    result is a smaller prompt for the same extraction.
+    """
+
+    STEPS = (
+        ("html", lambda text: html_to_text(text) if HTML_HINT.search(text) else text),
+        ("forward_headers", remove_forward_headers),
+        ("quoted_reply", remove_quoted_reply),
+        # Footers go first, so a signature followed by a footer is recognized as one
+        ("disclaimer", remove_disclaimers),
+        ("signature", remove_signature),
+        ("whitespace", collapse_whitespace),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"emails": 0, "input_bytes": 0, "output_bytes": 0}
+
+    def process(self, email_content):
+        """
+        Returns (cleaned text, report), where the report holds input and output sizes in
+        bytes and the bytes removed by each step.
+        """
+        text = str(email_content).replace("\r\n", "\n")
+        input_bytes = len(str(email_content).encode("utf-8"))
+        size = input_bytes
+        removed = {}
+        for step, func in self.STEPS:
+            text = func(text)
+            new_size = len(text.encode("utf-8"))
+            if new_size != size:
+                removed[step] = size - new_size
+                EMAIL_BYTES_REMOVED.inc(size - new_size, step)
+            size = new_size
+
+        EMAIL_BYTES.inc(input_bytes, "input")
+        EMAIL_BYTES.inc(size, "output")
+        with self._lock:
+            self._stats["emails"] += 1
+            self._stats["input_bytes"] += input_bytes
+            self._stats["output_bytes"] += size
+
+        return text, {
+            "input_bytes": input_bytes,
+            "output_bytes": size,
+            "bytes_removed": input_bytes - size,
+            "removed_by_step": removed
+        }
+
+    def stats(self):
+        """
+        Returns email and byte counters and the fraction of bytes removed.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["removed_fraction"] = round(1 - stats["output_bytes"] / stats["input_bytes"], 4) if stats["input_bytes"] else 0.0
+        return stats
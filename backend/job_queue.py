@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from dotenv import load_dotenv
+from metrics import JOB_WAIT_SECONDS, JOBS
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Job Queue Configuration ---
+# SQLite file holding the queue; job mode stays disabled until a path is configured
+JOB_QUEUE_DB_PATH = os.environ.get("JOB_QUEUE_DB_PATH", "")
+JOB_QUEUE_ENABLED = os.environ.get("JOB_QUEUE_ENABLED", "true").lower() == "true" and bool(JOB_QUEUE_DB_PATH)
+# Pipeline workers draining the queue
+JOB_QUEUE_WORKERS = int(os.environ.get("JOB_QUEUE_WORKERS", "4"))
+# Maximum queued (not yet running) jobs; further submissions are rejected
+JOB_QUEUE_MAX_DEPTH = int(os.environ.get("JOB_QUEUE_MAX_DEPTH", "10000"))
+# How long finished jobs (and their results) are kept for GET /api/jobs/<id>
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("JOB_RESULT_TTL_SECONDS", str(24 * 3600)))
+# Attempts per job; a job that was running when the process died is retried up to this many times
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# Lease on a running job, renewed while its worker is alive; jobs whose lease expired
+# (the worker process crashed or was recycled) are queued again by the other workers
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while JOB_QUEUE_MAX_DEPTH jobs are already queued.
+    """
+
+class JobQueue:
+    """
+    Durable job queue for the order pipeline backed by a local SQLite file.
+    Submitting inserts a "queued" row and returns immediately; a pool of worker threads
+    claims jobs in submission order, runs them through `handler(email_content)` and stores
+    the JSON result or error. While running, a job holds a lease that a heartbeat thread
+    renews every third of lease_seconds. Jobs whose lease expired were interrupted (the
+    process crashed, restarted or was recycled) and are queued again, up to
+    JOB_MAX_ATTEMPTS attempts: at startup and then by the heartbeat, so they are picked up
+    without a restart. Several processes may share the file; jobs another live process is
+    still running keep their lease and are never taken over.
+    """
+
+    def __init__(self, handler, db_path, workers=4, max_depth=10000,
+                 result_ttl_seconds=24 * 3600, max_attempts=3, recover=True, lease_seconds=60):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._started_at = None
+        self._busy_workers = 0
+        self._busy_seconds = 0.0
+        self._stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "recovered": 0, "lease_expired": 0}
+
+        self._db = open_job_database(db_path)
+        if recover:
+            self._stats["recovered"] = requeue_interrupted_jobs(self._db, max_attempts, expired_before=time.time())
+
+    def submit(self, email_content):
+        """
+        Queues an email and returns the new job id.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            depth = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if depth >= self.max_depth:
+                self._stats["rejected"] += 1
+                raise JobQueueFull(f"Job queue is full ({depth} jobs queued)")
+            self._db.execute(
+                "INSERT INTO jobs (id, status, email_content, enqueued_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, email_content, time.time())
+            )
+            self._db.commit()
+            self._stats["submitted"] += 1
+            self._wakeup.notify()
+        JOBS.inc(1, "submitted")
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns the job's status, timestamps and result or error, or None if it does not exist.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, result, error, attempts, enqueued_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            status, result, error, attempts, enqueued_at, started_at, finished_at = row
+            job = {
+                "job_id": job_id,
+                "status": status,
+                "attempts": attempts,
+                "enqueued_at": enqueued_at,
+                "started_at": started_at,
+                "finished_at": finished_at
+            }
+            if status == "queued":
+                job["position"] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND enqueued_at < ?", (enqueued_at,)
+                ).fetchone()[0]
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def start(self):
+        """
+        Starts the worker threads.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._started_at = time.perf_counter()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            self._threads.append(heartbeat)
+            heartbeat.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers after their current job and closes the database.
+        Jobs that are still queued stay in the file and run after the next start.
+        """
+        self._stop.set()
+        with self._lock:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        """
+        Returns queue depth, the wait time of the oldest queued job, worker utilization
+        (share of worker time spent running jobs since start) and job counters.
+        """
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._db.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            busy_seconds = self._busy_seconds
+            uptime = time.perf_counter() - self._started_at if self._started_at else 0.0
+            stats = dict(self._stats)
+            stats.update({
+                "depth": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "stored_results": counts.get("done", 0) + counts.get("failed", 0),
+                "oldest_wait_seconds": round(now - oldest, 3) if oldest else 0.0,
+                "workers": self.workers,
+                "busy_workers": self._busy_workers,
+                "worker_utilization": round(busy_seconds / (uptime * self.workers), 4) if uptime > 0 and self.workers else 0.0
+            })
+            return stats
+
+    def _claim(self):
+        # Must be called with self._lock held; returns (job_id, email_content, enqueued_at) or None.
+        # The conditional update keeps other processes sharing the file from claiming the same job.
+        now = time.time()
+        while True:
+            row = self._db.execute(
+                "SELECT id, email_content, enqueued_at FROM jobs WHERE status = 'queued' ORDER BY enqueued_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, lease_expires_at = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND status = 'queued'",
+                (now, now + self.lease_seconds, row[0])
+            ).rowcount
+            self._db.commit()
+            if claimed:
+                self._running.add(row[0])
+                return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # Must be called with self._lock held
+        self._running.discard(job_id)
+        self._db.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+            (status, result, error, time.time(), job_id)
+        )
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - self.result_ttl_seconds,)
+        )
+        self._db.commit()
+
+    def _heartbeat(self):
+        # Renews the leases of this process's running jobs and requeues expired ones
+        while not self._stop.wait(self.lease_seconds / 3):
+            now = time.time()
+            with self._lock:
+                try:
+                    if self._running:
+                        running = list(self._running)
+                        self._db.execute(
+                            f"UPDATE jobs SET lease_expires_at = ? WHERE status = 'running' AND id IN ({', '.join('?' * len(running))})",
+                            [now + self.lease_seconds] + running
+                        )
+                        self._db.commit()
+                    requeued = requeue_interrupted_jobs(self._db, self.max_attempts, expired_before=now)
+                except sqlite3.ProgrammingError:
+                    # Database closed by stop()
+                    return
+                if requeued:
+                    self._stats["lease_expired"] += requeued
+                    self._wakeup.notify_all()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                job = None
+                while not self._stop.is_set():
+                    job = self._claim()
+                    if job is not None:
+                        break
+                    self._wakeup.wait(1.0)
+                if job is None:
+                    return
+                self._busy_workers += 1
+
+            job_id, email_content, enqueued_at = job
+            JOB_WAIT_SECONDS.observe(max(time.time() - enqueued_at, 0.0))
+            started_at = time.perf_counter()
+            try:
+                result = json.dumps(self.handler(email_content))
+                status, error = "done", None
+            except Exception as e:
+                logger.error("Job %s failed: %s", job_id, e)
+                result, status, error = None, "failed", str(e)
+
+            with self._lock:
+                self._busy_workers -= 1
+                self._busy_seconds += time.perf_counter() - started_at
+                self._stats["completed" if status == "done" else "failed"] += 1
+                try:
+                    self._finish(job_id, status, result, error)
+                except sqlite3.ProgrammingError:
+                    # Database closed by stop(); the job is retried after restart
+                    return
+            JOBS.inc(1, "completed" if status == "done" else "failed")
+
+def open_job_database(db_path):
+    """
+    Opens (and creates if needed) the SQLite job database.
+    """
+    db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            email_content TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            lease_expires_at REAL
+        )
+    """)
+    # Files created before leases were added
+    columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+    if "lease_expires_at" not in columns:
+        db.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+    db.execute("CREATE INDEX IF NOT EXISTS jobs_status_enqueued_at ON jobs (status, enqueued_at)")
+    db.commit()
+    return db
+
+def requeue_interrupted_jobs(db, max_attempts, expired_before=None):
+    """
+    Queues jobs left "running" by a previous process again, or fails them once they
+    reached max_attempts. With expired_before, only jobs whose lease expired before that
+    time (or that have no lease) are affected; without it every running job is, which
+    is only safe when no other process uses the file. Returns the number of requeued jobs.
+    """
+    interrupted = "status = 'running'"
+    params = ()
+    if expired_before is not None:
+        interrupted += " AND (lease_expires_at IS NULL OR lease_expires_at < ?)"
+        params = (expired_before,)
+    requeued = db.execute(
+        f"UPDATE jobs SET status = 'queued', started_at = NULL, lease_expires_at = NULL WHERE {interrupted} AND attempts < ?",
+        params + (max_attempts,)
+    ).rowcount
+    db.execute(
+        f"UPDATE jobs SET status = 'failed', error = 'Job was interrupted too many times', finished_at = ?, "
+        f"lease_expires_at = NULL WHERE {interrupted}",
+        (time.time(),) + params
+    )
+    db.commit()
+    if requeued:
+        logger.info("Requeued %d interrupted jobs", requeued)
+    return requeued
+
+def recover_interrupted_jobs():
+    """
+    Recovers interrupted jobs (expired leases) in the configured job database once,
+    before worker processes start their queues with recover=False. No-op when job mode
+    is disabled.
+    """
+    if not JOB_QUEUE_ENABLED:
+        return 0
+    db = open_job_database(JOB_QUEUE_DB_PATH)
+    try:
+        return requeue_interrupted_jobs(db, JOB_MAX_ATTEMPTS, expired_before=time.time())
+    finally:
+        db.close()
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def start_job_queue(handler, recover=True):
+    """
+    Creates and starts the process-wide job queue configured from the environment,
+    or returns None when JOB_QUEUE_ENABLED is false.
+    """
+    global _job_queue
+    if not JOB_QUEUE_ENABLED:
+        return None
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(handler, JOB_QUEUE_DB_PATH, JOB_QUEUE_WORKERS, JOB_QUEUE_MAX_DEPTH,
+                                  JOB_RESULT_TTL_SECONDS, JOB_MAX_ATTEMPTS, recover, JOB_LEASE_SECONDS)
+            _job_queue.start()
+        return _job_queue
@@ -0,0 +1,174 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Logging Configuration ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for human-readable lines, "json" for one JSON object per line
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# Fraction of requests whose full payloads (AI responses, extraction data) are logged at DEBUG
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+# Payloads longer than this are truncated when rendered
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "500"))
+# Records beyond this many pending ones are dropped instead of blocking request threads
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+class Payload:
+    """
+    Lazily rendered, truncated log argument. Serialization only happens if the record
+    is actually emitted, e.g. logger.debug("Parsed data: %s", Payload(data)).
+    """
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars=None):
+        self.value = value
+        self.max_chars = max_chars or LOG_PAYLOAD_MAX_CHARS
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            text = self.value
+        else:
+            try:
+                text = json.dumps(self.value, ensure_ascii=False, default=str)
+            except (TypeError, ValueError):
+                text = repr(self.value)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... [{len(text) - self.max_chars} more chars]"
+        return text
+
+def should_log_payload(logger, level=logging.DEBUG):
+    """
+    True when payload logging is enabled at `level` and this call falls within the
+    LOG_PAYLOAD_SAMPLE_RATE sample. Check it before building payload log records.
+    """
+    return logger.isEnabledFor(level) and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the calling thread: the message is interpolated in the
+    caller (so later mutations of its arguments cannot change it), while the final
+    formatting and the stream I/O happen on the listener thread. Records are dropped and
+    counted when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects. Structured fields passed with
+    extra={"fields": {...}} are merged into the object.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """
+    Human-readable formatter that appends structured fields as key=value pairs.
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+def configure_logging():
+    """
+    Routes all logging through a bounded in-memory queue drained by a background
+    listener thread writing to stdout. Safe to call more than once.
+    """
+    global _listener, _queue_handler
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+
+        root = logging.getLogger()
+        root.handlers = [_queue_handler]
+        root.setLevel(LOG_LEVEL)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """
+    Flushes pending records and stops the listener thread.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def _restart_after_fork():
+    # The listener thread does not survive fork(); a forked worker gets its own queue and
+    # listener, otherwise its records would pile up in the queue and be dropped
+    global _listener, _configure_lock
+    _configure_lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        configure_logging()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+def get_dropped_log_records():
+    """
+    Number of records dropped because the log queue was full.
+    """
+    return _queue_handler.dropped if _queue_handler else 0
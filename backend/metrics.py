@@ -0,0 +1,239 @@
+import time
+import bisect
+import threading
+
+# Upper bounds (seconds) for latency histograms; covers sub-millisecond index lookups
+# up to slow Gemini calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    Monotonic counter with optional labels. Label values are passed positionally
+    in the order of labelnames.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """
+    Fixed-bucket histogram with optional labels. Observing is a bisect plus a few
+    increments under a lock; quantiles are estimated from the buckets at scrape time.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}   # labelvalues -> [bucket counts..., +Inf count], sum
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def quantile(self, q, *labelvalues):
+        """
+        Estimates the q-quantile by linear interpolation inside the matching bucket.
+        """
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                return None
+            counts = list(series[0])
+        return self._estimate(q, counts)
+
+    def _estimate(self, q, counts):
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index >= len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labelvalues, list(counts), total) for labelvalues, (counts, total) in self._series.items())
+        quantile_lines = []
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            for q in QUANTILES:
+                estimate = self._estimate(q, counts)
+                labels = _format_labels(self.labelnames, labelvalues, [("quantile", q)])
+                quantile_lines.append(f"{self.name}_quantile{labels} {_format_value(estimate)}")
+
+        if quantile_lines:
+            lines.append(f"# HELP {self.name}_quantile Estimated p50/p95/p99 of {self.name}")
+            lines.append(f"# TYPE {self.name}_quantile gauge")
+            lines.extend(quantile_lines)
+        return lines
+
+class MetricsRegistry:
+    """
+    Holds all metrics of the process and renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, gauges=None):
+        """
+        Renders all metrics. `gauges` optionally maps a metric prefix to a flat dictionary
+        of numeric stats (e.g. cache or pool stats), each rendered as a gauge.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats in (gauges or {}).items():
+            for key, value in sorted((stats or {}).items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# --- Pipeline Metrics ---
+STAGE_SECONDS = registry.histogram(
+    "order_pipeline_stage_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+REQUEST_SECONDS = registry.histogram(
+    "order_pipeline_request_seconds", "End-to-end pipeline time per order", ("execution",)
+)
+PROMPT_CHARS = registry.counter(
+    "order_pipeline_prompt_chars_total", "Characters sent to Gemini", ("stage",)
+)
+PROMPT_TOKENS = registry.counter(
+    "order_pipeline_prompt_tokens_estimated_total", "Estimated prompt tokens sent to Gemini", ("stage",)
+)
+PROMPT_COMPONENT_TOKENS = registry.counter(
+    "order_pipeline_prompt_component_tokens_estimated_total", "Estimated prompt tokens per prompt component (instructions, catalog, email, validated_data)", ("stage", "component")
+)
+PROMPT_BUDGET_OVERRUNS = registry.counter(
+    "order_pipeline_prompt_budget_overruns_total", "Prompts whose uncompacted size exceeded the stage token budget", ("stage",)
+)
+PROMPT_COMPACTIONS = registry.counter(
+    "order_pipeline_prompt_compaction_total", "Prompts by compaction level applied (0 = none)", ("stage", "level")
+)
+RESPONSE_CHARS = registry.counter(
+    "order_pipeline_response_chars_total", "Characters received from Gemini", ("stage",)
+)
+DB_QUERIES = registry.counter(
+    "order_pipeline_db_queries_total", "Database queries issued", ("query",)
+)
+VALIDATION_ISSUES = registry.counter(
+    "order_pipeline_validation_issues_total", "Validation issues reported", ("issue_type",)
+)
+EXTRACTION_PATHS = registry.counter(
+    "order_pipeline_extraction_path_total", "Extractions by path (rules, cache, llm)", ("path",)
+)
+RESERVATIONS = registry.counter(
+    "order_pipeline_reservations_total", "Inventory reservations by outcome (held, rejected, committed, released, expired)", ("outcome",)
+)
+COALESCED_REQUESTS = registry.counter(
+    "order_pipeline_coalesced_requests_total", "Requests served from another request's execution (in_flight, idempotent_replay)", ("reason",)
+)
+JOBS = registry.counter(
+    "order_pipeline_jobs_total", "Queued jobs by outcome (submitted, completed, failed)", ("outcome",)
+)
+JOB_WAIT_SECONDS = registry.histogram(
+    "order_pipeline_job_wait_seconds", "Time jobs spend queued before a worker picks them up"
+)
+GEMINI_CALLS = registry.counter(
+    "order_pipeline_gemini_calls_total", "Gemini call attempts by outcome (ok, error, timeout, retry, hedged, short_circuited)", ("stage", "outcome")
+)
+GEMINI_CALL_SECONDS = registry.histogram(
+    "order_pipeline_gemini_call_seconds", "Latency of successful Gemini calls, including retries and hedging", ("stage",)
+)
+EMAIL_BYTES = registry.counter(
+    "order_pipeline_email_bytes_total", "Email bytes before (input) and after (output) pre-processing", ("kind",)
+)
+EMAIL_BYTES_REMOVED = registry.counter(
+    "order_pipeline_email_bytes_removed_total", "Email bytes removed by each pre-processing step", ("step",)
+)
+PIPELINE_ERRORS = registry.counter(
+    "order_pipeline_errors_total", "Orders that failed with an error", ("execution",)
+)
+
+class time_stage:
+    """
+    Context manager recording the duration of the enclosed block in the stage latency
+    histogram. A plain class rather than a generator-based context manager to keep the
+    per-span overhead to about a microsecond.
+    """
+    __slots__ = ("stage", "started_at")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started_at, self.stage)
+        return False
@@ -0,0 +1,425 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+from metrics import GEMINI_CALLS, GEMINI_CALL_SECONDS
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Model Call Configuration ---
+# Total time budget per stage, including retries and hedged requests
+GEMINI_DEADLINE_SECONDS = {
+    "extraction": float(os.environ.get("GEMINI_EXTRACTION_DEADLINE_SECONDS", "30")),
+    "response": float(os.environ.get("GEMINI_RESPONSE_DEADLINE_SECONDS", "20")),
+}
+# Retries after the first attempt on transient errors (timeouts, 429, 5xx, connection errors)
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "2"))
+GEMINI_RETRY_BACKOFF_SECONDS = float(os.environ.get("GEMINI_RETRY_BACKOFF_SECONDS", "0.5"))
+GEMINI_RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get("GEMINI_RETRY_BACKOFF_MAX_SECONDS", "4"))
+# Hedging fires a second identical request once the first is slower than this latency
+# percentile of recent calls; the first response wins
+GEMINI_HEDGE_ENABLED = os.environ.get("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_QUANTILE = float(os.environ.get("GEMINI_HEDGE_QUANTILE", "0.95"))
+GEMINI_HEDGE_MIN_SECONDS = float(os.environ.get("GEMINI_HEDGE_MIN_SECONDS", "1"))
+# Successful calls per stage needed before the percentile is trusted
+GEMINI_HEDGE_MIN_SAMPLES = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+# Consecutive failed calls that open the circuit, and how long it stays open
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_FAILURE_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET_SECONDS = float(os.environ.get("GEMINI_BREAKER_RESET_SECONDS", "30"))
+# Threads running blocking model calls for the synchronous path
+GEMINI_CALL_THREADS = int(os.environ.get("GEMINI_CALL_THREADS", "32"))
+
+# Returned by next() when a stream is exhausted
+_STREAM_END = object()
+
+class ModelCallTimeout(Exception):
+    """
+    Raised when a model call does not finish within its stage deadline.
+    """
+
+class CircuitOpenError(Exception):
+    """
+    Raised without calling the model while the circuit breaker is open.
+    """
+
+def is_transient_error(error):
+    """
+    Returns True for errors worth retrying: timeouts, connection errors, rate limiting
+    and server-side failures of the Gemini API.
+    """
+    if isinstance(error, (ModelCallTimeout, TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if google_exceptions is not None and isinstance(error, (
+        google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded,
+        google_exceptions.GatewayTimeout
+    )):
+        return True
+    return False
+
+async def generate_content_async(model, prompt):
+    """
+    Calls the Gemini model without blocking the event loop.
+    Uses the SDK's native async method when available and falls back to running the
+    blocking call on the default thread executor (e.g. for stand-in models).
+    """
+    if hasattr(model, "generate_content_async"):
+        return await model.generate_content_async(prompt)
+    return await asyncio.to_thread(model.generate_content, prompt)
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker shared by all stages calling the same upstream.
+    After `failure_threshold` failed calls in a row the circuit opens and calls fail fast
+    for `reset_seconds`; then a single trial call is let through (half-open) and its
+    outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = {"opened": 0, "short_circuited": 0}
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if the call must not reach the upstream.
+        Returns True when the call is the half-open trial; the caller must then end it with
+        record_success(), record_failure() or release_trial().
+        """
+        with self._lock:
+            if self._state == "closed":
+                return False
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = "half_open"
+            if self._state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats["short_circuited"] += 1
+        raise CircuitOpenError("Gemini circuit breaker is open")
+
+    def release_trial(self):
+        """
+        Ends a half-open trial without an outcome (e.g. a non-transient error), so the
+        next call becomes the trial instead of the circuit staying shut for good.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                logger.info("Gemini circuit breaker closed")
+            self._state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                if self._state == "closed":
+                    logger.warning("Gemini circuit breaker opened after %d consecutive failures", self._failures)
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._stats["opened"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "state": self._state,
+                "open": 1 if self._state != "closed" else 0,
+                "consecutive_failures": self._failures
+            })
+            return stats
+
+class LatencyWindow:
+    """
+    Recent successful call latencies of one stage, used to derive the hedging delay.
+    """
+
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q, min_samples):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+_call_executor = None
+_call_executor_lock = threading.Lock()
+
+def get_call_executor():
+    """
+    Returns the shared thread pool that runs blocking model calls, so a call can be
+    abandoned at its deadline instead of pinning the request thread.
+    """
+    global _call_executor
+    with _call_executor_lock:
+        if _call_executor is None:
+            _call_executor = ThreadPoolExecutor(max_workers=GEMINI_CALL_THREADS, thread_name_prefix="gemini")
+        return _call_executor
+
+class ResilientModel:
+    """
+    Drop-in wrapper around a generative model (generate_content / generate_content_async)
+    for one pipeline stage. Each call gets the stage deadline, transient errors are retried
+    with jittered exponential backoff within that deadline, an optional hedged request is
+    fired once the first one exceeds the recent latency percentile, and a shared circuit
+    breaker fails fast while the upstream is degraded.
+    A timed-out synchronous call cannot be interrupted; it is abandoned on its thread.
+    """
+
+    def __init__(self, model, stage, breaker=None, deadline_seconds=None, max_retries=None,
+                 backoff_seconds=None, backoff_max_seconds=None, hedge=None,
+                 hedge_quantile=None, hedge_min_seconds=None, hedge_min_samples=None):
+        self.model = model
+        self.stage = stage
+        self.breaker = breaker or CircuitBreaker(GEMINI_BREAKER_FAILURE_THRESHOLD, GEMINI_BREAKER_RESET_SECONDS)
+        self.deadline_seconds = deadline_seconds or GEMINI_DEADLINE_SECONDS.get(stage, 30.0)
+        self.max_retries = GEMINI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = GEMINI_RETRY_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds or GEMINI_RETRY_BACKOFF_MAX_SECONDS
+        self.hedge = GEMINI_HEDGE_ENABLED if hedge is None else hedge
+        self.hedge_quantile = hedge_quantile or GEMINI_HEDGE_QUANTILE
+        self.hedge_min_seconds = GEMINI_HEDGE_MIN_SECONDS if hedge_min_seconds is None else hedge_min_seconds
+        self.hedge_min_samples = GEMINI_HEDGE_MIN_SAMPLES if hedge_min_samples is None else hedge_min_samples
+        self.latencies = LatencyWindow()
+
+    def hedge_delay(self):
+        """
+        Seconds after which a hedged request is fired, or None when hedging is off or
+        there are not enough samples yet.
+        """
+        if not self.hedge:
+            return None
+        threshold = self.latencies.quantile(self.hedge_quantile, self.hedge_min_samples)
+        if threshold is None:
+            return None
+        return max(threshold, self.hedge_min_seconds)
+
+    def backoff(self, attempt):
+        """
+        Full-jitter exponential backoff for the given retry number (1-based).
+        """
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempt - 1)))
+
+    def generate_content(self, prompt, stream=False):
+        """
+        Synchronous call with deadline, retries, hedging and circuit breaking.
+        Streaming calls get the same deadline and circuit breaking but are not retried or
+        hedged, since chunks are consumed by the caller as they arrive.
+        """
+        if stream:
+            return self._stream(prompt)
+
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            trial = self._before_call()
+            started_at = time.perf_counter()
+            try:
+                response = self._attempt(prompt, deadline)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._after_abort()
+                raise
+            else:
+                self._after_success(time.perf_counter() - started_at)
+                return response
+            finally:
+                if trial:
+                    self.breaker.release_trial()
+
+    async def generate_content_async(self, prompt):
+        """
+        Event-loop counterpart of generate_content().
+        """
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            trial = self._before_call()
+            started_at = time.perf_counter()
+            try:
+                response = await self._attempt_async(prompt, deadline)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled while waiting on the upstream
+                self._after_abort()
+                raise
+            else:
+                self._after_success(time.perf_counter() - started_at)
+                return response
+            finally:
+                if trial:
+                    self.breaker.release_trial()
+
+    def _attempt(self, prompt, deadline):
+        executor = get_call_executor()
+        pending = {executor.submit(self.model.generate_content, prompt)}
+        hedge_delay = self.hedge_delay()
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            can_hedge = hedge_delay is not None and len(pending) == 1 and error is None
+            done, pending = wait(pending, timeout=min(remaining, hedge_delay) if can_hedge else remaining,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if can_hedge and not done:
+                # The first request is slower than the hedging threshold: race a second one
+                GEMINI_CALLS.inc(1, self.stage, "hedged")
+                hedge_delay = None
+                pending.add(executor.submit(self.model.generate_content, prompt))
+        if pending or error is None:
+            raise ModelCallTimeout(f"Gemini {self.stage} call exceeded its {self.deadline_seconds:.1f}s deadline")
+        raise error
+
+    async def _attempt_async(self, prompt, deadline):
+        pending = {asyncio.ensure_future(generate_content_async(self.model, prompt))}
+        hedge_delay = self.hedge_delay()
+        error = None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                can_hedge = hedge_delay is not None and len(pending) == 1 and error is None
+                done, pending = await asyncio.wait(pending, timeout=min(remaining, hedge_delay) if can_hedge else remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if can_hedge and not done:
+                    GEMINI_CALLS.inc(1, self.stage, "hedged")
+                    hedge_delay = None
+                    pending.add(asyncio.ensure_future(generate_content_async(self.model, prompt)))
+            if pending or error is None:
+                raise ModelCallTimeout(f"Gemini {self.stage} call exceeded its {self.deadline_seconds:.1f}s deadline")
+            raise error
+        finally:
+            # Losing and timed-out requests are cancelled
+            for task in pending:
+                task.cancel()
+
+    def _stream(self, prompt):
+        """
+        Yields the chunks of a streaming call. Opening the stream and every chunk are
+        awaited on the call executor, so the whole stream shares the stage deadline and a
+        stalled upstream is abandoned like a hung unary call.
+        """
+        trial = self._before_call()
+        deadline = time.monotonic() + self.deadline_seconds
+        executor = get_call_executor()
+        try:
+            chunks = iter(self._stream_result(executor.submit(self.model.generate_content, prompt, stream=True), deadline))
+            while True:
+                chunk = self._stream_result(executor.submit(next, chunks, _STREAM_END), deadline)
+                if chunk is _STREAM_END:
+                    break
+                yield chunk
+        except Exception as e:
+            # Chunks may already have reached the caller, so streams are not retried
+            self._after_failure(e, self.max_retries, deadline)
+            raise
+        except BaseException:
+            # The consumer closed the stream (GeneratorExit) before it finished
+            self._after_abort()
+            raise
+        else:
+            self.breaker.record_success()
+            GEMINI_CALLS.inc(1, self.stage, "ok")
+        finally:
+            if trial:
+                self.breaker.release_trial()
+
+    def _stream_result(self, future, deadline):
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            raise ModelCallTimeout(f"Gemini {self.stage} stream exceeded its {self.deadline_seconds:.1f}s deadline") from None
+
+    def _before_call(self):
+        try:
+            return self.breaker.before_call()
+        except CircuitOpenError:
+            GEMINI_CALLS.inc(1, self.stage, "short_circuited")
+            raise
+
+    def _after_success(self, seconds):
+        self.breaker.record_success()
+        self.latencies.add(seconds)
+        GEMINI_CALL_SECONDS.observe(seconds, self.stage)
+        GEMINI_CALLS.inc(1, self.stage, "ok")
+
+    def _after_abort(self):
+        """
+        Records a call abandoned mid-flight (cancelled task, closed stream) as a failure,
+        since its outcome is unknown.
+        """
+        self.breaker.record_failure()
+        GEMINI_CALLS.inc(1, self.stage, "error")
+
+    def _after_failure(self, error, attempt, deadline):
+        """
+        Records a failed attempt and returns the backoff before the next retry, or None
+        when the error is not retried.
+        """
+        transient = is_transient_error(error)
+        if transient:
+            # Only upstream trouble counts against the breaker, not e.g. a malformed prompt;
+            # neither does it count as a success that would close a half-open circuit
+            self.breaker.record_failure()
+        GEMINI_CALLS.inc(1, self.stage, "timeout" if isinstance(error, ModelCallTimeout) else "error")
+
+        if not transient or attempt >= self.max_retries:
+            return None
+        delay = self.backoff(attempt + 1)
+        if time.monotonic() + delay >= deadline:
+            return None
+        GEMINI_CALLS.inc(1, self.stage, "retry")
+        logger.warning("Gemini %s call failed (%s), retry %d in %.2fs", self.stage, error, attempt + 1, delay)
+        return delay
@@ -0,0 +1,195 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from database import get_catalog_snapshot
+from metrics import time_stage, STAGE_SECONDS, REQUEST_SECONDS, PIPELINE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# --- Batch Configuration ---
+# Concurrent Gemini calls (extraction and response stages) per batch
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "8"))
+# Concurrent validation stages (database work) per batch
+BATCH_DB_CONCURRENCY = int(os.environ.get("BATCH_DB_CONCURRENCY", "4"))
+
+def log_order_completed(metadata, started_at):
+    """
+    Emits one INFO record per processed order with its key metadata as structured fields.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Order processed", extra={"fields": {
+            "execution": metadata.get("execution"),
+            "duration_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            "db_queries": metadata.get("validation", {}).get("db_queries"),
+            "response_path": metadata.get("response_path")
+        }})
+
+class OrderPipeline:
+    """
+    Orchestrates the three-agent pipeline:
+    Email Text -> [Agent 1: Extractor] -> Raw JSON -> [Agent 2: DB Validator] -> Validated Order -> [Agent 3: Response Agent] -> Final Response
+    Provides a synchronous path (one worker thread per order), an asyncio path
+    (many in-flight orders per event loop), a streaming path and a concurrent batch path.
+    """
+
+    def __init__(self, extraction_agent, validation_agent, response_agent):
+        self.extraction_agent = extraction_agent
+        self.validation_agent = validation_agent
+        self.response_agent = response_agent
+
+    def run(self, email_content, metadata=None, snapshot=None, llm_slots=None, db_slots=None):
+        """
+        Runs the pipeline synchronously and returns the final response.
+        Per-request metadata collected by the agents is attached under "metadata".
+        All stages use the same catalog snapshot; llm_slots and db_slots are optional
+        semaphores bounding how many orders run the LLM and database stages at once.
+        """
+        if metadata is None:
+            metadata = {}
+        metadata["execution"] = "sync"
+        started_at = time.perf_counter()
+
+        try:
+            if snapshot is None:
+                with time_stage("catalog_fetch"):
+                    snapshot = get_catalog_snapshot()
+
+            # Step 1: Agent 1 - Extract raw order details
+            logger.debug("Step 1: Agent 1 (Extractor) processing...")
+            with llm_slots or nullcontext():
+                raw_extraction_data = self.extraction_agent.extract_details(email_content, metadata, snapshot)
+            logger.debug("Agent 1 completed. Extracted %d items", len(raw_extraction_data.get("items", [])))
+
+            # Step 2: Agent 2 - Database validation
+            logger.debug("Step 2: Agent 2 (DB Validator) processing...")
+            with db_slots or nullcontext(), time_stage("db_validation"):
+                validated_order = self.validation_agent.validate_order(raw_extraction_data, metadata, snapshot)
+            logger.debug("Agent 2 completed. Validated: %d items, Issues: %d",
+                         len(validated_order.get("validated_items", [])), len(validated_order.get("issues", [])))
+
+            # Step 3: Agent 3 - Generate customer response
+            logger.debug("Step 3: Agent 3 (Response Agent) processing...")
+            with llm_slots or nullcontext(), time_stage("response_generation"):
+                final_response = self.response_agent.generate_customer_response(validated_order, metadata, snapshot)
+            logger.debug("Agent 3 completed. Response generated.")
+
+        except Exception:
+            PIPELINE_ERRORS.inc(1, "sync")
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started_at, "sync")
+
+        final_response["metadata"] = metadata
+        log_order_completed(metadata, started_at)
+        return final_response
+
+    async def run_async(self, email_content, metadata=None):
+        """
+        Runs the pipeline on the event loop: Gemini calls are awaited and catalog loads,
+        cache access and database work run off-loop, so a single process can hold many
+        orders in flight.
+        """
+        if metadata is None:
+            metadata = {}
+        metadata["execution"] = "async"
+        started_at = time.perf_counter()
+
+        try:
+            with time_stage("catalog_fetch"):
+                # Blocks on the database when the catalog cache is cold
+                snapshot = await asyncio.to_thread(get_catalog_snapshot)
+
+            raw_extraction_data = await self.extraction_agent.extract_details_async(email_content, metadata, snapshot)
+            with time_stage("db_validation"):
+                validated_order = await self.validation_agent.validate_order_async(raw_extraction_data, metadata, snapshot)
+            with time_stage("response_generation"):
+                final_response = await self.response_agent.generate_customer_response_async(validated_order, metadata, snapshot)
+
+        except Exception:
+            PIPELINE_ERRORS.inc(1, "async")
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started_at, "async")
+
+        final_response["metadata"] = metadata
+        log_order_completed(metadata, started_at)
+        return final_response
+
+    def run_streaming(self, email_content, metadata=None):
+        """
+        Runs the pipeline and yields (event, payload) tuples as results become available:
+            ("order_summary", {...})  as soon as validation finishes
+            ("token", {"text": "..."}) for each chunk of the customer email
+            ("done", {"metadata": {...}}) once the email is complete
+        Time to first byte (order summary) and to first token are recorded under
+        metadata["streaming"].
+        """
+        if metadata is None:
+            metadata = {}
+        metadata["execution"] = "stream"
+        started_at = time.perf_counter()
+
+        try:
+            with time_stage("catalog_fetch"):
+                snapshot = get_catalog_snapshot()
+
+            raw_extraction_data = self.extraction_agent.extract_details(email_content, metadata, snapshot)
+            with time_stage("db_validation"):
+                validated_order = self.validation_agent.validate_order(raw_extraction_data, metadata, snapshot)
+
+            streaming = metadata["streaming"] = {}
+            streaming["time_to_first_byte_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+            yield "order_summary", self.response_agent.build_order_summary(validated_order)
+
+            response_started_at = time.perf_counter()
+            for text in self.response_agent.stream_customer_response(validated_order, metadata, snapshot):
+                if "time_to_first_token_ms" not in streaming:
+                    streaming["time_to_first_token_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+                yield "token", {"text": text}
+            STAGE_SECONDS.observe(time.perf_counter() - response_started_at, "response_generation")
+
+        except Exception:
+            PIPELINE_ERRORS.inc(1, "stream")
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started_at, "stream")
+
+        streaming["total_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+        logger.info("Streaming response completed. TTFB: %s ms, first token: %s ms, total: %s ms",
+                    streaming["time_to_first_byte_ms"], streaming.get("time_to_first_token_ms"), streaming["total_ms"])
+        yield "done", {"metadata": metadata}
+
+    def run_batch(self, emails, llm_concurrency=None, db_concurrency=None):
+        """
+        Runs many emails through the pipeline with bounded concurrency.
+        The catalog snapshot is fetched once for the whole batch. Yields one result per
+        email as soon as it completes, in completion order:
+            {"index": i, "status": "ok", "result": {...}} or {"index": i, "status": "error", "error": "..."}
+        A failing email never affects the others.
+        """
+        llm_concurrency = llm_concurrency or BATCH_LLM_CONCURRENCY
+        db_concurrency = db_concurrency or BATCH_DB_CONCURRENCY
+        with time_stage("catalog_fetch"):
+            snapshot = get_catalog_snapshot()
+        llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        db_slots = threading.BoundedSemaphore(db_concurrency)
+
+        executor = ThreadPoolExecutor(max_workers=llm_concurrency + db_concurrency, thread_name_prefix="batch")
+        try:
+            futures = {
+                executor.submit(self.run, email_content, None, snapshot, llm_slots, db_slots): index
+                for index, email_content in enumerate(emails)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    yield {"index": index, "status": "ok", "result": future.result()}
+                except Exception as e:
+                    yield {"index": index, "status": "error", "error": str(e)}
+        finally:
+            # Stop queued work if the consumer goes away (e.g. the client disconnects)
+            executor.shutdown(wait=False, cancel_futures=True)
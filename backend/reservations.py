@@ -0,0 +1,259 @@
+import os
+import uuid
+import logging
+import threading
+from psycopg2.extras import RealDictCursor
+from database import get_database_connection
+from metrics import DB_QUERIES, RESERVATIONS
+
+logger = logging.getLogger(__name__)
+
+# --- Inventory Reservation Configuration ---
+# How long reserved stock is held before it is returned to inventory
+RESERVATION_TTL_SECONDS = int(os.environ.get("RESERVATION_TTL_SECONDS", "900"))
+# How often the background reaper returns expired reservations to inventory
+RESERVATION_REAP_INTERVAL_SECONDS = float(os.environ.get("RESERVATION_REAP_INTERVAL_SECONDS", "30"))
+# Maximum reservations expired per reaper statement
+RESERVATION_REAP_BATCH_SIZE = int(os.environ.get("RESERVATION_REAP_BATCH_SIZE", "500"))
+
+def reserve_inventory(items, ttl_seconds=None):
+    """
+    Atomically reserves stock for all items of an order.
+    `items` is a list of (sku, quantity) tuples; quantities of repeated SKUs are summed.
+
+    Every SKU is decremented with a conditional UPDATE ... WHERE inventory >= quantity in a
+    single transaction, in SKU order so concurrent multi-item orders cannot deadlock. Only
+    the product rows involved are locked, and only until the transaction commits. If any
+    SKU is short, the whole transaction is rolled back and nothing is reserved.
+
+    Returns:
+        tuple: (reservation dict with reservation_id, expires_at and items, or None;
+        dict of short SKUs mapped to their currently available inventory)
+    """
+    quantities = {}
+    for sku, quantity in items:
+        quantities[sku] = quantities.get(sku, 0) + int(quantity)
+    if not quantities:
+        return None, {}
+    ttl_seconds = RESERVATION_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+
+    try:
+        with get_database_connection() as connection:
+            cursor = connection.cursor()
+            shortages = {}
+            for sku in sorted(quantities):
+                DB_QUERIES.inc(1, "reserve_inventory")
+                cursor.execute(
+                    "UPDATE products SET inventory = inventory - %s WHERE sku = %s AND inventory >= %s RETURNING inventory",
+                    (quantities[sku], sku, quantities[sku])
+                )
+                if cursor.fetchone() is None:
+                    cursor.execute("SELECT inventory FROM products WHERE sku = %s", (sku,))
+                    row = cursor.fetchone()
+                    shortages[sku] = row[0] if row else 0
+
+            if shortages:
+                connection.rollback()
+                cursor.close()
+                RESERVATIONS.inc(1, "rejected")
+                return None, shortages
+
+            reservation_id = uuid.uuid4().hex
+            cursor.execute(
+                "INSERT INTO reservations (id, expires_at) VALUES (%s, now() + %s * interval '1 second') RETURNING expires_at",
+                (reservation_id, ttl_seconds)
+            )
+            expires_at = cursor.fetchone()[0]
+            cursor.execute(
+                """
+                INSERT INTO reservation_items (reservation_id, sku, quantity)
+                SELECT %s, sku, quantity FROM unnest(%s::text[], %s::int[]) AS r(sku, quantity)
+                """,
+                (reservation_id, list(quantities), list(quantities.values()))
+            )
+            connection.commit()
+            cursor.close()
+
+            RESERVATIONS.inc(1, "held")
+            return {
+                "reservation_id": reservation_id,
+                "expires_at": expires_at.isoformat(),
+                "items": quantities
+            }, {}
+
+    except Exception as e:
+        raise Exception(f"Failed to reserve inventory: {str(e)}")
+
+def release_reservation(reservation_id):
+    """
+    Cancels a held reservation and returns its stock to inventory.
+    The status transition is conditional, so a reservation is released at most once even
+    if release, commit and expiry race. Returns True if the reservation was released.
+    """
+    return _finish_reservation(reservation_id, "released", restore_inventory=True)
+
+def commit_reservation(reservation_id):
+    """
+    Marks a held reservation as committed (e.g. once the order is confirmed); the stock
+    stays deducted. Returns True if the reservation was committed.
+    """
+    return _finish_reservation(reservation_id, "committed", restore_inventory=False)
+
+def _finish_reservation(reservation_id, status, restore_inventory):
+    try:
+        with get_database_connection() as connection:
+            cursor = connection.cursor()
+            DB_QUERIES.inc(1, f"reservation_{status}")
+            cursor.execute(
+                "UPDATE reservations SET status = %s WHERE id = %s AND status = 'held' RETURNING id",
+                (status, reservation_id)
+            )
+            finished = cursor.fetchone() is not None
+            if finished and restore_inventory:
+                _restore_inventory(cursor, [reservation_id])
+            connection.commit()
+            cursor.close()
+            if finished:
+                RESERVATIONS.inc(1, status)
+            return finished
+
+    except Exception as e:
+        raise Exception(f"Failed to update reservation: {str(e)}")
+
+def get_reservation(reservation_id):
+    """
+    Returns a reservation with its items, or None if it does not exist.
+    """
+    try:
+        with get_database_connection() as connection:
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            DB_QUERIES.inc(1, "get_reservation")
+            cursor.execute(
+                """
+                SELECT r.id, r.status, r.created_at, r.expires_at,
+                       COALESCE(json_object_agg(ri.sku, ri.quantity) FILTER (WHERE ri.sku IS NOT NULL), '{}') AS items
+                FROM reservations r
+                LEFT JOIN reservation_items ri ON ri.reservation_id = r.id
+                WHERE r.id = %s
+                GROUP BY r.id
+                """,
+                (reservation_id,)
+            )
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+                return None
+            return {
+                "reservation_id": row["id"],
+                "status": row["status"],
+                "created_at": row["created_at"].isoformat(),
+                "expires_at": row["expires_at"].isoformat(),
+                "items": row["items"]
+            }
+
+    except Exception as e:
+        raise Exception(f"Failed to fetch reservation: {str(e)}")
+
+def expire_reservations(limit=None):
+    """
+    Expires held reservations past their expiry time and returns their stock to inventory
+    in one transaction. Rows locked by a concurrent release or commit are skipped and
+    picked up on the next run. Returns the number of reservations expired.
+    """
+    limit = limit or RESERVATION_REAP_BATCH_SIZE
+    try:
+        with get_database_connection() as connection:
+            cursor = connection.cursor()
+            DB_QUERIES.inc(1, "expire_reservations")
+            cursor.execute(
+                """
+                UPDATE reservations SET status = 'expired'
+                WHERE id IN (
+                    SELECT id FROM reservations
+                    WHERE status = 'held' AND expires_at < now()
+                    ORDER BY expires_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+                """,
+                (limit,)
+            )
+            expired_ids = [row[0] for row in cursor.fetchall()]
+            if expired_ids:
+                _restore_inventory(cursor, expired_ids)
+            connection.commit()
+            cursor.close()
+            if expired_ids:
+                RESERVATIONS.inc(len(expired_ids), "expired")
+            return len(expired_ids)
+
+    except Exception as e:
+        raise Exception(f"Failed to expire reservations: {str(e)}")
+
+def _restore_inventory(cursor, reservation_ids):
+    """
+    Adds the reserved quantities back to inventory. Product rows are locked in SKU order
+    first, the same order reserve_inventory uses, so the two cannot deadlock.
+    """
+    cursor.execute(
+        """
+        SELECT p.sku FROM products p
+        WHERE p.sku IN (SELECT sku FROM reservation_items WHERE reservation_id = ANY(%s))
+        ORDER BY p.sku
+        FOR UPDATE
+        """,
+        (reservation_ids,)
+    )
+    cursor.execute(
+        """
+        UPDATE products p SET inventory = p.inventory + totals.quantity
+        FROM (
+            SELECT sku, SUM(quantity) AS quantity FROM reservation_items
+            WHERE reservation_id = ANY(%s)
+            GROUP BY sku
+        ) totals
+        WHERE p.sku = totals.sku
+        """,
+        (reservation_ids,)
+    )
+
+class ReservationReaper:
+    """
+    Daemon thread that periodically returns expired reservations to inventory.
+    """
+
+    def __init__(self, interval_seconds=None):
+        self.interval_seconds = interval_seconds or RESERVATION_REAP_INTERVAL_SECONDS
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reservation-reaper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                # Drain the backlog in batches
+                while expire_reservations() >= RESERVATION_REAP_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logger.warning("Reservation expiry failed: %s", e)
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+def start_reservation_reaper():
+    """
+    Starts the process-wide reservation reaper once.
+    """
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = ReservationReaper()
+            _reaper.start()
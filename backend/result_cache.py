@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Result Cache Configuration ---
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024"))
+# Optional on-disk tier; leave empty to keep the cache in memory only
+RESULT_CACHE_DB_PATH = os.environ.get("RESULT_CACHE_DB_PATH", "")
+RESULT_CACHE_DB_MAX_BYTES = int(os.environ.get("RESULT_CACHE_DB_MAX_BYTES", str(64 * 1024 * 1024)))
+
+def normalize_email(email_content):
+    """
+    Normalizes email text for cache keys: trims and collapses all runs of whitespace.
+    """
+    return " ".join(str(email_content).split())
+
+def make_cache_key(*parts):
+    """
+    Builds a content-addressed key (SHA-256 hex digest) from JSON-serializable parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    Two-tier memoization cache for Gemini results.
+    Values are JSON-serializable objects stored as JSON text, so every hit returns a fresh copy.
+    Tier 1 is an in-memory LRU; tier 2 is an optional SQLite file evicted by total size,
+    least recently used first.
+    """
+
+    def __init__(self, max_entries=1024, db_path="", db_max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.db_max_bytes = db_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._db_bytes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_evictions": 0}
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS result_cache_accessed_at ON result_cache (accessed_at)")
+            self._db.commit()
+            self._db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()[0]
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return json.loads(value)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM result_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE result_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, row[0])
+                    self._stats["disk_hits"] += 1
+                    return json.loads(row[0])
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        """
+        Stores a JSON-serializable value in both tiers.
+        """
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, serialized)
+            self._stats["stores"] += 1
+
+            if self._db is not None:
+                size = len(serialized.encode("utf-8"))
+                previous = self._db.execute("SELECT size FROM result_cache WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, serialized, size, time.time())
+                )
+                self._db_bytes += size - (previous[0] if previous else 0)
+                self._evict_disk()
+                self._db.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters and tier sizes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk_enabled": self._db is not None,
+                "disk_bytes": self._db_bytes
+            })
+            return stats
+
+    def close(self):
+        """
+        Closes the on-disk tier.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, serialized):
+        # Must be called with self._lock held
+        self._memory[key] = serialized
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # Must be called with self._lock held; drops least recently used rows until under budget
+        while self._db_bytes > self.db_max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM result_cache ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._db_bytes = 0
+                return
+            for key, size in rows:
+                if self._db_bytes <= self.db_max_bytes:
+                    break
+                self._db.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                self._db_bytes -= size
+                self._stats["disk_evictions"] += 1
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """
+    Returns the process-wide result cache configured from the environment,
+    or None when RESULT_CACHE_ENABLED is false.
+    """
+    global _result_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_DB_PATH, RESULT_CACHE_DB_MAX_BYTES)
+        return _result_cache
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Production entry point: serves the Flask application with gunicorn worker processes.
+
+The master process preloads the catalog snapshot and its pre-rendered prompt fragments
+once (app.preload_shared_state()), then forks the workers, which share those pages
+copy-on-write. Each worker opens its own connection pool and starts its own background
+threads after fork, and warms up its catalog index and prompt templates before it
+accepts requests. Cold-start timings are logged and reported under "startup" in
+GET /api/health.
+
+Usage (from the backend directory):
+    python server.py                                  # SERVER_WORKERS workers on SERVER_BIND
+    python server.py --workers 8 --threads 16 --bind 0.0.0.0:5001
+"""
+
+import os
+import time
+import logging
+import argparse
+from gunicorn.app.base import BaseApplication
+import app as backend
+from database import close_connection_pool
+
+logger = logging.getLogger(__name__)
+
+# --- Server Configuration ---
+SERVER_BIND = os.environ.get("SERVER_BIND", "0.0.0.0:5001")
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", str(min(2 * (os.cpu_count() or 1) + 1, 8))))
+# Threads per worker; each request holds one while it waits on Gemini
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "8"))
+# Must exceed the slowest request (both Gemini stage deadlines plus validation)
+SERVER_TIMEOUT_SECONDS = int(os.environ.get("SERVER_TIMEOUT_SECONDS", "90"))
+
+def post_fork(server, worker):
+    """
+    Runs in the worker right after fork(): per-process pool, threads and agents.
+    """
+    worker.forked_at = time.perf_counter()
+    backend.initialize_worker(recover_jobs=False)
+
+def post_worker_init(worker):
+    """
+    Runs once the worker is initialized, before it accepts connections.
+    """
+    backend.warm_up()
+    backend.startup_stats["cold_start_seconds"] = round(time.perf_counter() - worker.forked_at, 3)
+    logger.info("Worker %d ready in %.3fs (preload %.3fs, init %.3fs, warmup %.3fs)",
+                worker.pid, backend.startup_stats["cold_start_seconds"],
+                backend.startup_stats.get("preload_seconds", 0.0),
+                backend.startup_stats.get("worker_init_seconds", 0.0),
+                backend.startup_stats.get("warmup_seconds", 0.0))
+
+def worker_exit(server, worker):
+    """
+    Stops the job queue workers and closes the worker's connection pool.
+    """
+    if backend.job_queue is not None:
+        backend.job_queue.stop(timeout=5)
+    close_connection_pool()
+
+class OrderPipelineServer(BaseApplication):
+    """
+    gunicorn application that preloads shared state in the master process.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # With preload_app this runs once in the master, before any worker is forked
+        backend.preload_shared_state()
+        return backend.app
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the order pipeline with gunicorn worker processes")
+    parser.add_argument("--bind", default=SERVER_BIND)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS)
+    parser.add_argument("--timeout", type=int, default=SERVER_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+
+    OrderPipelineServer({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "timeout": args.timeout,
+        "preload_app": True,
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+    }).run()
+
+if __name__ == "__main__":
+    main()
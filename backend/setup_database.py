@@ -1,18 +1,85 @@
 #!/usr/bin/env python3
 """
 Database setup script for the three-agent pipeline.
-This script creates the products table and populates it with sample data.
+This script applies the versioned schema migrations and checks the products data.
 """
 
 import os
+import time
 import psycopg2
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def create_products_table():
-    """Create the products table if it doesn't exist."""
+# --- Schema Migrations ---
+# Applied in order by apply_migrations(); each version runs once, in its own transaction,
+# and is recorded in schema_migrations. Released migrations must not be edited: add a
+# new version instead.
+MIGRATIONS = [
+    (1, "Create products table", """
+        CREATE TABLE IF NOT EXISTS products (
+            id SERIAL PRIMARY KEY,
+            sku VARCHAR(50) UNIQUE NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            price DECIMAL(10,2) NOT NULL,
+            min_order_qty INTEGER NOT NULL,
+            inventory INTEGER NOT NULL,
+            description TEXT
+        );
+    """),
+    # Reservations hold stock for an order until committed, released or expired
+    (2, "Create inventory reservation tables", """
+        CREATE TABLE IF NOT EXISTS reservations (
+            id VARCHAR(32) PRIMARY KEY,
+            status VARCHAR(16) NOT NULL DEFAULT 'held',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reservation_items (
+            reservation_id VARCHAR(32) NOT NULL REFERENCES reservations(id) ON DELETE CASCADE,
+            sku VARCHAR(50) NOT NULL REFERENCES products(sku),
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            PRIMARY KEY (reservation_id, sku)
+        );
+        CREATE INDEX IF NOT EXISTS reservations_held_expires_at_idx
+            ON reservations (expires_at) WHERE status = 'held';
+    """),
+    # Bumped by catalog_ingest.py whenever the catalog changes
+    (3, "Create catalog version table", """
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """),
+    # unaccent() is only STABLE, so it is wrapped in an IMMUTABLE function that pins the
+    # dictionary and search_path; that makes it usable in a generated column
+    (4, "Add normalized product name column", """
+        CREATE EXTENSION IF NOT EXISTS unaccent;
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE OR REPLACE FUNCTION normalize_product_name(text) RETURNS text
+            LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+            SET search_path = public, extensions
+            AS $$ SELECT btrim(regexp_replace(lower(unaccent('unaccent', $1)), '[^[:alnum:]]+', ' ', 'g')) $$;
+        ALTER TABLE products ADD COLUMN IF NOT EXISTS name_normalized TEXT
+            GENERATED ALWAYS AS (normalize_product_name(name)) STORED;
+    """),
+    (5, "Add trigram indexes on product names", """
+        CREATE INDEX IF NOT EXISTS products_name_trgm_idx
+            ON products USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS products_name_normalized_trgm_idx
+            ON products USING gin (name_normalized gin_trgm_ops);
+        ANALYZE products;
+    """),
+]
+
+# Arbitrary key for the advisory lock that serializes concurrent migration runs
+MIGRATION_LOCK_ID = 7410021
+
+def apply_migrations():
+    """Apply all pending schema migrations in version order."""
+    conn = None
     try:
         conn = psycopg2.connect(
             host=os.environ.get("HOST"),
@@ -23,24 +90,38 @@ def create_products_table():
         )
         
         with conn.cursor() as cur:
-            # Create products table
-            create_table_query = """
-            CREATE TABLE IF NOT EXISTS products (
-                id SERIAL PRIMARY KEY,
-                sku VARCHAR(50) UNIQUE NOT NULL,
-                name VARCHAR(255) NOT NULL,
-                price DECIMAL(10,2) NOT NULL,
-                min_order_qty INTEGER NOT NULL,
-                inventory INTEGER NOT NULL,
-                description TEXT
+            # Held for the session, so two deploys cannot apply the same migration twice
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
             );
-            """
-            cur.execute(create_table_query)
+            """)
             conn.commit()
-            print("✅ Products table created successfully!")
+            
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+            
+            for version, description, migration_sql in MIGRATIONS:
+                if version in applied:
+                    continue
+                started_at = time.perf_counter()
+                cur.execute(migration_sql)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                print(f"✅ Migration {version} applied: {description} ({time.perf_counter() - started_at:.2f}s)")
+            
+            print(f"✅ Database schema is at version {MIGRATIONS[-1][0]}")
+            return True
             
     except Exception as e:
-        print(f"❌ Error creating table: {e}")
+        print(f"❌ Error applying migrations: {e}")
+        return False
     finally:
         if conn:
             conn.close()
@@ -110,8 +191,9 @@ if __name__ == "__main__":
     if not check_database_connection():
         exit(1)
     
-    # Create table
-    create_products_table()
+    # Create or upgrade tables
+    if not apply_migrations():
+        exit(1)
     
     # Check if data exists
     has_data = check_products_data()
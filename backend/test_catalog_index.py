@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Name resolution test for the in-memory product index (catalog_index.ProductNameIndex).
+Checks that exact names, partial mentions and misspelled category words resolve, and
+that product variants which do not exist, other categories and ambiguous mentions are
+not found. Runs against the catalog CSV; needs no database.
+"""
+
+from benchmarks.fakes import load_csv_catalog
+from catalog_index import ProductNameIndex
+from database import PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN
+
+INDEX = ProductNameIndex(load_csv_catalog())
+
+def resolve(mention):
+    product, _ = INDEX.best_match(mention, PRODUCT_MATCH_MIN_SCORE, PRODUCT_MATCH_MIN_MARGIN)
+    return product["sku"] if product else None
+
+def test_resolves_known_products():
+    """Exact, folded, partial and SKU mentions resolve to the right product."""
+    print("🔍 Test 1: Known products resolve...")
+    cases = {
+        "Desk TRÄNHOLM 19": "DSK-0001",
+        "desk tranholm 19": "DSK-0001",
+        "TRÄNHOLM 19": "DSK-0001",
+        "Desk TRÄNHOLM": "DSK-0001",
+        "NORDMARK 476": "DSK-0002",
+        "DSK-0004": "DSK-0004",
+    }
+    for mention, sku in cases.items():
+        assert resolve(mention) == sku, f"{mention!r} resolved to {resolve(mention)}, expected {sku}"
+    print(f"   ✅ {len(cases)} mentions resolved")
+
+def test_rejects_unknown_variants():
+    """Variants that do not exist never resolve to a sibling product."""
+    print("🔍 Test 2: Unknown variants are not found...")
+    for mention in ("Desk TRÄNHOLM 20", "Desk NORDMARK 999", "Chair NORDMARK 476", "Desk LUNDMARK 476"):
+        assert resolve(mention) is None, f"{mention!r} resolved to {resolve(mention)}"
+    print("   ✅ 4 unknown variants not found")
+
+def test_rejects_ambiguous_mentions():
+    """A bare category and a name shared by several products are ambiguous."""
+    print("🔍 Test 3: Ambiguous mentions are not found...")
+    assert resolve("Desk") is None
+    index = ProductNameIndex({
+        "AAA-0001": {"name": "Lamp FJORD 1", "price": 1.0, "min_order_qty": 1, "inventory": 1},
+        "AAA-0002": {"name": "Lamp FJORD 1", "price": 2.0, "min_order_qty": 1, "inventory": 1},
+    })
+    assert [product["sku"] for product, _ in index.search("Lamp FJORD 1")] == ["AAA-0001", "AAA-0002"]
+    assert index.best_match("Lamp FJORD 1")[0] is None
+    print("   ✅ bare category and duplicate name not resolved")
+
+if __name__ == "__main__":
+    print("🚀 Product name index test")
+    print()
+    test_resolves_known_products()
+    test_rejects_unknown_variants()
+    test_rejects_ambiguous_mentions()
+    print()
+    print("✅ All product name index tests passed!")
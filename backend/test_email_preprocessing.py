@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Behavior test for the email pre-processing stage (email_preprocessing.EmailPreprocessor).
+Checks that quoted replies, forwarded headers, signatures and legal footers are removed,
+and that order lines, delivery notes and postscripts that merely resemble them survive.
+Needs no database or API key.
+"""
+
+from email_preprocessing import EmailPreprocessor
+
+PREPROCESSOR = EmailPreprocessor()
+
+SIGNATURE = "Jordan Meyer\nHead of Purchasing | Meyer Office Supplies GmbH\nTel: +49 30 1234 5678\nwww.meyer-office.example"
+FOOTER = (
+    "CONFIDENTIALITY NOTICE: This e-mail and any attachments are confidential and intended solely "
+    "for the use of the named recipient. If you have received this message in error, please notify the sender.\n\n"
+    "Please consider the environment before printing this e-mail."
+)
+
+def process(email):
+    return PREPROCESSOR.process(email)[0]
+
+def test_keeps_order_content_that_looks_like_noise():
+    """Footer phrases, From:/Date: lines and title-case notes in the body are kept."""
+    print("🔍 Test 1: Order content resembling noise survives...")
+    cases = {
+        "Hi,\n\nIf you have received the catalog, please send 10 x DSK-0004.\n\nThanks,\nJohn": "10 x DSK-0004",
+        "Hi,\n\nplease send 2 x DSK-0004.\n\nThis is not a disclaimer, just add 5 chairs too.": "just add 5 chairs too",
+        "We need 5 desks.\nFrom: Building A\nDate: next Monday please\nThanks": "Date: next Monday please",
+        "Please send 2 x DSK-0004\nThanks\nWarehouse Team\nAlso Need Chairs": "Also Need Chairs",
+        "Please send 2 x DSK-0004\n\nThanks,\nJordan\nP.S. Please deliver to the loading dock.": "P.S. Please deliver to the loading dock.",
+        "Please send 2 x DSK-0004\n\nBest regards,\nJordan Meyer\nSend 5 More": "Send 5 More",
+    }
+    for email, kept in cases.items():
+        text = process(email)
+        assert kept in text, f"{kept!r} was removed: {text!r}"
+    print(f"   ✅ {len(cases)} emails kept their order content")
+
+def test_removes_quoted_replies():
+    """Gmail and Outlook reply history is cut, the new message is kept."""
+    print("🔍 Test 2: Quoted replies are removed...")
+    gmail = ("Please add 3 x DSK-0002\n\nOn Mon, Jun 3, 2024 at 9:12 AM Sales <sales@example.com> wrote:\n"
+             "> Your order 4 x DSK-0009 has shipped.")
+    outlook = ("Please add 3 x DSK-0002\n\nFrom: Sales <sales@example.com>\nSent: Monday, June 3, 2024 9:12 AM\n"
+               "To: Jordan Meyer <jordan@example.com>\nSubject: RE: Order\n\nYour order 4 x DSK-0009 has shipped.")
+    quoted_only = "On Tue, Jun 4, 2024 at 10:02 AM Alex <alex@example.com> wrote:\n> Hi,\n> 2 x DSK-0004\n> Thanks"
+    assert process(gmail) == "Please add 3 x DSK-0002"
+    assert process(outlook) == "Please add 3 x DSK-0002"
+    assert "2 x DSK-0004" in process(quoted_only) and "wrote:" not in process(quoted_only)
+    print("   ✅ Gmail and Outlook history removed, quoted-only order kept")
+
+def test_keeps_forwarded_body():
+    """Forward separators and their headers are removed, the forwarded order is kept."""
+    print("🔍 Test 3: Forwarded body is kept...")
+    email = ("FYI, see below.\n\n---------- Forwarded message ---------\nFrom: Alex Schmidt <alex@example.com>\n"
+             "Date: Tue, Jun 4, 2024 at 10:02 AM\nSubject: Order\nTo: Jordan <jordan@example.com>\n\n"
+             "Hi Jordan,\n\nplease order:\n2 x DSK-0004\n\nCheers,\nAlex")
+    text = process(email)
+    assert "2 x DSK-0004" in text and "Forwarded message" not in text and "Subject:" not in text, text
+    print("   ✅ forwarded order kept without its headers")
+
+def test_removes_signatures_and_footers():
+    """Real signatures, mobile signatures and trailing legal footers are removed."""
+    print("🔍 Test 4: Signatures and footers are removed...")
+    email = f"Please send 2 x DSK-0004\n\nBest regards,\n{SIGNATURE}\n\n{FOOTER}"
+    assert process(email) == "Please send 2 x DSK-0004\n\nBest regards,", process(email)
+    email = f"Please send 2 x DSK-0004\n\nKind regards,\n\n-- \n{SIGNATURE}\n\n{FOOTER}"
+    assert process(email) == "Please send 2 x DSK-0004\n\nKind regards,", process(email)
+    assert process("Need 2 x DSK-0004 asap\n\nSent from my iPhone") == "Need 2 x DSK-0004 asap"
+    print("   ✅ signature, delimiter signature, mobile signature and footer removed")
+
+if __name__ == "__main__":
+    print("🚀 Email pre-processing test")
+    print()
+    test_keeps_order_content_that_looks_like_noise()
+    test_removes_quoted_replies()
+    test_keeps_forwarded_body()
+    test_removes_signatures_and_footers()
+    print()
+    print("✅ All email pre-processing tests passed!")
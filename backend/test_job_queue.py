@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Recovery test for the SQLite job queue (job_queue.JobQueue).
+Checks that a queue starting next to a live one leaves the jobs it is running alone,
+and that jobs whose lease expired (their process died) are queued again and completed.
+Uses a temporary SQLite file; needs no database or API key.
+"""
+
+import os
+import time
+import tempfile
+import threading
+from job_queue import JobQueue, open_job_database
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_live_lease_survives_second_queue():
+    """A second queue starting on the same file does not requeue a leased running job."""
+    print("🔍 Test 1: Live lease survives a second queue starting...")
+    release = threading.Event()
+    calls = []
+
+    def slow_handler(email_content):
+        calls.append(email_content)
+        release.wait(5)
+        return {"email": email_content}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "jobs.sqlite3")
+        first = JobQueue(slow_handler, path, workers=1, lease_seconds=30)
+        first.start()
+        job_id = first.submit("2 x Desk")
+        assert wait_for(lambda: first.get(job_id)["status"] == "running")
+
+        second = JobQueue(slow_handler, path, workers=1, lease_seconds=30)
+        second.start()
+        try:
+            assert second.stats()["recovered"] == 0, "live job was requeued at startup"
+            time.sleep(0.2)
+            assert first.get(job_id)["status"] == "running" and len(calls) == 1
+            release.set()
+            assert wait_for(lambda: first.get(job_id)["status"] == "done")
+            assert first.get(job_id)["attempts"] == 1 and len(calls) == 1
+        finally:
+            release.set()
+            second.stop(5)
+            first.stop(5)
+    print("   ✅ job ran once with 1 attempt")
+
+def test_expired_lease_is_recovered():
+    """A running job whose lease expired (its process died) is requeued at startup."""
+    print("🔍 Test 2: Expired lease is recovered at startup...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "jobs.sqlite3")
+        db = open_job_database(path)
+        db.execute(
+            "INSERT INTO jobs (id, status, email_content, attempts, enqueued_at, started_at, lease_expires_at) "
+            "VALUES ('crashed', 'running', '2 x Desk', 1, ?, ?, ?)",
+            (time.time() - 120, time.time() - 120, time.time() - 60)
+        )
+        db.commit()
+        db.close()
+
+        queue = JobQueue(lambda email_content: {"email": email_content}, path, workers=1, lease_seconds=30)
+        queue.start()
+        try:
+            assert queue.stats()["recovered"] == 1
+            assert wait_for(lambda: queue.get("crashed")["status"] == "done")
+            assert queue.get("crashed")["attempts"] == 2
+        finally:
+            queue.stop(5)
+    print("   ✅ crashed job requeued and completed on its second attempt")
+
+if __name__ == "__main__":
+    print("🚀 Job queue recovery test")
+    print()
+    test_live_lease_survives_second_queue()
+    test_expired_lease_is_recovered()
+    print()
+    print("✅ All job queue tests passed!")
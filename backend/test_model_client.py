@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Fault-injection test for the Gemini call wrapper (model_client.ResilientModel).
+Runs against FakeGenerativeModel with injected latency and failures and checks deadlines,
+retries, hedging and the circuit breaker on the synchronous, async and streaming paths.
+Needs no API key or database.
+"""
+
+import time
+import asyncio
+import logging
+import pytest
+from benchmarks.fakes import FakeGenerativeModel, FakeResponse
+from model_client import ResilientModel, CircuitBreaker, ModelCallTimeout, CircuitOpenError
+
+# Retry warnings are expected here
+logging.getLogger("model_client").setLevel(logging.ERROR)
+
+PROMPT = "**Email Content:**\n---\n2 x Desk\n---"
+
+def make_model(fake, **options):
+    options.setdefault("backoff_seconds", 0.01)
+    options.setdefault("hedge", False)
+    return ResilientModel(fake, "extraction", breaker=CircuitBreaker(100, 60), **options)
+
+def open_circuit(model):
+    """Fails calls until the model's breaker opens; the fake must fail every call."""
+    for _ in range(model.breaker.failure_threshold):
+        with pytest.raises(ConnectionError):
+            model.generate_content(PROMPT)
+    assert model.breaker.stats()["state"] == "open"
+
+def test_deadline():
+    """A hung call is abandoned at the stage deadline."""
+    print("🔍 Test 1: Deadline on a hung call...")
+    model = make_model(FakeGenerativeModel(slow_rate=1.0, slow_latency=2.0), deadline_seconds=0.3, max_retries=0)
+    started_at = time.perf_counter()
+    try:
+        model.generate_content(PROMPT)
+        timed_out = False
+    except ModelCallTimeout:
+        timed_out = True
+    elapsed = time.perf_counter() - started_at
+    assert timed_out and elapsed < 0.6, f"timed out: {timed_out} after {elapsed:.2f}s"
+    print(f"   ✅ timed out after {elapsed:.2f}s")
+
+def test_retries():
+    """Transient failures are retried; other errors are raised at once."""
+    print("🔍 Test 2: Retries on transient failures...")
+    fake = FakeGenerativeModel(failure_rate=0.3, seed=3)
+    model = make_model(fake, max_retries=8)
+    succeeded = sum(1 for _ in range(50) if model.generate_content(PROMPT).text)
+    assert succeeded == 50 and fake.calls > 50, f"{succeeded}/50 succeeded in {fake.calls} calls"
+
+    fake = FakeGenerativeModel(failure_rate=1.0, failure=ValueError)
+    model = make_model(fake, max_retries=5)
+    with pytest.raises(ValueError):
+        model.generate_content(PROMPT)
+    assert fake.calls == 1, f"non-transient error attempted {fake.calls} times"
+    print(f"   ✅ {succeeded}/50 succeeded with 30% injected failures, non-transient error attempts: {fake.calls}")
+
+def test_hedging():
+    """Hedged requests cut the tail caused by occasional slow calls."""
+    print("🔍 Test 3: Hedging against slow outliers...")
+    results = {}
+    for hedge in (False, True):
+        fake = FakeGenerativeModel(latency=0.01, slow_rate=0.1, slow_latency=0.5, seed=7)
+        model = make_model(fake, hedge=hedge, hedge_quantile=0.8, hedge_min_seconds=0.02, hedge_min_samples=10)
+        latencies = []
+        for index in range(110):
+            started_at = time.perf_counter()
+            model.generate_content(PROMPT)
+            # The first calls only warm up the latency window
+            if index >= 10:
+                latencies.append(time.perf_counter() - started_at)
+        latencies.sort()
+        results[hedge] = (latencies[int(0.95 * len(latencies))], fake.calls)
+    (plain_p95, plain_calls), (hedged_p95, hedged_calls) = results[False], results[True]
+    assert hedged_p95 < plain_p95 / 2, f"p95 {plain_p95 * 1000:.0f} ms -> {hedged_p95 * 1000:.0f} ms"
+    print(f"   ✅ p95 {plain_p95 * 1000:.0f} ms -> {hedged_p95 * 1000:.0f} ms "
+          f"({plain_calls} -> {hedged_calls} model calls)")
+
+def test_circuit_breaker():
+    """A failing upstream opens the circuit, calls fail fast, and a trial call closes it."""
+    print("🔍 Test 4: Circuit breaker...")
+    fake = FakeGenerativeModel(latency=0.05, failure_rate=1.0)
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=0.3)
+    model = ResilientModel(fake, "response", breaker=breaker, max_retries=0, hedge=False)
+    open_circuit(model)
+    started_at = time.perf_counter()
+    with pytest.raises(CircuitOpenError):
+        model.generate_content(PROMPT)
+    assert time.perf_counter() - started_at < 0.01
+    assert fake.calls == 3, f"{fake.calls - 3} upstream calls while open"
+
+    time.sleep(0.35)
+    fake.failure_rate = 0.0
+    assert model.generate_content(PROMPT).text is not None
+    assert breaker.stats()["state"] == "closed"
+    print("   ✅ failed fast while open, closed after the trial call")
+
+def test_async():
+    """The async path honours deadlines and hedging as well."""
+    print("🔍 Test 5: Async deadline and hedging...")
+
+    async def run():
+        model = make_model(FakeGenerativeModel(slow_rate=1.0, slow_latency=2.0), deadline_seconds=0.3, max_retries=0)
+        started_at = time.perf_counter()
+        try:
+            await model.generate_content_async(PROMPT)
+            timed_out = False
+        except ModelCallTimeout:
+            timed_out = True
+        timeout_elapsed = time.perf_counter() - started_at
+
+        fake = FakeGenerativeModel(latency=0.01, slow_rate=0.1, slow_latency=0.5, seed=7)
+        model = make_model(fake, hedge=True, hedge_quantile=0.8, hedge_min_seconds=0.02, hedge_min_samples=10)
+        slowest = 0.0
+        for index in range(60):
+            started_at = time.perf_counter()
+            await model.generate_content_async(PROMPT)
+            if index >= 10:
+                slowest = max(slowest, time.perf_counter() - started_at)
+        return timed_out, timeout_elapsed, slowest
+
+    timed_out, timeout_elapsed, slowest = asyncio.run(run())
+    assert timed_out and timeout_elapsed < 0.6, f"timed out: {timed_out} after {timeout_elapsed:.2f}s"
+    assert slowest < 0.3, f"slowest hedged call {slowest * 1000:.0f} ms"
+    print(f"   ✅ timed out after {timeout_elapsed:.2f}s, slowest hedged call {slowest * 1000:.0f} ms")
+
+def test_interrupted_trial():
+    """A cancelled or closed trial reopens the circuit instead of leaving it shut."""
+    print("🔍 Test 6: Cancelled and closed trial calls...")
+    fake = FakeGenerativeModel(latency=0.01, failure_rate=1.0)
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.1)
+    model = ResilientModel(fake, "response", breaker=breaker, max_retries=0, hedge=False)
+
+    async def cancel_trial():
+        fake.failure_rate, fake.latency = 0.0, 1.0
+        task = asyncio.ensure_future(model.generate_content_async(PROMPT))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    open_circuit(model)
+    time.sleep(0.15)
+    asyncio.run(cancel_trial())
+    assert breaker.stats()["state"] == "open", "cancelled trial did not reopen the circuit"
+
+    fake.latency = 0.01
+    time.sleep(0.15)
+    stream = model.generate_content(PROMPT, stream=True)
+    next(stream)
+    stream.close()
+    assert breaker.stats()["state"] == "open", "closed trial stream did not reopen the circuit"
+
+    time.sleep(0.15)
+    assert "".join(chunk.text for chunk in model.generate_content(PROMPT, stream=True))
+    assert breaker.stats()["state"] == "closed"
+    print("   ✅ cancelled and closed trials reopened the circuit, a finished stream closed it")
+
+def test_non_transient_trial():
+    """A non-transient error neither closes a half-open circuit nor blocks the next trial."""
+    print("🔍 Test 7: Non-transient error during the trial...")
+    fake = FakeGenerativeModel(latency=0.01, failure_rate=1.0)
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.1)
+    model = ResilientModel(fake, "response", breaker=breaker, max_retries=0, hedge=False)
+    open_circuit(model)
+    time.sleep(0.15)
+
+    fake.failure = ValueError
+    with pytest.raises(ValueError):
+        model.generate_content(PROMPT)
+    assert breaker.stats()["state"] == "half_open", "non-transient error closed the circuit"
+
+    fake.failure_rate = 0.0
+    assert model.generate_content(PROMPT).text is not None
+    assert breaker.stats()["state"] == "closed"
+    print("   ✅ circuit stayed half-open and the next trial closed it")
+
+class StalledStreamModel:
+    """Streams one chunk, then never sends the next."""
+
+    def generate_content(self, prompt, stream=False):
+        yield FakeResponse("Dear Customer,")
+        time.sleep(2.0)
+        yield FakeResponse(" thank you.")
+
+def test_stream_deadline():
+    """A stalled stream is abandoned at the stage deadline."""
+    print("🔍 Test 8: Deadline on a stalled stream...")
+    model = ResilientModel(StalledStreamModel(), "response", breaker=CircuitBreaker(100, 60), deadline_seconds=0.3)
+    started_at = time.perf_counter()
+    chunks = []
+    with pytest.raises(ModelCallTimeout):
+        for chunk in model.generate_content(PROMPT, stream=True):
+            chunks.append(chunk.text)
+    elapsed = time.perf_counter() - started_at
+    assert chunks == ["Dear Customer,"] and elapsed < 0.6, f"{chunks} after {elapsed:.2f}s"
+    assert model.breaker.stats()["consecutive_failures"] == 1
+    print(f"   ✅ timed out after the first chunk at {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    print("🚀 Gemini call wrapper fault-injection test")
+    print()
+    test_deadline()
+    test_retries()
+    test_hedging()
+    test_circuit_breaker()
+    test_async()
+    test_interrupted_trial()
+    test_non_transient_trial()
+    test_stream_deadline()
+    print()
+    print("✅ All model call tests passed!")
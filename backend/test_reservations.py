@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for atomic inventory reservations.
+Hammers two dedicated test products from many threads and verifies that stock is never
+oversold, that releases restore stock exactly once and that expired reservations are
+returned to inventory. Requires the database from setup_database.py (including the
+reservation tables); the test products are removed afterwards.
+"""
+
+import time
+import random
+import threading
+from dotenv import load_dotenv
+from database import get_database_connection, close_connection_pool
+from reservations import reserve_inventory, release_reservation, commit_reservation, get_reservation, expire_reservations
+
+# Load environment variables
+load_dotenv()
+
+TEST_PRODUCTS = {"STRESS-0001": 30, "STRESS-0002": 50}
+THREADS = 64
+ATTEMPTS_PER_THREAD = 25
+
+def set_up_products():
+    with get_database_connection() as connection:
+        with connection.cursor() as cursor:
+            for sku, inventory in TEST_PRODUCTS.items():
+                cursor.execute(
+                    """
+                    INSERT INTO products (sku, name, price, min_order_qty, inventory)
+                    VALUES (%s, %s, 1.00, 1, %s)
+                    ON CONFLICT (sku) DO UPDATE SET inventory = EXCLUDED.inventory
+                    """,
+                    (sku, f"Stress Test Item {sku}", inventory)
+                )
+        connection.commit()
+
+def clean_up_products():
+    with get_database_connection() as connection:
+        with connection.cursor() as cursor:
+            skus = list(TEST_PRODUCTS)
+            cursor.execute(
+                "DELETE FROM reservations WHERE id IN (SELECT reservation_id FROM reservation_items WHERE sku = ANY(%s))",
+                (skus,)
+            )
+            cursor.execute("DELETE FROM products WHERE sku = ANY(%s)", (skus,))
+        connection.commit()
+
+def get_inventory():
+    with get_database_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sku, inventory FROM products WHERE sku = ANY(%s)", (list(TEST_PRODUCTS),))
+            return dict(cursor.fetchall())
+
+def check_no_overselling():
+    """Many threads reserve overlapping multi-item orders on the same hot SKUs."""
+    print(f"🔍 Test 1: {THREADS} threads x {ATTEMPTS_PER_THREAD} reservation attempts on hot SKUs...")
+    reserved = {sku: 0 for sku in TEST_PRODUCTS}
+    reservations = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(ATTEMPTS_PER_THREAD):
+            # Items in random order: reserve_inventory must lock in SKU order regardless
+            items = [(sku, rng.randint(1, 3)) for sku in TEST_PRODUCTS if rng.random() < 0.7] or [("STRESS-0001", 1)]
+            rng.shuffle(items)
+            try:
+                reservation, _ = reserve_inventory(items)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            if reservation:
+                with lock:
+                    reservations.append(reservation["reservation_id"])
+                    for sku, quantity in reservation["items"].items():
+                        reserved[sku] += quantity
+
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    inventory = get_inventory()
+    attempts = THREADS * ATTEMPTS_PER_THREAD
+    print(f"   {attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s), {len(reservations)} held, {len(errors)} errors")
+    ok = not errors
+    for sku, initial in TEST_PRODUCTS.items():
+        consistent = inventory[sku] >= 0 and inventory[sku] + reserved[sku] == initial
+        ok = ok and consistent
+        print(f"   {'✅' if consistent else '❌'} {sku}: initial {initial}, reserved {reserved[sku]}, remaining {inventory[sku]}")
+    for error in errors[:5]:
+        print(f"   ❌ {error}")
+    return ok, reservations
+
+def check_release_exactly_once(reservation_ids):
+    """Every reservation is released twice concurrently; stock must be restored once."""
+    print("🔍 Test 2: Releasing every reservation twice concurrently...")
+    released = []
+    lock = threading.Lock()
+
+    def worker(reservation_id):
+        if release_reservation(reservation_id):
+            with lock:
+                released.append(reservation_id)
+
+    threads = [threading.Thread(target=worker, args=(rid,)) for rid in reservation_ids for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    inventory = get_inventory()
+    ok = len(released) == len(reservation_ids) and inventory == TEST_PRODUCTS
+    print(f"   {'✅' if ok else '❌'} {len(released)} of {len(reservation_ids)} released, inventory {inventory}")
+    return ok
+
+def check_expiry():
+    """Expired reservations return their stock and can no longer be committed."""
+    print("🔍 Test 3: Reservation expiry...")
+    reservation, _ = reserve_inventory([("STRESS-0001", 5)], ttl_seconds=1)
+    if reservation is None:
+        print("   ❌ Could not reserve stock")
+        return False
+    time.sleep(2)
+    expire_reservations()
+    status = get_reservation(reservation["reservation_id"])["status"]
+    inventory = get_inventory()["STRESS-0001"]
+    committed = commit_reservation(reservation["reservation_id"])
+    ok = status == "expired" and inventory == TEST_PRODUCTS["STRESS-0001"] and not committed
+    print(f"   {'✅' if ok else '❌'} status {status}, inventory {inventory}, late commit accepted: {committed}")
+    return ok
+
+if __name__ == "__main__":
+    print("🚀 Inventory reservation stress test")
+    print()
+    try:
+        set_up_products()
+        results = []
+        ok, reservation_ids = check_no_overselling()
+        results.append(ok)
+        results.append(check_release_exactly_once(reservation_ids))
+        results.append(check_expiry())
+        print()
+        print("✅ All reservation tests passed!" if all(results) else "❌ Some reservation tests failed")
+    except Exception as e:
+        print(f"❌ Reservation test failed: {e}")
+    finally:
+        clean_up_products()
+        close_connection_pool()
@@ -0,0 +1,103 @@
+import os
+import logging
+from dotenv import load_dotenv
+from metrics import PROMPT_COMPONENT_TOKENS, PROMPT_BUDGET_OVERRUNS, PROMPT_COMPACTIONS
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Token Budget Configuration ---
+# Estimated prompt tokens allowed per LLM stage before the prompt is compacted
+PROMPT_TOKEN_BUDGETS = {
+    "extraction": int(os.environ.get("EXTRACTION_PROMPT_TOKEN_BUDGET", "6000")),
+    "response": int(os.environ.get("RESPONSE_PROMPT_TOKEN_BUDGET", "3000")),
+}
+
+def estimate_tokens(text):
+    """
+    Rough token estimate for Gemini prompts (about four characters per token).
+    """
+    return (len(text) + 3) // 4
+
+def drop_indentation(prompt):
+    """
+    Removes leading whitespace from every line and blank lines from a prompt.
+    """
+    return "\n".join(line.strip() for line in prompt.splitlines() if line.strip())
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cuts text to about max_tokens estimated tokens, marking the cut.
+    """
+    max_chars = max(max_tokens, 0) * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 20, 0)].rstrip() + "\n[... truncated]"
+
+class PromptBudget:
+    """
+    Token accounting and compaction bookkeeping for one prompt of one LLM stage.
+    The agent estimates tokens for each prompt component, compacts step by step while the
+    prompt is over budget, and finally calls record() to store the accounting under
+    metadata["tokens"][stage] and in the metrics. The compaction level is the most
+    aggressive level applied (0 = none); the individual steps are listed as well.
+    """
+
+    def __init__(self, stage, budget=None):
+        self.stage = stage
+        self.budget = budget or PROMPT_TOKEN_BUDGETS[stage]
+        self.initial_tokens = None
+        self.level = 0
+        self.steps = []
+
+    def fits(self, prompt):
+        """
+        Returns True if the prompt is within budget; remembers the size of the first
+        (uncompacted) prompt checked.
+        """
+        tokens = estimate_tokens(prompt)
+        if self.initial_tokens is None:
+            self.initial_tokens = tokens
+        return tokens <= self.budget
+
+    def compacted(self, level, step):
+        """
+        Records a compaction step (e.g. "catalog_top_10", "drop_indentation") of the given level.
+        """
+        self.level = max(self.level, level)
+        self.steps.append(step)
+
+    def record(self, prompt, components, metadata=None):
+        """
+        Records the final prompt size, tokens per component (the rest of the prompt is
+        counted as "instructions"), budget overrun and compaction level.
+        Returns the accounting dictionary.
+        """
+        total = estimate_tokens(prompt)
+        components = dict(components)
+        components["instructions"] = max(total - sum(components.values()), 0)
+        over_budget = (self.initial_tokens if self.initial_tokens is not None else total) > self.budget
+
+        for component, tokens in components.items():
+            PROMPT_COMPONENT_TOKENS.inc(tokens, self.stage, component)
+        if over_budget:
+            PROMPT_BUDGET_OVERRUNS.inc(1, self.stage)
+            logger.info("%s prompt over budget (%d > %d tokens), compacted to %d tokens (level %d: %s)",
+                        self.stage, self.initial_tokens, self.budget, total, self.level, ", ".join(self.steps))
+        PROMPT_COMPACTIONS.inc(1, self.stage, str(self.level))
+
+        accounting = {
+            "components": components,
+            "total": total,
+            "budget": self.budget,
+            "over_budget": over_budget,
+            "uncompacted_total": self.initial_tokens if self.initial_tokens is not None else total,
+            "compaction_level": self.level,
+            "compaction": list(self.steps),
+            "within_budget": total <= self.budget
+        }
+        if metadata is not None:
+            metadata.setdefault("tokens", {})[self.stage] = accounting
+        return accounting